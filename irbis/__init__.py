@@ -16,31 +16,43 @@ from irbis._common import ADMINISTRATOR, BRIEF, CATALOGER, close_async, \
 
 from irbis.alphabet import AlphabetTable, load_alphabet_table, \
     UpperCaseTable, load_uppercase_table
+from irbis.batch import RecordBatch
+from irbis.codec import iter_binary_records, read_binary_record, \
+    write_binary_record
 from irbis.database import DatabaseInfo
 from irbis.direct import DirectAccess, InvertedFile, MstControl, MstField,\
     MstFile, MstEntry, MstLeader, MstRecord, XrfFile, XrfRecord
 from irbis.error import IrbisError, IrbisFileNotFoundError
 from irbis.export import read_iso_record, read_text_record, STOP_MARKER, \
     write_iso_record, write_text_record
+from irbis.federated import FederatedResult, FederatedSearch, \
+    SearchTarget, TargetResult
 from irbis.ini import IniFile, IniLine, IniSection
+from irbis.local_search import LocalSearch
 from irbis.menus import load_menu, MenuEntry, MenuFile
 from irbis.opt import load_opt_file, OptFile
 from irbis.par import load_par_file, ParFile
+from irbis.pft import compile_format, CompiledFormat, local_format, \
+    LocalFormat
 from irbis.process import Process
 from irbis.query import ClientQuery
-from irbis.records import Field, RawRecord, Record, SubField
+from irbis.records import CompactRecord, Field, LazyRecord, RawRecord, \
+    Record, SubField
 from irbis.resource import Resource, ResourceDictionary
 from irbis.response import ServerResponse
-from irbis.search import CellResult, FoundLine, SearchParameters, \
-    SearchScenario, TextParameters, TextResult
+from irbis.routing import READ_COMMANDS, Replica, RoutingConnection
+from irbis.search import CellResult, FoundLine, PreparedSearch, \
+    SearchParameters, SearchScenario, SearchTemplate, TextParameters, \
+    TextResult
 from irbis.specification import FileSpecification
 from irbis.stats import ClientInfo, ServerStat
 from irbis.table import TableDefinition
-from irbis.terms import PostingParameters, TermInfo, TermParameters, \
-    TermPosting
+from irbis.terms import PostingList, PostingParameters, TermInfo, \
+    TermList, TermPager, TermParameters, TermPosting
 from irbis.tree import load_tree_file, TreeFile, TreeNode
 from irbis.user import UserInfo
 from irbis.version import ServerVersion
+from irbis.writing import RecordResult, WriteResult
 
 from irbis.connection import Connection
 
@@ -59,21 +71,33 @@ __copyright__ = 'Copyright 2018-2021 Alexey Mironov'
 
 __all__ = ['ADMINISTRATOR', 'AlphabetTable', 'BRIEF', 'CATALOGER',
            'CellResult', 'ClientInfo', 'ClientQuery', 'close_async',
-           'Connection', 'DatabaseInfo', 'DirectAccess', 'irbis_event_loop',
-           'IrbisError', 'IrbisFileNotFoundError', 'Field',
+           'compile_format', 'CompiledFormat', 'CompactRecord', 'Connection',
+           'DatabaseInfo',
+           'DirectAccess', 'irbis_event_loop',
+           'IrbisError', 'IrbisFileNotFoundError', 'FederatedResult',
+           'FederatedSearch', 'Field',
            'FileSpecification', 'FoundLine', 'IniFile', 'IniLine',
-           'IniSection', 'init_async', 'InvertedFile',
+           'IniSection', 'init_async', 'InvertedFile', 'iter_binary_records',
+           'LazyRecord',
            'load_alphabet_table', 'load_menu', 'load_opt_file',
            'load_par_file', 'load_tree_file', 'load_uppercase_table',
+           'local_format', 'LocalFormat', 'LocalSearch',
            'LAST', 'LOCKED', 'LOGICALLY_DELETED', 'MenuEntry',
            'MenuFile', 'MstControl', 'MstField', 'MstFile',
            'MstEntry', 'MstLeader', 'MstRecord', 'NON_ACTUALIZED',
            'NOT_CONNECTED', 'OptFile', 'ParFile', 'PHYSICALLY_DELETED',
-           'PostingParameters', 'prepare_format', 'Process', 'RawRecord',
-           'read_iso_record', 'read_text_record', 'Record', 'remove_comments',
-           'Resource', 'ResourceDictionary', 'SearchParameters',
-           'SearchScenario', 'ServerResponse', 'ServerStat', 'ServerVersion',
-           'STOP_MARKER', 'SubField', 'TableDefinition', 'TermInfo',
-           'TermParameters', 'TextResult', 'TermPosting', 'TextParameters',
-           'TreeFile', 'TreeNode', 'UpperCaseTable', 'UserInfo',
-           'write_iso_record', 'write_text_record', 'XrfFile', 'XrfRecord']
+           'PostingList', 'PostingParameters', 'prepare_format',
+           'PreparedSearch', 'Process', 'RawRecord', 'READ_COMMANDS',
+           'read_binary_record', 'read_iso_record', 'read_text_record',
+           'Record', 'RecordBatch', 'RecordResult',
+           'remove_comments', 'Replica', 'Resource', 'ResourceDictionary',
+           'RoutingConnection',
+           'SearchParameters', 'SearchScenario', 'SearchTarget',
+           'SearchTemplate', 'ServerResponse', 'ServerStat',
+           'ServerVersion', 'STOP_MARKER', 'SubField', 'TableDefinition',
+           'TargetResult', 'TermInfo',
+           'TermList', 'TermPager', 'TermParameters', 'TextResult',
+           'TermPosting', 'TextParameters', 'TreeFile', 'TreeNode',
+           'UpperCaseTable', 'UserInfo', 'write_binary_record',
+           'write_iso_record', 'WriteResult',
+           'write_text_record', 'XrfFile', 'XrfRecord']
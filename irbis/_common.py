@@ -6,6 +6,7 @@
 
 import asyncio
 import os.path
+import re
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from typing import Union, Optional, SupportsInt, List
@@ -309,6 +310,18 @@ def change_extension(filename: str, new_extension: str) -> str:
     return os.path.splitext(filename)[0] + new_extension
 
 
+# Код вне комментариев: обычные символы, одиночный слэш и литералы
+# (внутри литералов комментариев не бывает), за которыми может следовать
+# комментарий до конца строки. Незакрытый литерал простирается
+# до конца текста.
+_COMMENT_REGEX = re.compile(r"((?:[^'\"|/]+|/(?!\*)|'[^']*(?:'|\Z)"
+                            r"|\"[^\"]*(?:\"|\Z)|\|[^|]*(?:\||\Z))*)"
+                            r"(?:/\*[^\r\n]*)?")
+
+# Управляющие символы, вырезаемые из формата перед отсылкой на сервер
+_CONTROL_CHARS = dict.fromkeys(range(32))
+
+
 def remove_comments(text: str) -> str:
     """
     Удаление комментариев из кода.
@@ -320,36 +333,7 @@ def remove_comments(text: str) -> str:
     if '/*' not in text:
         return text
 
-    result = []
-    state = ''
-    index = 0
-    length = len(text)
-    while index < length:
-        char = text[index]
-        if state in ("'", '"', '|'):
-            if char == state:
-                state = ''
-            result.append(char)
-        else:
-            if char == '/':
-                if index + 1 < length and text[index + 1] == '*':
-                    while index < length:
-                        char = text[index]
-                        if char in ('\r', '\n'):
-                            result.append(char)
-                            break
-                        index = index + 1
-                else:
-                    result.append(char)
-            else:
-                if char in ("'", '"', '|'):
-                    state = char
-                    result.append(char)
-                else:
-                    result.append(char)
-        index = index + 1
-
-    return ''.join(result)
+    return ''.join(_COMMENT_REGEX.findall(text))
 
 
 def prepare_format(text: str) -> str:
@@ -359,26 +343,7 @@ def prepare_format(text: str) -> str:
     :param text: Неподготовленный формат
     :return: Подготовленный формат
     """
-    text = remove_comments(text)
-    length = len(text)
-    if length == 0:
-        return text
-
-    flag = False
-    for char in text:
-        if char < ' ':
-            flag = True
-            break
-
-    if not flag:
-        return text
-
-    result = []
-    for char in text:
-        if char >= ' ':
-            result.append(char)
-
-    return ''.join(result)
+    return remove_comments(text).translate(_CONTROL_CHARS)
 
 
 ##############################################################################
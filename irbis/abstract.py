@@ -3,6 +3,7 @@
 """
 
 from abc import ABCMeta, abstractmethod
+from operator import attrgetter
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from typing import Any, Dict, Iterable
@@ -15,6 +16,9 @@ class AttrRedirect:
     с именами старых атрибутов как ключей словаря и именами новых атрибутов
     как значений словаря.
 
+    Псевдонимы превращаются в свойства при создании класса,
+    поэтому обращение к остальным атрибутам ничем не замедляется.
+
     Тестируемый пример:
 
     >>> class MyClass(AttrRedirect):
@@ -31,27 +35,24 @@ class AttrRedirect:
     """
     __aliases__: 'Dict[str, str]' = {}
 
-    def __getattr__(self, name: str) -> 'Any':
-        """
-        Дескриптор получения атрибутов.
+    def __init_subclass__(cls, **kwargs: 'Any') -> None:
+        super().__init_subclass__(**kwargs)
+        for old_name, new_name in cls.__aliases__.items():
+            setattr(cls, old_name, _alias(new_name))
 
-        :param name: имя запрашиваемого атрибута
-        :return: возвращаемый атрибут
-        """
-        if name != '__aliases__':
-            name = self.__aliases__.get(name, name)
-        return object.__getattribute__(self, name)
 
-    def __setattr__(self, name: str, value: 'Any'):
-        """
-        Дескриптор установки значений атрибутов.
+def _alias(name: str) -> property:
+    """
+    Свойство, перенаправляющее чтение и запись к другому атрибуту.
 
-        :param name: имя атрибута
-        :param value: значение атрибута
-        :return: ничегошеньки
-        """
-        name = self.__aliases__.get(name, name)
-        object.__setattr__(self, name, value)
+    :param name: имя нового атрибута
+    :return: свойство
+    """
+
+    def _set(instance: 'Any', value: 'Any') -> None:
+        setattr(instance, name, value)
+
+    return property(attrgetter(name), _set)
 
 
 class DictLike:
@@ -0,0 +1,350 @@
+# coding: utf-8
+
+"""
+Колоночное представление набора записей: значения выбранных
+подполей хранятся столбцами, что позволяет фильтровать,
+группировать и соединять сотни тысяч записей, не обращаясь
+повторно к самим записям.
+"""
+
+# pylint: disable=protected-access
+
+from array import array
+from collections import Counter
+from itertools import compress
+from typing import TYPE_CHECKING
+from irbis._common import ANSI
+from irbis.export import read_iso_record, read_text_record
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, Iterable, Iterator, List, \
+        Optional, Sequence, Tuple, Union
+    from irbis.direct import DirectAccess
+
+    ColumnSpec = Union[int, str, Tuple[int, str]]
+    Column = List[Optional[str]]
+    Mask = Sequence[bool]
+
+
+def parse_column(spec: 'ColumnSpec') -> 'Tuple[int, str]':
+    """
+    Разбор описания столбца: метка (700), строка вида '700^a'
+    либо кортеж (700, 'a'). Без кода подполя берется значение
+    поля до первого разделителя (либо первое подполе), как в fm.
+
+    :param spec: Описание столбца
+    :return: Кортеж (метка, код)
+    """
+    if isinstance(spec, int):
+        return spec, '*'
+    if isinstance(spec, str):
+        text, _, code = spec.partition('^')
+        return int(text), code.lower() or '*'
+    tag, code = spec
+    return int(tag), code.lower() or '*'
+
+
+def _column_name(spec: 'Tuple[int, str]') -> str:
+    tag, code = spec
+    return str(tag) if code == '*' else str(tag) + '^' + code
+
+
+class RecordBatch:
+    """
+    Набор записей в колоночном представлении.
+
+    Каждый столбец содержит для каждой записи значение
+    record.fm(метка, код) (None, если значения нет),
+    MFN записей хранятся в отдельном массиве mfn.
+    """
+
+    __slots__ = 'mfn', '_columns', '_specs'
+
+    def __init__(self, mfn: 'Iterable[int]' = (),
+                 columns: 'Optional[Dict[str, Column]]' = None,
+                 specs: 'Optional[Dict[str, Tuple[int, str]]]' = None) \
+            -> None:
+        self.mfn = array('l', mfn)
+        self._columns: 'Dict[str, Column]' = dict(columns or {})
+        self._specs: 'Dict[str, Tuple[int, str]]' = dict(specs or {})
+        for name, values in self._columns.items():
+            if len(values) != len(self.mfn):
+                raise ValueError('Column length mismatch: ' + name)
+
+    @staticmethod
+    def _plan(columns: 'Any') -> 'Dict[str, Tuple[int, str]]':
+        if isinstance(columns, dict):
+            return {name: parse_column(spec)
+                    for name, spec in columns.items()}
+        result = {}
+        for spec in columns:
+            parsed = parse_column(spec)
+            result[_column_name(parsed)] = parsed
+        return result
+
+    @classmethod
+    def from_records(cls, records: 'Iterable[Any]', columns: 'Any') \
+            -> 'RecordBatch':
+        """
+        Построение набора по записям (Record, LazyRecord, CompactRecord,
+        в т. ч. полученным read_records и search_read). Записи
+        просматриваются однократно и в наборе не сохраняются.
+
+        :param records: Записи (любой итерируемый источник)
+        :param columns: Описания столбцов (список либо словарь
+            "имя - описание"), см. parse_column
+        :return: Набор записей
+        """
+        specs = cls._plan(columns)
+        values: 'Dict[str, Column]' = {name: [] for name in specs}
+        plan = [(tag, code, values[name].append)
+                for name, (tag, code) in specs.items()]
+        mfn = array('l')
+        add_mfn = mfn.append
+        for record in records:
+            add_mfn(record.mfn)
+            fm = record.fm
+            for tag, code, append in plan:
+                append(fm(tag, code))
+        result = cls(specs=specs)
+        result.mfn = mfn
+        result._columns = values
+        return result
+
+    @classmethod
+    def from_direct(cls, access: 'DirectAccess', columns: 'Any',
+                    mfns: 'Optional[Iterable[int]]' = None) -> 'RecordBatch':
+        """
+        Построение набора прямым просмотром базы данных.
+        Удаленные записи пропускаются, у записей разбираются
+        только поля с нужными метками.
+
+        :param access: Открытая база данных
+        :param columns: Описания столбцов, см. from_records
+        :param mfns: MFN просматриваемых записей (по умолчанию все)
+        :return: Набор записей
+        """
+        if mfns is None:
+            mfns = range(1, access.next_mfn())
+        records = (access.read_record(mfn, lazy=True) for mfn in mfns)
+        return cls.from_records((record for record in records
+                                 if not record.is_deleted()), columns)
+
+    @classmethod
+    def from_iso(cls, stream: 'Any', columns: 'Any',
+                 charset: str = ANSI) -> 'RecordBatch':
+        """
+        Построение набора по файлу в формате ISO 2709.
+
+        :param stream: Двоичный поток
+        :param columns: Описания столбцов, см. from_records
+        :param charset: Кодировка
+        :return: Набор записей
+        """
+        return cls.from_records(iter(lambda: read_iso_record(stream, charset),
+                                     None), columns)
+
+    @classmethod
+    def from_text(cls, stream: 'Any', columns: 'Any') -> 'RecordBatch':
+        """
+        Построение набора по файлу в текстовом обменном формате ИРБИС.
+
+        :param stream: Текстовый поток
+        :param columns: Описания столбцов, см. from_records
+        :return: Набор записей
+        """
+        return cls.from_records(iter(lambda: read_text_record(stream), None),
+                                columns)
+
+    @property
+    def names(self) -> 'List[str]':
+        """
+        Имена столбцов.
+        """
+        return list(self._columns)
+
+    @property
+    def tags(self) -> 'List[int]':
+        """
+        Метки полей, нужных для построения столбцов
+        (для параметра tags в read_records и search_read).
+        """
+        return sorted({tag for tag, _ in self._specs.values()})
+
+    def column(self, name: str) -> 'Column':
+        """
+        Значения столбца.
+
+        :param name: Имя столбца
+        :return: Список значений (None -- значения нет)
+        """
+        return self._columns[name]
+
+    def mask(self, name: str, predicate: 'Callable[[str], Any]') \
+            -> 'List[bool]':
+        """
+        Маска записей, значение столбца которых удовлетворяет условию.
+        Для отсутствующих значений условие не вызывается.
+
+        :param name: Имя столбца
+        :param predicate: Условие
+        :return: Маска
+        """
+        return [value is not None and bool(predicate(value))
+                for value in self._columns[name]]
+
+    def equal(self, name: str, value: 'Optional[str]') -> 'List[bool]':
+        """
+        Маска записей с указанным значением столбца.
+
+        :param name: Имя столбца
+        :param value: Значение (None -- значения нет)
+        :return: Маска
+        """
+        return [one == value for one in self._columns[name]]
+
+    def isin(self, name: str, values: 'Iterable[Optional[str]]') \
+            -> 'List[bool]':
+        """
+        Маска записей, значение столбца которых входит в набор.
+
+        :param name: Имя столбца
+        :param values: Допустимые значения
+        :return: Маска
+        """
+        allowed = frozenset(values)
+        return [value in allowed for value in self._columns[name]]
+
+    def present(self, name: str) -> 'List[bool]':
+        """
+        Маска записей, у которых есть значение столбца.
+
+        :param name: Имя столбца
+        :return: Маска
+        """
+        return [value is not None for value in self._columns[name]]
+
+    def filter(self, mask: 'Mask') -> 'RecordBatch':
+        """
+        Отбор записей по маске (маски можно объединять
+        поэлементно, например, map(operator.and_, first, second)).
+
+        :param mask: Маска
+        :return: Новый набор записей
+        """
+        mask = list(mask)
+        if len(mask) != len(self.mfn):
+            raise ValueError('Mask length mismatch')
+        result = RecordBatch(specs=self._specs)
+        result.mfn = array('l', compress(self.mfn, mask))
+        result._columns = {name: list(compress(values, mask))
+                           for name, values in self._columns.items()}
+        return result
+
+    def where(self, name: str, predicate: 'Callable[[str], Any]') \
+            -> 'RecordBatch':
+        """
+        Отбор записей, значение столбца которых удовлетворяет условию.
+
+        :param name: Имя столбца
+        :param predicate: Условие
+        :return: Новый набор записей
+        """
+        return self.filter(self.mask(name, predicate))
+
+    def count_by(self, *names: str) -> 'Counter':
+        """
+        Количество записей для каждого значения столбца
+        (для нескольких столбцов -- для каждого кортежа значений).
+
+        :param names: Имена столбцов
+        :return: Счетчик (значение - количество записей)
+        """
+        if len(names) == 1:
+            return Counter(self._columns[names[0]])
+        return Counter(zip(*(self._columns[name] for name in names)))
+
+    def join(self, other: 'RecordBatch', on: str,
+             other_on: 'Optional[str]' = None,
+             suffix: str = '_right') -> 'RecordBatch':
+        """
+        Внутреннее соединение с другим набором по равенству
+        значений столбцов (записи без значения не соединяются).
+        MFN берутся из этого набора, столбцы другого набора
+        с совпадающими именами получают суффикс.
+
+        :param other: Другой набор
+        :param on: Столбец этого набора
+        :param other_on: Столбец другого набора (по умолчанию тот же)
+        :param suffix: Суффикс для совпадающих имен
+        :return: Новый набор записей
+        """
+        index: 'Dict[str, List[int]]' = {}
+        for position, key in enumerate(other.column(other_on or on)):
+            if key is not None:
+                index.setdefault(key, []).append(position)
+
+        left: 'List[int]' = []
+        right: 'List[int]' = []
+        for position, key in enumerate(self._columns[on]):
+            found = index.get(key) if key is not None else None
+            if found:
+                left.extend([position] * len(found))
+                right.extend(found)
+
+        result = RecordBatch(specs=self._specs)
+        result.mfn = array('l', [self.mfn[i] for i in left])
+        for name, values in self._columns.items():
+            result._columns[name] = [values[i] for i in left]
+        for name, values in other._columns.items():
+            target = name + suffix if name in result._columns else name
+            result._columns[target] = [values[i] for i in right]
+            if name in other._specs:
+                result._specs[target] = other._specs[name]
+        return result
+
+    def rows(self) -> 'Iterator[Tuple[Any, ...]]':
+        """
+        Построчный перебор набора.
+
+        :return: Кортежи (MFN, значения столбцов...)
+        """
+        return zip(self.mfn, *self._columns.values())
+
+    def to_numpy(self, name: 'Optional[str]' = None) -> 'Any':
+        """
+        Преобразование в массивы NumPy (требуется установленный NumPy).
+
+        :param name: Имя столбца либо 'mfn'. Если не задано,
+            возвращается словарь всех массивов.
+        :return: Массив (объектный для столбцов, целочисленный для mfn)
+        """
+        # pylint: disable=import-outside-toplevel,import-error
+        import numpy  # type: ignore
+
+        if name == 'mfn':
+            return numpy.array(self.mfn, dtype=numpy.int64)
+        if name is not None:
+            return numpy.array(self._columns[name], dtype=object)
+        result = {'mfn': numpy.array(self.mfn, dtype=numpy.int64)}
+        for key, values in self._columns.items():
+            result[key] = numpy.array(values, dtype=object)
+        return result
+
+    def __getitem__(self, name: str) -> 'Column':
+        return self._columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._columns
+
+    def __len__(self):
+        return len(self.mfn)
+
+    def __bool__(self):
+        return bool(self.mfn)
+
+    def __str__(self):
+        return f"RecordBatch: {len(self.mfn)} records, " \
+               f"columns: {', '.join(self._columns)}"
+
+
+__all__ = ['parse_column', 'RecordBatch']
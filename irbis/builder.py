@@ -4,9 +4,11 @@
 Search expression builder.
 """
 
+import re
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from typing import Any
+    from typing import Any, Dict, List, Optional, Tuple, Union
+    SearchNode = Union['SearchTerm', 'SearchOperation', 'SearchText']
 
 ###############################################################################
 
@@ -14,12 +16,14 @@ if TYPE_CHECKING:
 class Search:
     """
     Search expression builder class.
+    Along with the text, the builder keeps the expression tree (node).
     """
 
-    __slots__ = ('buffer',)
+    __slots__ = ('buffer', 'node')
 
     def __init__(self) -> None:
         self.buffer = ''
+        self.node: 'Optional[SearchNode]' = None
 
     @staticmethod
     def all() -> 'Search':
@@ -27,7 +31,8 @@ class Search:
         All documents in the database.
         """
         result = Search()
-        result.buffer = 'I=$'
+        result.buffer = ALL_TERM
+        result.node = SearchTerm(ALL_TERM)
         return result
 
     def and_(self, *items: 'Any') -> 'Search':
@@ -38,8 +43,22 @@ class Search:
         for item in items:
             self.buffer = self.buffer + ' * ' + Search.wrap(item)
         self.buffer = self.buffer + ')'
+        self.node = self._combine('*', items)
         return self
 
+    def cache_key(self) -> str:
+        """
+        Cache key: text of the normalized expression.
+        """
+        return search_cache_key(self)
+
+    def _combine(self, operator: str, items: 'Any') -> 'SearchNode':
+        nodes = [] if self.node is None else [self.node]
+        nodes.extend(Search.to_node(item) for item in items)
+        if len(nodes) == 1:
+            return nodes[0]
+        return SearchOperation(operator, nodes)
+
     @staticmethod
     def equals(prefix: str, *values: 'Any') -> 'Search':
         """
@@ -52,6 +71,10 @@ class Search:
             for item in values[1:len(values)]:
                 text = text + ' + ' + Search.wrap(prefix + str(item))
             text = text + ')'
+            result.node = SearchOperation('+', [SearchTerm(prefix + str(item))
+                                                for item in values])
+        else:
+            result.node = SearchTerm(prefix + str(values[0]))
         result.buffer = text
         return result
 
@@ -69,11 +92,21 @@ class Search:
                 return True
         return False
 
+    def normalize(self) -> 'Search':
+        """
+        Normalized copy of the expression.
+        """
+        result = Search()
+        result.node = normalize_search(self)
+        result.buffer = str(result.node)
+        return result
+
     def not_(self, text: 'Any') -> 'Search':
         """
         Logical NOT.
         """
         self.buffer = '(' + self.buffer + ' ^ ' + Search.wrap(text) + ')'
+        self.node = self._combine('^', (text,))
         return self
 
     def or_(self, *items: 'Any') -> 'Search':
@@ -84,6 +117,7 @@ class Search:
         for item in items:
             self.buffer = self.buffer + ' + ' + Search.wrap(item)
         self.buffer = self.buffer + ')'
+        self.node = self._combine('+', items)
         return self
 
     def same_field(self, *items: 'Any') -> 'Search':
@@ -94,6 +128,7 @@ class Search:
         for item in items:
             self.buffer = self.buffer + ' (G) ' + Search.wrap(item)
         self.buffer = self.buffer + ')'
+        self.node = self._combine('(G)', items)
         return self
 
     def same_repeat(self, *items: 'Any') -> 'Search':
@@ -104,8 +139,28 @@ class Search:
         for item in items:
             self.buffer = self.buffer + ' (F) ' + Search.wrap(item)
         self.buffer = self.buffer + ')'
+        self.node = self._combine('(F)', items)
         return self
 
+    @staticmethod
+    def to_node(item: 'Any') -> 'SearchNode':
+        """
+        Expression tree for the item (Search, node or text).
+        Text the parser does not support (e.g. ".", "/(200)")
+        becomes an opaque SearchText node.
+        """
+        if isinstance(item, (SearchTerm, SearchOperation, SearchText)):
+            return item
+        if isinstance(item, Search) and item.node is not None:
+            return item.node
+        text = str(item)
+        if text and text[0] in '"(':
+            try:
+                return parse_search(text)
+            except ValueError:
+                return SearchText(text)
+        return SearchTerm(text)
+
     @staticmethod
     def wrap(text: 'Any') -> str:
         """
@@ -122,6 +177,325 @@ class Search:
 ###############################################################################
 
 
+class SearchTerm:
+    """
+    Терм поискового выражения (узел дерева разбора).
+    """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: str) -> None:
+        self.text: str = text
+
+    @property
+    def truncated(self) -> bool:
+        """
+        Терм с правым усечением ("A=ПУШКИН$")?
+        """
+        return self.text.endswith('$')
+
+    def __str__(self):
+        return Search.wrap(self.text)
+
+
+class SearchOperation:
+    """
+    Операция поискового выражения (узел дерева разбора).
+    Операция "^" вычитает из первого операнда все последующие.
+    """
+
+    __slots__ = ('operator', 'items')
+
+    def __init__(self, operator: str,
+                 items: 'List[SearchNode]') -> None:
+        self.operator: str = operator
+        self.items: 'List[SearchNode]' = items
+
+    def __str__(self):
+        separator = ' ' + self.operator + ' '
+        return '(' + separator.join(str(item) for item in self.items) + ')'
+
+
+class SearchText:
+    """
+    Фрагмент поискового выражения, который не удалось разобрать
+    (например, с операторами ".", "$", "/(200)"). Выводится
+    как есть, при нормализации не изменяется.
+    """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: str) -> None:
+        self.text: str = text
+
+    def __str__(self):
+        return self.text
+
+
+# Все записи базы данных
+ALL_TERM = 'I=$'
+
+# Операторы в порядке возрастания приоритета
+SEARCH_OPERATORS = ('+', '*', '^', '(G)', '(F)')
+
+_SEARCH_TOKEN_REGEX = re.compile(r'\s*(?:(\(\s*[GFgf]\s*\))|([()+*^])'
+                                 r'|"([^"]*)"|([^\s()+*^"]+))')
+
+
+def parse_search(text: 'Any') -> 'SearchNode':
+    """
+    Разбор текста поискового выражения в дерево.
+    Поддерживаются термы (в том числе в кавычках и с усечением),
+    скобки и операторы "+", "*", "^", "(G)", "(F)".
+
+    :param text: Поисковое выражение (строка или Search)
+    :return: Корень дерева разбора
+    """
+    text = str(text)
+    tokens: 'List[Tuple[str, str]]' = []
+    position, length = 0, len(text)
+    while position < length:
+        match = _SEARCH_TOKEN_REGEX.match(text, position)
+        if not match or match.end() == position:
+            if text[position:].isspace():
+                break
+            raise ValueError('Unexpected character at ' + str(position))
+        position = match.end()
+        proximity, operator, quoted, bare = match.groups()
+        if proximity:
+            tokens.append(('op', '(' + proximity[1:-1].strip().upper() + ')'))
+        elif operator in ('(', ')'):
+            tokens.append((operator, operator))
+        elif operator:
+            tokens.append(('op', operator))
+        elif quoted is not None:
+            tokens.append(('term', quoted))
+        elif bare:
+            if bare[0] in './#' or '/(' in bare:
+                raise ValueError('Unsupported search syntax: ' + bare)
+            tokens.append(('term', bare))
+    if not tokens:
+        raise ValueError('Empty search expression')
+
+    index = 0
+
+    def parse_level(level: int) -> 'SearchNode':
+        nonlocal index
+        if level == len(SEARCH_OPERATORS):
+            return parse_primary()
+        operator = SEARCH_OPERATORS[level]
+        items = [parse_level(level + 1)]
+        while index < len(tokens) and tokens[index] == ('op', operator):
+            index += 1
+            items.append(parse_level(level + 1))
+        if len(items) == 1:
+            return items[0]
+        return SearchOperation(operator, items)
+
+    def parse_primary() -> 'SearchNode':
+        nonlocal index
+        if index >= len(tokens):
+            raise ValueError('Unexpected end of search expression')
+        kind, value = tokens[index]
+        index += 1
+        if kind == 'term':
+            return SearchTerm(value)
+        if kind == '(':
+            result = parse_level(0)
+            if index >= len(tokens) or tokens[index][0] != ')':
+                raise ValueError('Unbalanced parentheses')
+            index += 1
+            return result
+        raise ValueError('Unexpected token ' + value)
+
+    result = parse_level(0)
+    if index != len(tokens):
+        raise ValueError('Unexpected token ' + tokens[index][1])
+    return result
+
+
+def _is_all(node: 'SearchNode') -> bool:
+    return isinstance(node, SearchTerm) and node.text.upper() == ALL_TERM
+
+
+def _unique_nodes(items: 'List[SearchNode]') -> 'List[SearchNode]':
+    unique: 'Dict[str, SearchNode]' = {}
+    for item in items:
+        unique.setdefault(str(item), item)
+    return [unique[key] for key in sorted(unique)]
+
+
+def normalize_search(expression: 'Any') -> 'SearchNode':
+    """
+    Нормализация поискового выражения: термы приводятся к верхнему
+    регистру, вложенные однотипные операции раскрываются, повторы
+    операндов удаляются, операнды упорядочиваются, "I=$" (все записи)
+    сворачивается: "X * I=$" -> "X", "X + I=$" -> "I=$".
+
+    :param expression: Поисковое выражение (строка, Search или узел)
+    :return: Корень нормализованного дерева
+    """
+    if isinstance(expression, (SearchTerm, SearchOperation, SearchText)):
+        node = expression
+    elif isinstance(expression, Search) and expression.node is not None:
+        node = expression.node
+    else:
+        node = parse_search(expression)
+    if isinstance(node, SearchText):
+        return node
+    if isinstance(node, SearchTerm):
+        return SearchTerm(node.text.upper())
+
+    operator = node.operator
+    items: 'List[SearchNode]' = []
+    for position, item in enumerate(node.items):
+        item = normalize_search(item)
+        # "(A ^ B) ^ C" == "A ^ B ^ C", но "A ^ (B ^ C)" -- другое дело
+        if isinstance(item, SearchOperation) and item.operator == operator \
+                and (operator != '^' or position == 0):
+            items.extend(item.items)
+        else:
+            items.append(item)
+
+    if operator == '^':
+        first = items[0]
+        rest = _unique_nodes(items[1:])
+        if not rest:
+            return first
+        return SearchOperation(operator, [first] + rest)
+
+    items = _unique_nodes(items)
+    if operator == '+' and any(_is_all(item) for item in items):
+        return SearchTerm(ALL_TERM)
+    if operator == '*':
+        items = [item for item in items if not _is_all(item)] \
+            or [SearchTerm(ALL_TERM)]
+    if len(items) == 1:
+        return items[0]
+    return SearchOperation(operator, items)
+
+
+def search_cache_key(expression: 'Any') -> str:
+    """
+    Ключ для кэширования результатов поиска: текст нормализованного
+    выражения. Эквивалентные с точностью до порядка операндов
+    и повторов выражения получают одинаковый ключ.
+
+    :param expression: Поисковое выражение (строка, Search или узел)
+    :return: Ключ
+    """
+    return str(normalize_search(expression))
+
+
+class SearchPlanner:
+    """
+    Планировщик поисковых выражений: оценивает стоимость узлов
+    по количеству ссылок термов из словаря (read_terms) и перестраивает
+    нормализованное выражение -- самые избирательные операнды
+    пересечения идут первыми, заведомо пустые термы отбрасываются.
+    """
+
+    __slots__ = ('connection', 'counts')
+
+    def __init__(self, connection: 'Any') -> None:
+        self.connection: 'Any' = connection
+        self.counts: 'Dict[str, int]' = {}
+
+    def term_count(self, text: str) -> int:
+        """
+        Количество ссылок терма (для усеченного терма -- сумма
+        по всем термам с данным префиксом).
+
+        :param text: Терм
+        :return: Количество ссылок
+        """
+        text = text.upper()
+        result = self.counts.get(text)
+        if result is None:
+            if text == ALL_TERM:
+                result = self.connection.get_max_mfn()
+            elif text.endswith('$'):
+                prefix = text[:-1]
+                result = sum(term.count for term in
+                             self.connection.iter_terms(prefix, prefix))
+            else:
+                terms = self.connection.read_terms((text, 1))
+                result = terms[0].count \
+                    if terms and terms[0].text == text else 0
+            self.counts[text] = result
+        return result
+
+    def cost(self, node: 'SearchNode') -> int:
+        """
+        Оценка количества записей, отбираемых узлом (сверху).
+        Неразобранный фрагмент оценивается количеством всех записей.
+
+        :param node: Узел дерева
+        :return: Оценка
+        """
+        if isinstance(node, SearchText):
+            return self.term_count(ALL_TERM)
+        if isinstance(node, SearchTerm):
+            return self.term_count(node.text)
+        if node.operator == '+':
+            return sum(self.cost(item) for item in node.items)
+        if node.operator == '^':
+            return self.cost(node.items[0])
+        return min(self.cost(item) for item in node.items)
+
+    def plan(self, expression: 'Any') -> 'SearchNode':
+        """
+        Нормализация и перестройка выражения с учетом стоимости.
+
+        :param expression: Поисковое выражение (строка, Search или узел)
+        :return: Корень перестроенного дерева
+        """
+        return self._plan(normalize_search(expression))
+
+    def _plan(self, node: 'SearchNode') -> 'SearchNode':
+        if not isinstance(node, SearchOperation):
+            return node
+        items = [self._plan(item) for item in node.items]
+        if node.operator == '+':
+            items = [item for item in items if self.cost(item)] or items[:1]
+        elif node.operator == '^':
+            if not self.cost(items[0]):
+                return items[0]
+            items = items[:1] + [item for item in items[1:]
+                                 if self.cost(item)]
+        else:
+            items.sort(key=self.cost)
+        if len(items) == 1:
+            return items[0]
+        return SearchOperation(node.operator, items)
+
+    def split(self, expression: 'Any',
+              max_items: int = 100) -> 'List[SearchNode]':
+        """
+        Разбиение выражения вида "A + B + ..." с большим количеством
+        операндов на несколько выражений, результаты которых
+        нужно объединить.
+
+        :param expression: Поисковое выражение (строка, Search или узел)
+        :param max_items: Максимальное количество операндов в выражении
+        :return: Перечень выражений
+        """
+        assert max_items > 0
+        node = self.plan(expression)
+        if not isinstance(node, SearchOperation) or node.operator != '+' \
+                or len(node.items) <= max_items:
+            return [node]
+        result: 'List[SearchNode]' = []
+        for start in range(0, len(node.items), max_items):
+            chunk = node.items[start:start + max_items]
+            result.append(chunk[0] if len(chunk) == 1
+                          else SearchOperation('+', chunk))
+        return result
+
+
+###############################################################################
+
+
 def keyword(*values: 'Any') -> Search:
     """
     Поиск по ключевым словам.
@@ -0,0 +1,269 @@
+# coding: utf-8
+
+"""
+Компактная двоичная сериализация записей (Record, RawRecord)
+для кэширования и передачи между процессами.
+
+Формат (версия 1), все числа little-endian:
+
+* заголовок: версия формата (1 байт), вид записи (0 -- Record,
+  1 -- RawRecord), флаги (PARTIAL, DIRTY, WIDE), MFN, статус и версия
+  записи (int32), количество чисел в таблице (uint32);
+* таблица длин и количеств (uint16, а при флаге WIDE -- uint32);
+* все строки записи подряд в UTF-8.
+
+Длина строки хранится в таблице как "длина + 1", 0 означает None.
+Для Record таблица содержит: длину имени базы данных, количество
+полей, затем для каждого поля -- метку, длину значения до первого
+разделителя, количество подполей и длины значений подполей.
+Код подполя (ровно один символ) хранится в строках перед значением.
+Для RawRecord: длину имени базы данных, количество полей и длины строк.
+
+Поток записей: перед каждой записью ее длина в байтах (uint32).
+"""
+
+import struct
+import sys
+from array import array
+from typing import TYPE_CHECKING
+from irbis.records import Field, RawRecord, Record, SubField
+if TYPE_CHECKING:
+    from typing import BinaryIO, Callable, Iterator, List, Optional, Union
+
+    AnyRecord = Union[Record, RawRecord]
+
+FORMAT_VERSION = 1
+
+# Вид записи
+RECORD_KIND = 0
+RAW_RECORD_KIND = 1
+
+# Флаги
+PARTIAL = 1  # Неполная запись
+DIRTY = 2  # Запись изменена
+WIDE = 4  # Таблица из uint32
+
+_HEADER = struct.Struct('<BBBiiiI')
+_LENGTH = struct.Struct('<I')
+_SWAP = sys.byteorder != 'little'
+
+def _size(text: 'Optional[str]') -> int:
+    return 0 if text is None else len(text) + 1
+
+
+def _encode_record(record: Record, numbers: 'List[int]',
+                   strings: 'List[str]') -> None:
+    add, add_string = numbers.append, strings.append
+    fields = record.fields
+    add(len(fields))
+    for field in fields:
+        value = field.value
+        subfields = field.subfields
+        add(field.tag)
+        add(0 if value is None else len(value) + 1)
+        add(len(subfields))
+        if value:
+            add_string(value)
+        for subfield in subfields:
+            code, value = subfield.code, subfield.value
+            if len(code) != 1:
+                raise ValueError('Bad code: ' + repr(code))
+            add_string(code)
+            if value is None:
+                add(0)
+            else:
+                add(len(value) + 1)
+                add_string(value)
+
+
+def _check_end(number: 'Callable[[], int]', text: str,
+               position: int) -> None:
+    # Прочитаны ровно все строки и все числа таблицы
+    if position > len(text):
+        raise ValueError('Truncated record')
+    if position == len(text):
+        try:
+            number()
+        except StopIteration:
+            return
+    raise ValueError('Corrupt record')
+
+
+def _decode_record(numbers: 'List[int]', text: str, position: int) \
+        -> 'List[Field]':
+    number = iter(numbers).__next__
+    result = []
+    new_field, new_subfield = Field.loaded, SubField.loaded
+    try:
+        for _ in range(number()):
+            tag = number()
+            size = number()
+            value: 'Optional[str]' = None
+            if size:
+                value = text[position:position + size - 1]
+                position += size - 1
+            subfields = []
+            for _ in range(number()):
+                code = text[position]
+                size = number()
+                if size:
+                    subfields.append(new_subfield(
+                        code, text[position + 1:position + size]))
+                    position += size
+                else:
+                    subfields.append(new_subfield(code, None))
+                    position += 1
+            result.append(new_field(tag, value, subfields))
+    except StopIteration:
+        raise ValueError('Corrupt record') from None
+    except IndexError:
+        raise ValueError('Truncated record') from None
+    _check_end(number, text, position)
+    return result
+
+
+def _decode_raw_record(numbers: 'List[int]', text: str, position: int) \
+        -> 'List[str]':
+    result = []
+    for size in numbers:
+        result.append(text[position:position + size])
+        position += size
+    _check_end(iter(()).__next__, text, position)
+    return result
+
+
+def dumps(record: 'AnyRecord') -> bytes:
+    """
+    Сериализация записи.
+
+    :param record: Запись (LazyRecord сериализуется как Record)
+    :return: Двоичное представление
+    """
+    if not isinstance(record, (Record, RawRecord)):
+        raise TypeError('Record or RawRecord expected')
+    database = record.database
+    numbers = [_size(database)]
+    strings = [database or '']
+    flags = PARTIAL if record.partial else 0
+    if isinstance(record, Record):
+        kind = RECORD_KIND
+        if record.dirty:
+            flags |= DIRTY
+        _encode_record(record, numbers, strings)
+    else:
+        kind = RAW_RECORD_KIND
+        numbers.append(len(record.fields))
+        numbers.extend(len(line) for line in record.fields)
+        strings.extend(record.fields)
+
+    try:
+        table = array('H', numbers)
+    except OverflowError:
+        flags |= WIDE
+        table = array('I', numbers)
+    if _SWAP:
+        table.byteswap()
+    header = _HEADER.pack(FORMAT_VERSION, kind, flags, record.mfn,
+                          record.status, record.version, len(numbers))
+    return header + table.tobytes() + ''.join(strings).encode('utf-8')
+
+
+def loads(data: 'Union[bytes, bytearray, memoryview]') -> 'AnyRecord':
+    """
+    Восстановление записи из двоичного представления.
+
+    :param data: Результат dumps
+    :return: Запись того же вида (Record либо RawRecord)
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError('Truncated record')
+    version, kind, flags, mfn, status, record_version, count = \
+        _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported format version: ' + str(version))
+    table = array('I' if flags & WIDE else 'H')
+    stop = _HEADER.size + count * table.itemsize
+    if len(data) < stop:
+        raise ValueError('Truncated record')
+    if not count:
+        raise ValueError('Corrupt record')
+    table.frombytes(data[_HEADER.size:stop])
+    if _SWAP:
+        table.byteswap()
+    numbers = table.tolist()
+    try:
+        text = bytes(data[stop:]).decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError('Corrupt record') from None
+
+    position = max(numbers[0] - 1, 0)  # Длина имени базы данных
+    database = text[:position] if numbers[0] else None
+    result: 'AnyRecord'
+    if kind == RECORD_KIND:
+        result = Record()
+        result.fields = _decode_record(numbers[1:], text, position)
+    elif kind == RAW_RECORD_KIND:
+        if len(numbers) < 2 or numbers[1] != len(numbers) - 2:
+            raise ValueError('Corrupt record')
+        result = RawRecord()
+        result.fields = _decode_raw_record(numbers[2:], text, position)
+    else:
+        raise ValueError('Unknown record kind: ' + str(kind))
+    result.database = database
+    result.mfn = mfn
+    result.status = status
+    result.version = record_version
+    result.partial = bool(flags & PARTIAL)
+    if isinstance(result, Record) and not flags & DIRTY:
+        result.mark_loaded()
+    return result
+
+
+def write_binary_record(stream: 'BinaryIO', record: 'AnyRecord') -> None:
+    """
+    Запись в поток двоичного представления записи (с длиной).
+
+    :param stream: Двоичный поток
+    :param record: Запись
+    :return: None
+    """
+    data = dumps(record)
+    stream.write(_LENGTH.pack(len(data)))
+    stream.write(data)
+
+
+def read_binary_record(stream: 'BinaryIO') -> 'Optional[AnyRecord]':
+    """
+    Чтение из потока записи, сохраненной write_binary_record.
+
+    :param stream: Двоичный поток
+    :return: Запись либо None, если поток закончился
+    """
+    prefix = stream.read(_LENGTH.size)
+    if not prefix:
+        return None
+    if len(prefix) != _LENGTH.size:
+        raise ValueError('Truncated record')
+    size = _LENGTH.unpack(prefix)[0]
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated record')
+    return loads(data)
+
+
+def iter_binary_records(stream: 'BinaryIO') -> 'Iterator[AnyRecord]':
+    """
+    Перебор всех записей потока, сохраненных write_binary_record.
+
+    :param stream: Двоичный поток
+    :return: Итератор записей
+    """
+    while True:
+        record = read_binary_record(stream)
+        if record is None:
+            break
+        yield record
+
+
+__all__ = ['dumps', 'iter_binary_records', 'loads', 'read_binary_record',
+           'write_binary_record']
@@ -8,44 +8,55 @@ import asyncio
 import socket
 import random
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import TYPE_CHECKING
 
 from irbis._common import ACTUALIZE_RECORD, ALL, CREATE_DATABASE, \
     CREATE_DICTIONARY, DATA, DELETE_DATABASE, EMPTY_DATABASE, FORMAT_RECORD, \
     FULL_TEXT_SEARCH, GET_MAX_MFN, GET_PROCESS_LIST, GET_SERVER_STAT, \
-    GET_USER_LIST, IRBIS_DELIMITER, irbis_to_dos, irbis_to_lines, \
+    GET_USER_LIST, irbis_to_dos, irbis_to_lines, \
     irbis_event_loop, LIST_FILES, LOGICALLY_DELETED, MASTER_FILE, \
     MAX_POSTINGS, NOP, NOT_CONNECTED, ObjectWithError, OTHER_DELIMITER, \
     PRINT, READ_RECORD, READ_RECORD_CODES, READ_DOCUMENT, READ_POSTINGS, \
     READ_TERMS, READ_TERMS_REVERSE, READ_TERMS_CODES, RECORD_LIST, \
     REGISTER_CLIENT, RELOAD_DICTIONARY, RELOAD_MASTER_FILE, RESTART_SERVER, \
-    safe_str, SEARCH, SERVER_INFO, SET_USER_LIST, short_irbis_to_lines, \
-    SYSTEM, throw_value_error, UNREGISTER_CLIENT, UNLOCK_DATABASE, \
-    UNLOCK_RECORDS, UPDATE_INI_FILE, UPDATE_RECORD
+    safe_int, safe_str, SAVE_RECORD_GROUP, SEARCH, SERVER_INFO, \
+    SET_USER_LIST, short_irbis_to_lines, SYSTEM, throw_value_error, \
+    UNREGISTER_CLIENT, UNLOCK_DATABASE, UNLOCK_RECORDS, UPDATE_INI_FILE, \
+    UPDATE_RECORD
 
 from irbis.alphabet import AlphabetTable, UpperCaseTable
 from irbis.database import DatabaseInfo
 from irbis.error import IrbisError, IrbisFileNotFoundError
 from irbis.ini import IniFile
+from irbis.local_search import LocalSearch
 from irbis.menus import MenuFile
 from irbis.opt import OptFile
 from irbis.par import ParFile
+from irbis.pft import CompiledFormat, local_format, projection_format
 from irbis.process import Process
 from irbis.query import ClientQuery
-from irbis.records import RawRecord, Record
+from irbis.records import LazyRecord, RawRecord, Record
 from irbis.response import ServerResponse
 from irbis.search import CellResult, FoundLine, SearchParameters, \
     SearchScenario, TextParameters, TextResult
 from irbis.specification import FileSpecification
 from irbis.stats import ServerStat
 from irbis.table import TableDefinition
-from irbis.terms import PostingParameters, TermInfo, TermPosting, \
-    TermParameters
+from irbis.terms import PostingList, PostingParameters, TermList, \
+    TermPager, TermPosting, TermParameters
 from irbis.tree import TreeFile
 from irbis.version import ServerVersion
 from irbis.user import UserInfo
+from irbis.writing import RecordResult, WriteResult
 if TYPE_CHECKING:
-    from typing import Any, List, Optional, Tuple, Union
+    from typing import Any, AsyncIterator, Callable, Deque, Iterable, \
+        Iterator, List, Optional, Tuple, TypeVar, Union
+    from irbis.pft import FormatSpecification
+    from irbis.terms import TermInfo
+    T = TypeVar('T')
+    PageHandler = Callable[[ServerResponse], Tuple[T, Optional[ClientQuery]]]
 
 
 class Connection(ObjectWithError):
@@ -59,7 +70,7 @@ class Connection(ObjectWithError):
 
     __slots__ = ('host', 'port', 'username', 'password', 'database',
                  'workstation', 'client_id', 'query_id', 'connected',
-                 '_stack', 'server_version', 'ini_file')
+                 '_stack', 'server_version', 'ini_file', '__weakref__')
 
     def __init__(self, host: 'Optional[str]' = None,
                  port: int = 0,
@@ -368,7 +379,8 @@ class Connection(ObjectWithError):
             pass
 
     # noinspection DuplicatedCode
-    def format_record(self, script: str, record: 'Union[Record, int]') -> str:
+    def format_record(self, script: 'FormatSpecification',
+                      record: 'Union[Record, int]') -> str:
         """
         Форматирование записи с указанным MFN.
 
@@ -383,7 +395,7 @@ class Connection(ObjectWithError):
         if not record:
             raise ValueError()
 
-        assert isinstance(script, str)
+        assert isinstance(script, (str, CompiledFormat))
         assert isinstance(record, (Record, int))
 
         if not script:
@@ -395,7 +407,7 @@ class Connection(ObjectWithError):
         if isinstance(record, int):
             query.add(1).add(record)
         else:
-            query.add(-2).utf(IRBIS_DELIMITER.join(record.encode()))
+            query.add(-2).record(record)
 
         with self.execute(query) as response:
             if not response.check_return_code():
@@ -405,7 +417,7 @@ class Connection(ObjectWithError):
             return result
 
     # noinspection DuplicatedCode
-    async def format_record_async(self, script: str,
+    async def format_record_async(self, script: 'FormatSpecification',
                                   record: 'Union[Record, int]') -> str:
         """
         Асинхронное форматирование записи с указанным MFN.
@@ -423,7 +435,7 @@ class Connection(ObjectWithError):
         if not record:
             raise ValueError()
 
-        assert isinstance(script, str)
+        assert isinstance(script, (str, CompiledFormat))
         assert isinstance(record, (Record, int))
 
         query = ClientQuery(self, FORMAT_RECORD).ansi(self.database)
@@ -431,7 +443,7 @@ class Connection(ObjectWithError):
         if isinstance(record, int):
             query.add(1).add(record)
         else:
-            query.add(-2).utf(IRBIS_DELIMITER.join(record.encode()))
+            query.add(-2).record(record)
 
         response = await self.execute_async(query)
         if not response.check_return_code():
@@ -441,7 +453,30 @@ class Connection(ObjectWithError):
         response.close()
         return result
 
-    def format_records(self, script: str, records: 'List[int]') -> 'List[str]':
+    def format_local(self, script: 'FormatSpecification',
+                     records: 'List[Record]') -> 'List[str]':
+        """
+        Форматирование уже загруженных записей. Простые форматы
+        (см. irbis.pft.LocalFormat) исполняются на стороне клиента
+        без обращения к серверу, остальные отсылаются серверу
+        по одной записи.
+
+        :param script: Текст формата
+        :param records: Список записей
+        :return: Список строк
+        """
+        if not records:
+            return []
+
+        local = local_format(script)
+        if local is not None:
+            return [local.format_record(record).strip('\r\n')
+                    for record in records]
+
+        return [self.format_record(script, record) for record in records]
+
+    def format_records(self, script: 'FormatSpecification',
+                       records: 'List[int]') -> 'List[str]':
         """
         Форматирование группы записей по MFN.
 
@@ -457,12 +492,18 @@ class Connection(ObjectWithError):
 
         script = script or throw_value_error()
 
-        assert isinstance(script, str)
+        assert isinstance(script, (str, CompiledFormat))
         assert isinstance(records, list)
 
         if not script:
             return [''] * len(records)
 
+        result = self._format_lines(script, records)
+        result = [line.split('#', 1)[1] for line in result]
+        return result
+
+    def _format_lines(self, script: 'FormatSpecification',
+                      records: 'List[int]') -> 'List[str]':
         if len(records) > MAX_POSTINGS:
             raise IrbisError()
 
@@ -476,9 +517,7 @@ class Connection(ObjectWithError):
             if not response.check_return_code():
                 return []
 
-            result = response.utf_remaining_lines()
-            result = [line.split('#', 1)[1] for line in result]
-            return result
+            return response.utf_remaining_lines()
 
     def fulltext_search(self, search: SearchParameters,
                         fulltext: TextParameters) -> \
@@ -659,6 +698,232 @@ class Connection(ObjectWithError):
                 self.server_version = result.version
             return result
 
+    def _iter_pages(self, query: ClientQuery,
+                    handle: 'PageHandler[T]',
+                    prefetch: bool = True) -> 'Iterator[T]':
+        """
+        Выполнение цепочки запросов, в которой следующий запрос
+        определяется ответом на предыдущий. Пока вызывающий код
+        обрабатывает текущую порцию, следующий запрос выполняется
+        в фоновом потоке.
+
+        :param query: Первый запрос
+        :param handle: Разбор ответа: порция данных и следующий запрос
+            (None, если запросов больше нет)
+        :param prefetch: Выполнять следующий запрос заранее
+        :return: Итератор порций данных
+        """
+        # Запросы формируются в текущем потоке, чтобы их номера
+        # шли по порядку; в фоне выполняется лишь обмен с сервером
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        future = executor.submit(self.execute, query) if executor else None
+        next_query: 'Optional[ClientQuery]' = query
+        try:
+            while next_query:
+                if future:
+                    response = future.result()
+                else:
+                    response = self.execute(next_query)
+                page, next_query = handle(response)
+                future = None
+                if executor and next_query:
+                    future = executor.submit(self.execute, next_query)
+                yield page
+        finally:
+            if executor:
+                if future:
+                    future.cancel()
+                executor.shutdown(wait=True)
+
+    def iter_postings(self, terms: 'Union[str, Iterable[str]]',
+                      page_size: int = 1000, prefetch: bool = True,
+                      fmt: 'Optional[FormatSpecification]' = None,
+                      database: 'Optional[str]' = None) \
+            -> 'Iterator[PostingList]':
+        """
+        Постраничное считывание постингов для указанных термов.
+        Постинги каждого терма запрашиваются порциями (с помощью
+        смещения first), термы обрабатываются по очереди.
+
+        :param terms: Терм или перечень термов
+        :param page_size: Количество постингов в одной порции
+        :param prefetch: Запрашивать следующую порцию заранее
+        :param fmt: Опциональный формат
+        :param database: База данных (по умолчанию -- текущая)
+        :return: Итератор непустых порций постингов
+        """
+        if not self.check_connection():
+            return
+
+        terms = [terms] if isinstance(terms, str) else list(terms)
+        if not terms:
+            return
+
+        assert page_size > 0
+        database = database or self.database
+        position = [0, 1]  # Индекс терма и смещение внутри него
+
+        def make_query() -> ClientQuery:
+            parameters = PostingParameters(terms[position[0]], fmt)
+            parameters.database = database
+            parameters.first = position[1]
+            parameters.number = page_size
+            return self._read_postings_query(parameters)
+
+        def handle(response: ServerResponse) \
+                -> 'Tuple[PostingList, Optional[ClientQuery]]':
+            with response:
+                page = self._read_postings_response(response)
+            if len(page) < page_size:
+                position[0] += 1
+                position[1] = 1
+            else:
+                position[1] += page_size
+            if position[0] >= len(terms):
+                return page, None
+            return page, make_query()
+
+        for page in self._iter_pages(make_query(), handle, prefetch):
+            if page:
+                yield page
+
+    def iter_search_format(self, expression: 'Any',
+                           format_specification: 'Any', *,
+                           page_size: int = 100, limit: int = 0,
+                           prefetch: bool = False) -> 'Iterator[str]':
+        """
+        Поиск записей с расформатированием, выдаваемых по мере
+        получения страниц от сервера. Если вызывающий код прекратил
+        обход, оставшиеся записи с сервера не запрашиваются.
+
+        :param expression: Поисковое выражение.
+        :param format_specification: Спецификация формата.
+        :param page_size: Количество записей в одной странице.
+        :param limit: Ограничение на количество записей (0 - нет).
+        :param prefetch: Запрашивать следующую страницу заранее.
+        :return: Итератор расформатированных записей.
+        """
+        if not self.check_connection():
+            return
+
+        for lines in self._iter_search(expression, format_specification,
+                                       page_size, limit, prefetch):
+            for line in lines:
+                parts = line.split('#', 2)
+                if len(parts) > 1 and parts[1]:
+                    yield parts[1]
+
+    def iter_search_read(self, expression: 'Any', *, page_size: int = 100,
+                         limit: int = 0,
+                         tags: 'Optional[Iterable[int]]' = None,
+                         prefetch: bool = False,
+                         lazy: bool = False) -> 'Iterator[Record]':
+        """
+        Поиск и считывание записей, выдаваемых по мере получения
+        страниц от сервера. Если вызывающий код прекратил обход,
+        оставшиеся записи с сервера не запрашиваются.
+
+        :param expression: Поисковое выражение.
+        :param page_size: Количество записей в одной странице.
+        :param limit: Ограничение на количество записей (0 - нет).
+        :param tags: Метки полей, которые нужно загрузить (опционально).
+        :param prefetch: Запрашивать следующую страницу заранее.
+        :param lazy: Выдавать LazyRecord (поля разбираются
+            при первом обращении).
+        :return: Итератор записей.
+        """
+        if not self.check_connection():
+            return
+
+        specification = ALL if tags is None else projection_format(tags)
+        for lines in self._iter_search(expression, specification,
+                                       page_size, limit, prefetch):
+            for line in lines:
+                yield self._found_record(line, tags, lazy)
+
+    def iter_terms(self, start: str, prefix_stop: 'Union[bool, str]' = True,
+                   *, page_size: int = 100, reverse: bool = False,
+                   prefetch: bool = True,
+                   database: 'Optional[str]' = None) \
+            -> 'Iterator[TermInfo]':
+        """
+        Постраничный обход поискового словаря, начиная с указанного терма.
+        Пока вызывающий код обрабатывает текущую порцию термов,
+        следующая порция запрашивается в фоновом потоке.
+
+        :param start: Стартовый терм, например, "A=ПУШКИН"
+        :param prefix_stop: True -- остановиться на выходе за пределы
+            префикса стартового терма (до знака "=" включительно),
+            строка -- за пределы указанного префикса,
+            False -- обойти словарь до конца
+        :param page_size: Количество термов в одной порции
+        :param reverse: Обход в обратном направлении
+        :param prefetch: Запрашивать следующую порцию заранее
+        :param database: База данных (по умолчанию -- текущая)
+        :return: Итератор термов
+        """
+        if not self.check_connection():
+            return
+
+        pager = TermPager(start, prefix_stop, page_size, reverse,
+                          database or self.database)
+
+        def handle(response: ServerResponse) \
+                -> 'Tuple[List[TermInfo], Optional[ClientQuery]]':
+            with response:
+                page = self._read_terms_response(response)
+            terms = pager.accept(page)
+            if pager.done:
+                return terms, None
+            return terms, self._read_terms_query(pager.parameters())
+
+        query = self._read_terms_query(pager.parameters())
+        for terms in self._iter_pages(query, handle, prefetch):
+            yield from terms
+
+    async def iter_terms_async(self, start: str,
+                               prefix_stop: 'Union[bool, str]' = True,
+                               *, page_size: int = 100, reverse: bool = False,
+                               database: 'Optional[str]' = None) \
+            -> 'AsyncIterator[TermInfo]':
+        """
+        Асинхронный постраничный обход поискового словаря.
+        Следующая порция термов запрашивается, пока вызывающий код
+        обрабатывает текущую.
+
+        :param start: Стартовый терм, например, "A=ПУШКИН"
+        :param prefix_stop: True -- остановиться на выходе за пределы
+            префикса стартового терма, строка -- за пределы
+            указанного префикса, False -- обойти словарь до конца
+        :param page_size: Количество термов в одной порции
+        :param reverse: Обход в обратном направлении
+        :param database: База данных (по умолчанию -- текущая)
+        :return: Асинхронный итератор термов
+        """
+        if not self.check_connection():
+            return
+
+        pager = TermPager(start, prefix_stop, page_size, reverse,
+                          database or self.database)
+        query = self._read_terms_query(pager.parameters())
+        task: 'Optional[asyncio.Future]' = \
+            asyncio.ensure_future(self.execute_async(query))
+        try:
+            while task:
+                response = await task
+                page = self._read_terms_response(response)
+                response.close()
+                terms = pager.accept(page)
+                task = None
+                if not pager.done:
+                    query = self._read_terms_query(pager.parameters())
+                    task = asyncio.ensure_future(self.execute_async(query))
+                for term in terms:
+                    yield term
+        finally:
+            if task:
+                task.cancel()
+
     def list_databases(self, specification: str) \
             -> 'List[DatabaseInfo]':
         """
@@ -1042,41 +1307,55 @@ class Connection(ObjectWithError):
             result.parse(text)
             return result
 
+    def _read_postings_query(self, parameters: PostingParameters) \
+            -> ClientQuery:
+        """
+        Формирование запроса на считывание постингов.
+
+        :param parameters: Параметры постингов
+        :return: Клиентский запрос
+        """
+        database = parameters.database or self.database or throw_value_error()
+        query = ClientQuery(self, READ_POSTINGS)
+        query.ansi(database).add(parameters.number).add(parameters.first)
+        query.format(parameters.fmt)
+        for term in parameters.terms:
+            query.utf(term)
+        return query
+
+    @staticmethod
+    def _read_postings_response(response: ServerResponse) -> PostingList:
+        """
+        Разбор ответа сервера на запрос постингов.
+
+        :param response: Ответ сервера
+        :return: Компактный список постингов
+        """
+        if not response.check_return_code(READ_TERMS_CODES):
+            return PostingList()
+
+        return PostingList.parse(response.utf_remaining_lines())
+
     def read_postings(self, parameters: 'Union[PostingParameters, str]',
-                      fmt: 'Optional[str]' = None) -> 'List[TermPosting]':
+                      fmt: 'Optional[FormatSpecification]' = None) \
+            -> PostingList:
         """
         Считывание постингов для указанных термов из поискового словаря.
 
         :param parameters: Параметры постингов или терм
         :param fmt: Опциональный формат
-        :return: Список постингов
+        :return: Компактный список постингов
         """
         if not self.check_connection():
-            return []
+            return PostingList()
 
         if isinstance(parameters, str):
             parameters = PostingParameters(parameters)
             parameters.fmt = fmt
 
-        database = parameters.database or self.database or throw_value_error()
-        query = ClientQuery(self, READ_POSTINGS)
-        query.ansi(database).add(parameters.number)
-        query.add(parameters.first).ansi(parameters.fmt)
-        for term in parameters.terms:
-            query.utf(term)
+        query = self._read_postings_query(parameters)
         with self.execute(query) as response:
-            result: 'List[TermPosting]' = []
-            if not response.check_return_code(READ_TERMS_CODES):
-                return result
-
-            while True:
-                line = response.utf()
-                if not line:
-                    break
-                posting = TermPosting()
-                posting.parse(line)
-                result.append(posting)
-            return result
+            return self._read_postings_response(response)
 
     def read_raw_record(self, mfn: int) -> 'Optional[RawRecord]':
         """
@@ -1103,7 +1382,8 @@ class Connection(ObjectWithError):
 
         return result
 
-    def read_record(self, mfn: int, version: int = 0) -> 'Optional[Record]':
+    def read_record(self, mfn: int, version: int = 0,
+                    lazy: bool = False) -> 'Optional[Record]':
         """
         Чтение записи с указанным MFN с сервера. Обратите внимание,
         запрос версии `0` означает выдачу текущей версии записи
@@ -1112,6 +1392,8 @@ class Connection(ObjectWithError):
 
         :param mfn: MFN
         :param version: версия
+        :param lazy: Выдать LazyRecord (поля разбираются
+            при первом обращении).
         :return: Прочитанная запись
         """
         if not self.check_connection():
@@ -1128,7 +1410,7 @@ class Connection(ObjectWithError):
                 return None
 
             text = response.utf_remaining_lines()
-            result = Record()
+            result = LazyRecord() if lazy else Record()
             result.database = self.database
             result.parse(text)
 
@@ -1190,11 +1472,18 @@ class Connection(ObjectWithError):
                 result.append(one)
         return result
 
-    def read_records(self, *mfns: int) -> 'List[Record]':
+    def read_records(self, *mfns: int,
+                     tags: 'Optional[Iterable[int]]' = None,
+                     lazy: bool = False) -> 'List[Record]':
         """
         Чтение записей с указанными MFN с сервера.
 
         :param mfns: Перечень MFN
+        :param tags: Метки полей, которые нужно загрузить (опционально).
+            Если метки заданы, сервер выдает только эти поля,
+            а записи помечаются как неполные (partial).
+        :param lazy: Выдавать LazyRecord (поля разбираются
+            при первом обращении).
         :return: Список записей
         """
         if not self.check_connection():
@@ -1205,8 +1494,12 @@ class Connection(ObjectWithError):
         if not array:
             return []
 
+        if tags is not None:
+            lines = self._format_lines(projection_format(tags), array)
+            return [self._projected_record(line, lazy) for line in lines]
+
         if len(array) == 1:
-            record = self.read_record(array[0])
+            record = self.read_record(array[0], lazy=lazy)
             return [record] if record else []
 
         lines = self.format_records(ALL, array)
@@ -1215,7 +1508,7 @@ class Connection(ObjectWithError):
             parts = line.split(OTHER_DELIMITER)
             if parts:
                 parts = [x for x in parts[1:] if x]
-                record = Record()
+                record = LazyRecord() if lazy else Record()
                 record.parse(parts)
                 if record:
                     record.database = self.database
@@ -1223,6 +1516,26 @@ class Connection(ObjectWithError):
 
         return result
 
+    def _projected_record(self, line: str, lazy: bool = False) -> Record:
+        """
+        Разбор неполной записи, полученной с помощью projection_format.
+
+        :param line: Строка вида "MFN#поле\x1Fполе\x1F..."
+        :param lazy: Создать LazyRecord.
+        :return: Неполная запись
+        """
+        parts = line.split('#', 1)
+        result = LazyRecord() if lazy else Record()
+        result.database = self.database
+        result.mfn = int(parts[0])
+        result.partial = True
+        if len(parts) > 1:
+            for text in parts[1].split(OTHER_DELIMITER):
+                if text:
+                    result.parse_line(text)
+        result.mark_clean()
+        return result
+
     def read_search_scenario(self,
                              specification: 'Union[FileSpecification, str]') \
             -> 'List[SearchScenario]':
@@ -1245,19 +1558,17 @@ class Connection(ObjectWithError):
             result = SearchScenario.parse(ini)
             return result
 
-    def read_terms(self,
-                   parameters: 'Union[TermParameters, str, Tuple[str, int]]') \
-            -> 'List[TermInfo]':
+    def _read_terms_query(
+            self,
+            parameters: 'Union[TermParameters, str, Tuple[str, int]]') \
+            -> ClientQuery:
         """
-        Получение термов поискового словаря.
+        Формирование запроса на получение термов поискового словаря.
 
         :param parameters: Параметры термов или терм
             или кортеж "терм, количество"
-        :return: Список термов
+        :return: Клиентский запрос
         """
-        if not self.check_connection():
-            return []
-
         if isinstance(parameters, tuple):
             parameters2 = TermParameters(parameters[0])
             parameters2.number = parameters[1]
@@ -1272,13 +1583,58 @@ class Connection(ObjectWithError):
         database = parameters.database or self.database or throw_value_error()
         command = READ_TERMS_REVERSE if parameters.reverse else READ_TERMS
         query = ClientQuery(self, command)
-        query.ansi(database).utf(parameters.start)
-        query.add(parameters.number).ansi(parameters.format)
+        query.ansi(database).utf(parameters.start).add(parameters.number)
+        query.format(parameters.format)
+        return query
+
+    @staticmethod
+    def _read_terms_response(response: ServerResponse) -> TermList:
+        """
+        Разбор ответа сервера на запрос термов.
+
+        :param response: Ответ сервера
+        :return: Компактный список термов
+        """
+        response.check_return_code(READ_TERMS_CODES)
+        lines = response.utf_remaining_lines()
+        return TermList.parse(lines)
+
+    def read_terms(self,
+                   parameters: 'Union[TermParameters, str, Tuple[str, int]]') \
+            -> TermList:
+        """
+        Получение термов поискового словаря.
+
+        :param parameters: Параметры термов или терм
+            или кортеж "терм, количество"
+        :return: Компактный список термов
+        """
+        if not self.check_connection():
+            return TermList()
+
+        query = self._read_terms_query(parameters)
         with self.execute(query) as response:
-            response.check_return_code(READ_TERMS_CODES)
-            lines = response.utf_remaining_lines()
-            result = TermInfo.parse(lines)
-            return result
+            return self._read_terms_response(response)
+
+    async def read_terms_async(
+            self,
+            parameters: 'Union[TermParameters, str, Tuple[str, int]]') \
+            -> TermList:
+        """
+        Асинхронное получение термов поискового словаря.
+
+        :param parameters: Параметры термов или терм
+            или кортеж "терм, количество"
+        :return: Компактный список термов
+        """
+        if not self.check_connection():
+            return TermList()
+
+        query = self._read_terms_query(parameters)
+        response = await self.execute_async(query)
+        result = self._read_terms_response(response)
+        response.close()
+        return result
 
     def read_text_file(self, specification: 'Union[FileSpecification, str]') \
             -> str:
@@ -1569,7 +1925,7 @@ class Connection(ObjectWithError):
             return []
 
         if not isinstance(parameters, SearchParameters):
-            parameters = SearchParameters(str(parameters))
+            parameters = SearchParameters(parameters)
 
         query = ClientQuery(self, SEARCH)
         parameters.encode(query, self)
@@ -1578,13 +1934,7 @@ class Connection(ObjectWithError):
             return []
 
         _ = response.number()  # Число найденных записей
-        result: 'List[int]' = []
-        while 1:
-            line = response.ansi()
-            if not line:
-                break
-            mfn = int(line)
-            result.append(mfn)
+        result: 'List[int]' = response.remaining_numbers().tolist()
         return result
 
     def search_all(self, expression: 'Any') -> 'List[int]':
@@ -1597,7 +1947,6 @@ class Connection(ObjectWithError):
             return []
 
         assert expression
-        expression = str(expression)
 
         result: 'List[int]' = []
         first: int = 1
@@ -1606,7 +1955,7 @@ class Connection(ObjectWithError):
         while 1:
             query = ClientQuery(self, SEARCH)
             query.ansi(self.database)
-            query.utf(expression)
+            query.expression(expression)
             query.add(10000)
             query.add(first)
             query.new_line()
@@ -1624,15 +1973,11 @@ class Connection(ObjectWithError):
             else:
                 _ = response.number()
 
-            while 1:
-                line = response.ansi()
-                if not line:
-                    break
-                mfn = int(line)
-                result.append(mfn)
-                first = first + 1
+            found = response.remaining_numbers()
+            result.extend(found)
+            first = first + len(found)
 
-            if first >= expected:
+            if not found or first >= expected:
                 return result
 
         return result
@@ -1649,7 +1994,7 @@ class Connection(ObjectWithError):
             return []
 
         if not isinstance(parameters, SearchParameters):
-            parameters = SearchParameters(str(parameters))
+            parameters = SearchParameters(parameters)
 
         query = ClientQuery(self, SEARCH)
         parameters.encode(query, self)
@@ -1658,13 +2003,7 @@ class Connection(ObjectWithError):
             return []
 
         _ = response.number()  # Число найденных записей
-        result: 'List[int]' = []
-        while 1:
-            line = response.ansi()
-            if not line:
-                break
-            mfn = int(line)
-            result.append(mfn)
+        result: 'List[int]' = response.remaining_numbers().tolist()
         response.close()
         return result
 
@@ -1679,11 +2018,9 @@ class Connection(ObjectWithError):
         if not self.check_connection():
             return 0
 
-        expression = str(expression)
-
         query = ClientQuery(self, SEARCH)
         query.ansi(self.database)
-        query.utf(expression)
+        query.expression(expression)
         query.add(0)
         query.add(0)
 
@@ -1704,11 +2041,9 @@ class Connection(ObjectWithError):
         if not self.check_connection():
             return 0
 
-        expression = str(expression)
-
         query = ClientQuery(self, SEARCH)
         query.ansi(self.database)
-        query.utf(expression)
+        query.expression(expression)
         query.add(0)
         query.add(0)
 
@@ -1732,7 +2067,7 @@ class Connection(ObjectWithError):
             return []
 
         if not isinstance(parameters, SearchParameters):
-            parameters = SearchParameters(str(parameters))
+            parameters = SearchParameters(parameters)
 
         query = ClientQuery(self, SEARCH)
         parameters.encode(query, self)
@@ -1752,6 +2087,76 @@ class Connection(ObjectWithError):
         return result
 
     # noinspection DuplicatedCode
+    def _search_query(self, expression: 'Any', first: int, number: int,
+                      format_specification: 'Any') -> ClientQuery:
+        """
+        Формирование запроса на поиск с расформатированием
+        найденных записей.
+
+        :param expression: Поисковое выражение.
+        :param first: Номер первой выдаваемой записи (с 1).
+        :param number: Количество выдаваемых записей (0 - все).
+        :param format_specification: Спецификация формата.
+        :return: Клиентский запрос.
+        """
+        query = ClientQuery(self, SEARCH)
+        query.ansi(self.database)
+        query.expression(expression)
+        query.add(number)
+        query.add(first)
+        if format_specification == ALL:
+            query.ansi(ALL)
+        else:
+            if not isinstance(format_specification, CompiledFormat):
+                format_specification = str(format_specification)
+            query.format(format_specification)
+        query.add(0)
+        query.add(0)
+        return query
+
+    def _iter_search(self, expression: 'Any', format_specification: 'Any',
+                     page_size: int, limit: int, prefetch: bool) \
+            -> 'Iterator[List[str]]':
+        """
+        Постраничный поиск с расформатированием: сервер выдает
+        не более page_size записей за раз, следующая страница
+        запрашивается, только когда вызывающий код до нее дошел
+        (или заранее, если задан prefetch).
+
+        :param expression: Поисковое выражение.
+        :param format_specification: Спецификация формата.
+        :param page_size: Количество записей в одной странице.
+        :param limit: Ограничение на общее количество записей (0 - нет).
+        :param prefetch: Запрашивать следующую страницу заранее.
+        :return: Итератор страниц (строк ответа сервера).
+        """
+        assert page_size > 0
+        assert isinstance(limit, int)
+
+        def make_query(first: int) -> ClientQuery:
+            number = page_size
+            if limit:
+                number = min(number, limit - first + 1)
+            return self._search_query(expression, first, number,
+                                      format_specification)
+
+        position = [1]  # Номер первой записи следующей страницы
+
+        def handle(response: ServerResponse) \
+                -> 'Tuple[List[str], Optional[ClientQuery]]':
+            with response:
+                if not response.check_return_code():
+                    return [], None
+                found = response.number()
+                lines = response.utf_remaining_lines()
+            position[0] += len(lines)
+            first = position[0]
+            if not lines or first > found or (limit and first > limit):
+                return lines, None
+            return lines, make_query(first)
+
+        return self._iter_pages(make_query(1), handle, prefetch)
+
     def search_format(self, expression: 'Any', format_specification: 'Any',
                       limit: int = 0,) -> 'List[str]':
         """
@@ -1759,7 +2164,8 @@ class Connection(ObjectWithError):
 
         :param expression: Поисковое выражение.
         :param format_specification: Спецификация формата.
-        :param limit: Ограничение на количество выдаваемых записей.
+        :param limit: Ограничение на количество выдаваемых записей
+            (передается серверу).
         :return: Список расформатированных записей.
         """
         if not self.check_connection():
@@ -1767,18 +2173,8 @@ class Connection(ObjectWithError):
 
         assert isinstance(limit, int)
 
-        expression = str(expression)
-        format_specification = str(format_specification)
-
-        query = ClientQuery(self, SEARCH)
-        query.ansi(self.database)
-        query.utf(expression)
-        query.add(0)
-        query.add(1)
-        query.format(format_specification)
-        query.add(0)
-        query.add(0)
-
+        query = self._search_query(expression, 1, limit,
+                                   format_specification)
         response = self.execute(query)
         if not response.check_return_code():
             return []
@@ -1799,13 +2195,37 @@ class Connection(ObjectWithError):
 
         return result
 
+    def search_local(self, expression: 'Any',
+                     page_size: int = 10000) -> 'List[int]':
+        """
+        Поиск записей с вычислением выражения на стороне клиента
+        по постингам термов. В отличие от search, результат
+        не ограничен MAX_POSTINGS.
+
+        :param expression: Поисковое выражение (строка или Search).
+        :param page_size: Размер порции при считывании постингов.
+        :return: Отсортированный список найденных MFN.
+        """
+        if not self.check_connection():
+            return []
+
+        return LocalSearch(self, page_size).search(expression)
+
     # noinspection DuplicatedCode
-    def search_read(self, expression: 'Any', limit: int = 0) -> 'List[Record]':
+    def search_read(self, expression: 'Any', limit: int = 0,
+                    tags: 'Optional[Iterable[int]]' = None,
+                    lazy: bool = False) -> 'List[Record]':
         """
         Поиск и считывание записей.
 
         :param expression: Поисковый запрос.
-        :param limit: Лимит считываемых записей (0 - нет).
+        :param limit: Лимит считываемых записей (0 - нет),
+            передается серверу.
+        :param tags: Метки полей, которые нужно загрузить (опционально).
+            Если метки заданы, сервер выдает только эти поля,
+            а записи помечаются как неполные (partial).
+        :param lazy: Выдавать LazyRecord (поля разбираются
+            при первом обращении).
         :return: Список найденных записей.
         """
         if not self.check_connection():
@@ -1813,17 +2233,8 @@ class Connection(ObjectWithError):
 
         assert isinstance(limit, int)
 
-        expression = str(expression)
-
-        query = ClientQuery(self, SEARCH)
-        query.ansi(self.database)
-        query.utf(expression)
-        query.add(0)
-        query.add(1)
-        query.ansi(ALL)
-        query.add(0)
-        query.add(0)
-
+        specification = ALL if tags is None else projection_format(tags)
+        query = self._search_query(expression, 1, limit, specification)
         response = self.execute(query)
         if not response.check_return_code():
             return []
@@ -1834,15 +2245,30 @@ class Connection(ObjectWithError):
             line = response.utf()
             if not line:
                 break
-            lines = line.split("\x1F")
-            lines = lines[1:]
-            record = Record()
-            record.parse(lines)
-            result.append(record)
+            result.append(self._found_record(line, tags, lazy))
             if limit and len(result) >= limit:
                 break
         return result
 
+    def _found_record(self, line: str,
+                      tags: 'Optional[Iterable[int]]' = None,
+                      lazy: bool = False) -> Record:
+        """
+        Разбор записи из ответа на поиск с расформатированием.
+
+        :param line: Строка ответа сервера.
+        :param tags: Метки полей, если запрашивались не все поля.
+        :param lazy: Создать LazyRecord.
+        :return: Запись.
+        """
+        if tags is not None:
+            return self._projected_record(line, lazy)
+        lines = line.split("\x1F")
+        lines = lines[1:]
+        record = LazyRecord() if lazy else Record()
+        record.parse(lines)
+        return record
+
     def throw_on_error(self) -> None:
         """
         Бросает исключение, если произошла ошибка
@@ -2009,13 +2435,15 @@ class Connection(ObjectWithError):
         database = record.database or self.database or throw_value_error()
         if not record:
             raise ValueError()
+        if record.partial:
+            raise ValueError('Неполную запись нельзя сохранять')
 
         assert isinstance(record, RawRecord)
         assert isinstance(database, str)
 
         query = ClientQuery(self, UPDATE_RECORD)
         query.ansi(database).add(int(lock)).add(int(actualize))
-        query.utf(IRBIS_DELIMITER.join(record.encode()))
+        query.record(record)
         with self.execute(query) as response:
             if not response.check_return_code():
                 return 0
@@ -2043,19 +2471,23 @@ class Connection(ObjectWithError):
         database = record.database or self.database or throw_value_error()
         if not record:
             raise ValueError()
+        if record.partial:
+            raise ValueError('Неполную запись нельзя сохранять')
 
         assert isinstance(record, Record)
         assert isinstance(database, str)
 
         query = ClientQuery(self, UPDATE_RECORD)
         query.ansi(database).add(int(lock)).add(int(actualize))
-        query.utf(IRBIS_DELIMITER.join(record.encode()))
+        query.record(record)
         with self.execute(query) as response:
             if not response.check_return_code():
                 return 0
 
             result = response.return_code  # Новый максимальный MFN
-            if not dont_parse:
+            if dont_parse:
+                record.mark_clean()
+            else:
                 first_line = response.utf()
                 text = short_irbis_to_lines(response.utf())
                 text.insert(0, first_line)
@@ -2083,6 +2515,8 @@ class Connection(ObjectWithError):
         database = record.database or self.database or throw_value_error()
         if not record:
             raise ValueError()
+        if record.partial:
+            raise ValueError('Неполную запись нельзя сохранять')
 
         assert isinstance(record, Record)
         assert isinstance(database, str)
@@ -2092,11 +2526,13 @@ class Connection(ObjectWithError):
 
         query = ClientQuery(self, UPDATE_RECORD)
         query.ansi(database).add(int(lock)).add(int(actualize))
-        query.utf(IRBIS_DELIMITER.join(record.encode()))
+        query.record(record)
         response = await self.execute_async(query)
         response.check_return_code()
         result = response.return_code  # Новый максимальный MFN
-        if not dont_parse:
+        if dont_parse:
+            record.mark_clean()
+        else:
             first_line = response.utf()
             text = short_irbis_to_lines(response.utf())
             text.insert(0, first_line)
@@ -2105,36 +2541,232 @@ class Connection(ObjectWithError):
         response.close()
         return result
 
-    def write_records(self, records: 'List[Record]') -> bool:
+    def write_records(self, records: 'Iterable[Record]',
+                      only_dirty: bool = False, *,
+                      chunk_size: int = 1000,
+                      chunk_bytes: int = 4 * 1024 * 1024,
+                      workers: int = 1,
+                      dont_parse: bool = False) -> WriteResult:
         """
-        Сохранение нескольких записей на сервере.
+        Сохранение нескольких записей на сервере порциями.
         Записи могут принадлежать разным базам.
+        Запросы порций формируются по мере отправки, поэтому в памяти
+        одновременно находится не более workers + 1 запросов.
+        Сохраненные записи получают от сервера MFN, статус и версию
+        (а если не задан dont_parse -- и поля после актуализации)
+        и считаются неизмененными (см. Record.dirty).
+
+        При workers > 1 на сервере регистрируются дополнительные
+        подключения с теми же параметрами (по одному на каждый
+        рабочий поток сверх первого) и отключаются по окончании
+        сохранения. Через каждое подключение запросы идут по одному
+        и по порядку номеров. Если сервер не принимает очередное
+        подключение, сохранение идет через уже установленные.
+        Ответы разбираются в вызывающем потоке, а last_error
+        выставляется по окончании сохранения (см. WriteResult.error_code).
 
         :param records: Записи для сохранения.
-        :return: Результат.
-        """
+        :param only_dirty: Сохранять только измененные записи?
+        :param chunk_size: Наибольшее количество записей в одном запросе.
+        :param chunk_bytes: Размер запроса в байтах, по достижении
+            которого порция закрывается.
+        :param workers: Количество одновременно выполняемых запросов.
+        :param dont_parse: Не разбирать поля записей из ответа сервера?
+        :return: Результат (истинен, если все записи сохранены).
+        """
+        result = WriteResult()
+        records = list(records)
+        if only_dirty:
+            records = [record for record in records if record.dirty]
+
         if not self.check_connection():
-            return False
+            result.error_code = NOT_CONNECTED
+            result.add_failed(records, NOT_CONNECTED)
+            return result
 
-        if not records:
-            return True
+        assert chunk_size > 0 and chunk_bytes > 0 and workers > 0
+        if any(record.partial for record in records):
+            raise ValueError('Неполную запись нельзя сохранять')
+
+        started = time.perf_counter()
+        connections = [self]
+        if workers > 1 and len(records) > 1:
+            connections += self._worker_connections(workers - 1)
+        try:
+            self._send_chunks(self._record_chunks(records, chunk_size,
+                                                  chunk_bytes, connections),
+                              connections, result, dont_parse)
+        finally:
+            for connection in connections[1:]:
+                connection.disconnect()
+        result.elapsed = time.perf_counter() - started
+        self.last_error = result.error_code
+        return result
 
-        if len(records) == 1:
-            return bool(self.write_record(records[0]))
+    def _send_chunks(self,
+                     chunks: 'Iterator[Tuple[List[Record], int, ClientQuery]]',
+                     connections: 'List[Connection]', result: WriteResult,
+                     dont_parse: bool) -> None:
+        """
+        Отправка запросов на сохранение порций и разбор ответов.
+
+        :param chunks: Порции записей с номерами подключений и запросами
+        :param connections: Подключения, выполняющие запросы
+        :param result: Пополняемый результат
+        :param dont_parse: Не разбирать поля записей?
+        :return: None
+        """
+        # Подключение не потокобезопасно, поэтому у каждого
+        # подключения свой поток, выполняющий его запросы по порядку
+        executors = [ThreadPoolExecutor(max_workers=1)
+                     for _ in connections]
+        pending: 'Deque[Tuple[List[Record], Future]]' = deque()
+        try:
+            # Следующая порция кодируется, пока предыдущие
+            # передаются серверу
+            for chunk, index, query in chunks:
+                result.bytes_sent += len(query)
+                future = executors[index].submit(
+                    self._timed_execute, connections[index], query)
+                pending.append((chunk, future))
+                while len(pending) > len(connections):
+                    self._finish_chunk(*pending.popleft(), result,
+                                       dont_parse)
+            while pending:
+                self._finish_chunk(*pending.popleft(), result, dont_parse)
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+
+    @staticmethod
+    def _timed_execute(connection: 'Connection', query: ClientQuery) \
+            -> 'Tuple[ServerResponse, float]':
+        """
+        Выполнение запроса с замером времени обмена с сервером.
+
+        :param connection: Подключение, выполняющее запрос
+        :param query: Запрос
+        :return: Ответ сервера и время в секундах
+        """
+        started = time.perf_counter()
+        response = connection.execute(query)
+        return response, time.perf_counter() - started
 
-        query = ClientQuery(self, "6")
-        query.add(0).add(1)
+    def _worker_connections(self, count: int) -> 'List[Connection]':
+        """
+        Дополнительные подключения к серверу с теми же параметрами
+        для параллельного сохранения записей.
+
+        :param count: Нужное количество подключений
+        :return: Установленные подключения (возможно, меньше count)
+        """
+        result: 'List[Connection]' = []
+        for _ in range(count):
+            connection = Connection(
+                connection_string=self.to_connection_string())
+            try:
+                connection.connect()
+            except (IrbisError, OSError, ValueError):
+                break
+            if not connection.connected:
+                break
+            result.append(connection)
+        return result
 
+    def _record_chunks(self, records: 'List[Record]', chunk_size: int,
+                       chunk_bytes: int, connections: 'List[Connection]') \
+            -> 'Iterator[Tuple[List[Record], int, ClientQuery]]':
+        """
+        Разбиение записей на порции и формирование запросов
+        на их сохранение. Порции распределяются по подключениям
+        поочередно. Запросы формируются в текущем потоке,
+        чтобы их номера шли по порядку.
+
+        :param records: Записи
+        :param chunk_size: Наибольшее количество записей в порции
+        :param chunk_bytes: Размер запроса, по достижении
+            которого порция закрывается
+        :param connections: Подключения, выполняющие запросы
+        :return: Итератор троек "записи порции, номер подключения, запрос"
+        """
+        chunk: 'List[Record]' = []
+        query: 'Optional[ClientQuery]' = None
+        index = 0
         for record in records:
-            database = record.database or self.database
-            line = database + IRBIS_DELIMITER + \
-                IRBIS_DELIMITER.join(record.encode())
-            query.utf(line)
+            if query is None:
+                query = ClientQuery(connections[index], SAVE_RECORD_GROUP) \
+                    .add(0).add(1)
+            query.record(record, record.database or self.database)
+            chunk.append(record)
+            if len(chunk) >= chunk_size or len(query) >= chunk_bytes:
+                yield chunk, index, query
+                chunk, query = [], None
+                index = (index + 1) % len(connections)
+        if query is not None:
+            yield chunk, index, query
+
+    def _finish_chunk(self, chunk: 'List[Record]', future: 'Future',
+                      result: WriteResult, dont_parse: bool) -> None:
+        """
+        Разбор ответа сервера на сохранение порции записей.
+        Сервер выдает по строке на каждую запись: запись
+        в серверном представлении с коротким разделителем
+        (отрицательный MFN -- код ошибки).
+
+        :param chunk: Записи порции
+        :param future: Ответ сервера и время обмена
+        :param result: Пополняемый результат
+        :param dont_parse: Не разбирать поля записей?
+        :return: None
+        """
+        try:
+            response, elapsed = future.result()
+        except Exception as exception:  # pylint: disable=broad-except
+            result.add_failed(chunk, error=exception)
+            return
 
-        with self.execute(query) as response:
-            response.check_return_code()
+        result.chunk_times.append(elapsed)
+        with response:
+            if not response.check_return_code():
+                if not result.error_code:
+                    result.error_code = response.return_code
+                result.add_failed(chunk, response.return_code)
+                return
 
-        return True
+            for record in chunk:
+                code = self._written_record(record, response.utf(),
+                                            dont_parse)
+                one = RecordResult(record)
+                one.error_code = code
+                result.records.append(one)
+
+    def _written_record(self, record: Record, line: str,
+                        dont_parse: bool) -> int:
+        """
+        Обновление сохраненной записи по строке ответа сервера.
+
+        :param record: Запись
+        :param line: Строка ответа (пустая, если сервер
+            не сообщил подробностей)
+        :param dont_parse: Не разбирать поля записи?
+        :return: Код ошибки либо 0
+        """
+        text = short_irbis_to_lines(line) if line else []
+        mfn = safe_int(text[0].split('#', 1)[0]) if text else 0
+        if mfn < 0:
+            return mfn
+        if len(text) > 1 and not dont_parse:
+            record.database = record.database or self.database
+            record.parse(text)
+            return 0
+        if text:
+            header = Record()
+            header.parse(text[:2])
+            record.mfn = header.mfn
+            record.status = header.status
+            record.version = header.version
+        record.mark_clean()
+        return 0
 
     def write_text_file(self, *specification: FileSpecification) -> bool:
         """
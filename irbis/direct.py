@@ -8,7 +8,7 @@ from io import SEEK_SET
 from ctypes import BigEndianStructure, c_int32, c_uint16, c_uint32
 from typing import TYPE_CHECKING
 from irbis._common import change_extension, UTF
-from irbis.records import Field, RawRecord, Record
+from irbis.records import LazyRecord, RawRecord, Record
 if TYPE_CHECKING:
     from typing import List
 
@@ -192,19 +192,20 @@ class MstRecord:
             result.fields.append(line)
         return result
 
-    def decode_record(self) -> Record:
+    def decode_record(self, lazy: bool = False) -> Record:
         """
         Декодирование в полноценную запись.
+        :param lazy: Создать LazyRecord (поля разбираются
+            при первом обращении).
         :return:
         """
-        result = Record()
-        result.mfn = self.leader.mfn
-        result.version = self.leader.version
-        result.status = self.leader.status
-        for source in self.fields:
-            target = Field(source.tag)
-            target.headless_parse(source.value)
-            result.fields.append(target)
+        leader = self.leader
+        text = [str(leader.mfn) + '#' + str(leader.status),
+                '0#' + str(leader.version)]
+        text.extend(str(source.tag) + '#' + source.value
+                    for source in self.fields)
+        result = LazyRecord() if lazy else Record()
+        result.parse(text)
         return result
 
     def dump_fields(self) -> None:
@@ -498,14 +499,16 @@ class DirectAccess:
         mst_record = self.read_mst_record(mfn)
         return mst_record.decode_raw()
 
-    def read_record(self, mfn: int) -> Record:
+    def read_record(self, mfn: int, lazy: bool = False) -> Record:
         """
         Чтение полностью декодированной записи.
         :param mfn: MFN.
+        :param lazy: Выдать LazyRecord (поля разбираются
+            при первом обращении).
         :return:
         """
         mst_record = self.read_mst_record(mfn)
-        return mst_record.decode_record()
+        return mst_record.decode_record(lazy)
 
     def __enter__(self):
         return self
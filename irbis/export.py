@@ -10,7 +10,7 @@ Reading and writing plain text files in IRBIS format.
 from typing import TYPE_CHECKING
 from irbis._common import ANSI, STOP_MARKER, safe_str
 from irbis.error import IrbisError
-from irbis.records import SubField, Field, Record
+from irbis.records import Field, Record
 if TYPE_CHECKING:
     from typing import Iterable, Optional, List
 
@@ -23,7 +23,7 @@ def read_text_record(stream) -> 'Optional[Record]':
     :return: Запись или None
     """
 
-    result = Record()
+    fields = []
     while True:
         line: str = stream.readline()
         if not line:
@@ -38,13 +38,13 @@ def read_text_record(stream) -> 'Optional[Record]':
             break
         tag = int(parts[0])
         text = parts[1][1:]
-        field = Field(tag)
-        field.parse(text)
-        result.fields.append(field)
+        fields.append(Field.trusted(tag, text))
 
-    if not result.fields:  # Если в записи нет полей, возвращаем None
+    if not fields:  # Если в записи нет полей, возвращаем None
         return None
 
+    result = Record()
+    result.fields = fields
     return result
 
 
@@ -171,7 +171,8 @@ def read_iso_record(stream, charset: str = ANSI) -> 'Optional[Record]':
     base_address = parse_int(record[12:17])
 
     # Начинаем собственно конверсию
-    result = Record()
+    fields = []
+    delimiter = chr(SUBFIELD_DELIMITER)
 
     # Пошли по полям при помощи справочника
     directory = MARKER_LENGTH
@@ -182,48 +183,26 @@ def read_iso_record(stream, charset: str = ANSI) -> 'Optional[Record]':
         field_length = parse_int(record[directory + 3:directory + 7])
         field_offset = parse_int(record[directory + 7:directory + 12]) + \
             base_address
-        field = Field(tag)
-        result.fields.append(field)
-
         if tag < 10:
             # фиксированное поле
-            # не может содержать подполей и индикаторов
-            field.value = record[field_offset:field_offset +
-                                 field_length - 1].decode(charset)
+            # не может содержать подполей и индикаторов,
+            # поэтому текст (даже пустой) становится значением как есть
+            text = record[field_offset:field_offset + field_length - 1]
+            fields.append(Field.loaded(tag, text.decode(charset), []))
         else:
             # поле переменной длины
             # содержит два однобайтных индикатора
             # может содержать подполя
             start = field_offset + indicator_length
             stop = field_offset + field_length - indicator_length + 1
-            position = start
-
-            # ищем значение поля до первого разделителя
-            while position < stop:
-                if record[start] == SUBFIELD_DELIMITER:
-                    break
-                position += 1
-
-            # если есть текст до первого раздлителя, запоминаем его
-            if position != start:
-                field.value = record[start:position].decode(charset)
-
-            # просматриваем подполя
-            start = position
-            while start < stop:
-                position = start + 1
-                while position < stop:
-                    if record[position] == SUBFIELD_DELIMITER:
-                        break
-                    position += 1
-                subfield = SubField(chr(record[start + 1]),
-                                    record[start + 2:position].decode(charset))
-                field.subfields.append(subfield)
-                start = position
+            fields.append(Field.trusted(
+                tag, record[start:stop].decode(charset), delimiter))
 
         # переходим к следующему полю в справочнике
         directory += 12
 
+    result = Record()
+    result.fields = fields
     return result
 
 
@@ -322,7 +301,8 @@ def write_iso_record(stream, record: Record, encoding: str) -> None:
         # Кодируем поле
         if field.tag < 10:
             # В фиксированном поле не бывает подполей и индикаторов
-            encode_str(buffer, current_address, field.value, encoding)
+            current_address = encode_str(buffer, current_address,
+                                         field.value, encoding)
         else:
             # Два индикатора
             buffer[current_address + 0] = 32
@@ -0,0 +1,334 @@
+# coding: utf-8
+
+"""
+Федеративный поиск: одновременный поиск в нескольких базах данных
+на одном или нескольких серверах.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock
+from weakref import WeakKeyDictionary
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, Iterable, List, Optional, \
+        Set, Tuple, Union
+    from irbis.connection import Connection
+    TargetSpecification = Union['SearchTarget', Connection,
+                                Tuple[Connection, str]]
+
+
+class SearchTarget:
+    """
+    Цель федеративного поиска: подключение и база данных.
+    """
+
+    __slots__ = ('connection', 'database', 'timeout', 'name')
+
+    def __init__(self, connection: 'Connection',
+                 database: 'Optional[str]' = None,
+                 timeout: 'Optional[float]' = None,
+                 name: 'Optional[str]' = None) -> None:
+        self.connection: 'Connection' = connection
+        self.database: str = database or connection.database
+        self.timeout: 'Optional[float]' = timeout  # Секунды
+        self.name: str = name or (connection.host + ':'
+                                  + str(connection.port) + '/'
+                                  + self.database)
+
+    def __str__(self):
+        return self.name
+
+
+class TargetResult:
+    """
+    Результат поиска по одной цели.
+    """
+
+    __slots__ = ('target', 'result', 'error', 'error_code', 'elapsed',
+                 'timed_out')
+
+    def __init__(self, target: SearchTarget) -> None:
+        self.target: SearchTarget = target
+        self.result: 'Any' = None
+        self.error: 'Optional[BaseException]' = None
+        self.error_code: int = 0  # Код ошибки ИРБИС
+        self.elapsed: float = 0.0  # Секунды
+        self.timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """
+        Поиск по цели завершился успешно?
+        """
+        return not self.timed_out and self.error is None \
+            and self.error_code >= 0
+
+    def __str__(self):
+        if self.timed_out:
+            status = 'timeout'
+        elif self.error is not None:
+            status = repr(self.error)
+        elif self.error_code < 0:
+            status = 'error ' + str(self.error_code)
+        else:
+            status = 'ok'
+        return self.target.name + ': ' + status \
+            + f' ({self.elapsed:.3f} s)'
+
+
+class FederatedResult:
+    """
+    Результат федеративного поиска: объединенные результаты
+    и сведения о каждой цели.
+    """
+
+    __slots__ = ('items', 'targets')
+
+    def __init__(self, items: 'Any',
+                 targets: 'List[TargetResult]') -> None:
+        self.items: 'Any' = items
+        self.targets: 'List[TargetResult]' = targets
+
+    @property
+    def failures(self) -> 'List[TargetResult]':
+        """
+        Цели, поиск по которым не удался (в том числе по таймауту).
+        """
+        return [one for one in self.targets if not one.ok]
+
+    @property
+    def complete(self) -> bool:
+        """
+        Поиск успешно выполнен по всем целям?
+        """
+        return all(one.ok for one in self.targets)
+
+    def __str__(self):
+        return '\n'.join(str(one) for one in self.targets)
+
+
+# Блокировки подключений, удерживаемые между вызовами FederatedSearch.run
+_LOCKS: 'WeakKeyDictionary[Connection, Lock]' = WeakKeyDictionary()
+_LOCKS_GUARD = Lock()
+
+
+def _connection_lock(connection: 'Connection') -> 'Lock':
+    """
+    Блокировка, под которой федеративный поиск работает с подключением.
+
+    :param connection: Подключение
+    :return: Блокировка
+    """
+    with _LOCKS_GUARD:
+        result = _LOCKS.get(connection)
+        if result is None:
+            result = _LOCKS[connection] = Lock()
+        return result
+
+
+def _perform(action: 'Callable[[Connection], Any]',
+             target: SearchTarget) -> 'Tuple[Any, Any, int]':
+    """
+    Выполнение действия над подключением цели.
+
+    :param action: Действие
+    :param target: Цель
+    :return: Результат, исключение и код ошибки ИРБИС
+    """
+    connection = target.connection
+    connection.push_database(target.database)
+    try:
+        connection.last_error = 0
+        value = action(connection)
+        return value, None, connection.last_error
+    except Exception as exception:  # pylint: disable=broad-except
+        return None, exception, 0
+    finally:
+        connection.pop_database()
+
+
+class FederatedSearch:
+    """
+    Одновременный поиск по нескольким целям. Подключения
+    не потокобезопасны, поэтому цели, относящиеся к одному подключению,
+    обрабатываются в одном потоке по очереди, а разные подключения --
+    параллельно. Срок отсчитывается от начала обработки каждой цели.
+    Запрос к цели, не уложившейся в срок, не прерывается; пока он
+    не завершится, подключение занято (в том числе для последующих
+    вызовов run), а остальные цели этого подключения считаются
+    не уложившимися в срок.
+    """
+
+    __slots__ = ('targets', 'timeout', 'max_workers')
+
+    def __init__(self, targets: 'Iterable[TargetSpecification]',
+                 timeout: 'Optional[float]' = None,
+                 max_workers: 'Optional[int]' = None) -> None:
+        self.targets: 'List[SearchTarget]' = []
+        for target in targets:
+            if isinstance(target, tuple):
+                target = SearchTarget(target[0], target[1])
+            elif not isinstance(target, SearchTarget):
+                target = SearchTarget(target)
+            self.targets.append(target)
+        self.timeout: 'Optional[float]' = timeout  # По умолчанию, секунды
+        self.max_workers: 'Optional[int]' = max_workers
+
+    def run(self, action: 'Callable[[Connection], Any]') \
+            -> 'List[TargetResult]':
+        """
+        Выполнение действия для всех целей.
+
+        :param action: Действие (выполняется над подключением,
+            переключенным на базу данных цели)
+        :return: Результаты по каждой цели (в порядке целей)
+        """
+        targets = list(self.targets)
+        results = [TargetResult(target) for target in targets]
+        groups: 'Dict[int, List[int]]' = {}
+        for index, target in enumerate(targets):
+            groups.setdefault(id(target.connection), []).append(index)
+        if not groups:
+            return results
+
+        # Общее состояние защищено условной переменной
+        condition = Condition()
+        started: 'List[Optional[float]]' = [None] * len(targets)
+        outcomes: 'List[Optional[Tuple[Any, Any, int, float]]]' = \
+            [None] * len(targets)
+        abandoned = [False] * len(targets)
+        finished: 'Set[int]' = set()
+
+        def run_group(key: int, indexes: 'List[int]') -> None:
+            lock = _connection_lock(targets[indexes[0]].connection)
+            try:
+                for index in indexes:
+                    target = targets[index]
+                    with condition:
+                        if abandoned[index]:
+                            return
+                        begin = started[index] = time.perf_counter()
+                        condition.notify_all()
+                    # Подключение может быть еще занято целью,
+                    # не уложившейся в срок при предыдущем вызове
+                    with lock:
+                        if abandoned[index]:
+                            return
+                        outcome = _perform(action, target)
+                    with condition:
+                        outcomes[index] = outcome \
+                            + (time.perf_counter() - begin,)
+                        condition.notify_all()
+            finally:
+                with condition:
+                    finished.add(key)
+                    condition.notify_all()
+
+        def abandon(index: int) -> None:
+            abandoned[index] = True
+            results[index].timed_out = True
+
+        workers = self.max_workers or len(groups)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for key, indexes in groups.items():
+                executor.submit(run_group, key, indexes)
+            stuck: 'Set[int]' = set()  # Группы с зависшей целью
+            with condition:
+                while True:
+                    now = time.perf_counter()
+                    wake: 'Optional[float]' = None
+                    waiting = False
+                    for index, result in enumerate(results):
+                        outcome = outcomes[index]
+                        if abandoned[index]:
+                            continue
+                        if outcome is not None:
+                            result.result, result.error, \
+                                result.error_code, result.elapsed = outcome
+                            continue
+                        begin = started[index]
+                        if begin is None:
+                            # Все потоки заняты зависшими целями
+                            if len(stuck - finished) >= workers:
+                                abandon(index)
+                            else:
+                                waiting = True
+                            continue
+                        target = targets[index]
+                        timeout = target.timeout \
+                            if target.timeout is not None else self.timeout
+                        if timeout is None:
+                            waiting = True
+                            continue
+                        deadline = begin + timeout
+                        if now < deadline:
+                            waiting = True
+                            wake = deadline if wake is None \
+                                else min(wake, deadline)
+                            continue
+                        # Остальные цели подключения вовремя не начнутся
+                        key = id(target.connection)
+                        stuck.add(key)
+                        for other in groups[key]:
+                            if other >= index:
+                                abandon(other)
+                        result.elapsed = now - begin
+                    if not waiting:
+                        break
+                    condition.wait(None if wake is None else wake - now)
+        finally:
+            # Не дожидаемся целей, не уложившихся в отведенное время
+            executor.shutdown(wait=False)
+        return results
+
+    def search(self, expression: 'Any') -> FederatedResult:
+        """
+        Поиск записей по всем целям.
+
+        :param expression: Поисковое выражение
+        :return: Объединенный список пар "имя цели, MFN" без повторов
+        """
+        targets = self.run(lambda connection: connection.search(expression))
+        items: 'Dict[Tuple[str, int], None]' = {}
+        for one in targets:
+            if one.ok and one.result:
+                for mfn in one.result:
+                    items.setdefault((one.target.name, mfn))
+        return FederatedResult(list(items), targets)
+
+    def search_count(self, expression: 'Any') -> FederatedResult:
+        """
+        Количество найденных записей по всем целям.
+
+        :param expression: Поисковое выражение
+        :return: Суммарное количество (по успешно опрошенным целям)
+        """
+        targets = self.run(
+            lambda connection: connection.search_count(expression))
+        total = sum(one.result for one in targets if one.ok and one.result)
+        return FederatedResult(total, targets)
+
+    def search_format(self, expression: 'Any', format_specification: 'Any',
+                      limit: int = 0) -> FederatedResult:
+        """
+        Поиск и расформатирование записей по всем целям.
+
+        :param expression: Поисковое выражение
+        :param format_specification: Спецификация формата
+        :param limit: Ограничение на количество записей от одной цели
+        :return: Объединенный список строк без повторов
+        """
+        targets = self.run(lambda connection: connection.search_format(
+            expression, format_specification, limit))
+        items: 'Dict[str, None]' = {}
+        for one in targets:
+            if one.ok and one.result:
+                for line in one.result:
+                    items.setdefault(line)
+        return FederatedResult(list(items), targets)
+
+
+__all__ = ['FederatedResult', 'FederatedSearch', 'SearchTarget',
+           'TargetResult']
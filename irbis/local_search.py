@@ -0,0 +1,289 @@
+# coding: utf-8
+
+"""
+Локальное (на стороне клиента) вычисление поисковых выражений
+по постингам термов. Результат не ограничен MAX_POSTINGS сервера.
+"""
+
+from array import array
+from bisect import bisect_left
+from typing import TYPE_CHECKING
+from irbis.builder import normalize_search, SearchOperation, SearchText
+from irbis.terms import PostingList
+if TYPE_CHECKING:
+    from typing import Any, Dict, Iterable, List, Optional
+    from irbis.builder import SearchNode
+
+# Уровни детализации ключей: запись, поле (метка), повторение поля
+MFN_LEVEL = 0
+FIELD_LEVEL = 1
+REPEAT_LEVEL = 2
+
+# Ключ: (((MFN << 16) | метка) << 16) | повторение
+_SHIFT = 16
+_LIMIT = 1 << _SHIFT
+
+# При таком соотношении длин пересечение ищется двоичным поиском
+_GALLOP_RATIO = 8
+
+
+def intersect(first: array, second: array) -> array:
+    """
+    Пересечение двух отсортированных массивов без повторов.
+
+    :param first: Первый массив
+    :param second: Второй массив
+    :return: Отсортированный массив без повторов
+    """
+    if len(first) > len(second):
+        first, second = second, first
+    result = array(second.typecode)
+    if not first:
+        return result
+    if len(second) > _GALLOP_RATIO * len(first):
+        low, high = 0, len(second)
+        for value in first:
+            low = bisect_left(second, value, low, high)
+            if low == high:
+                break
+            if second[low] == value:
+                result.append(value)
+        return result
+
+    i = j = 0
+    first_len, second_len = len(first), len(second)
+    while i < first_len and j < second_len:
+        left, right = first[i], second[j]
+        if left < right:
+            i += 1
+        elif left > right:
+            j += 1
+        else:
+            result.append(left)
+            i += 1
+            j += 1
+    return result
+
+
+def union(first: array, second: array) -> array:
+    """
+    Объединение двух отсортированных массивов без повторов.
+
+    :param first: Первый массив
+    :param second: Второй массив
+    :return: Отсортированный массив без повторов
+    """
+    if not first:
+        return array(second.typecode, second)
+    if not second:
+        return array(first.typecode, first)
+    result = array(first.typecode)
+    append = result.append
+    i = j = 0
+    first_len, second_len = len(first), len(second)
+    while i < first_len and j < second_len:
+        left, right = first[i], second[j]
+        if left < right:
+            append(left)
+            i += 1
+        elif left > right:
+            append(right)
+            j += 1
+        else:
+            append(left)
+            i += 1
+            j += 1
+    result.extend(first[i:])
+    result.extend(second[j:])
+    return result
+
+
+def difference(first: array, second: array) -> array:
+    """
+    Разность двух отсортированных массивов без повторов.
+
+    :param first: Уменьшаемое
+    :param second: Вычитаемое
+    :return: Отсортированный массив без повторов
+    """
+    if not first or not second:
+        return array(first.typecode, first)
+    result = array(first.typecode)
+    append = result.append
+    i = j = 0
+    first_len, second_len = len(first), len(second)
+    while i < first_len and j < second_len:
+        left, right = first[i], second[j]
+        if left < right:
+            append(left)
+            i += 1
+        elif left > right:
+            j += 1
+        else:
+            i += 1
+            j += 1
+    result.extend(first[i:])
+    return result
+
+
+def _unique(keys: 'Iterable[int]') -> array:
+    return array('Q', sorted(set(keys)))
+
+
+def posting_keys(postings: PostingList, level: int) -> array:
+    """
+    Ключи постингов указанного уровня детализации.
+
+    :param postings: Постинги
+    :param level: Уровень детализации (MFN_LEVEL и т. д.)
+    :return: Отсортированный массив ключей без повторов
+    """
+    # Метка и повторение занимают по _SHIFT бит ключа;
+    # большие значения перекрыли бы соседние части ключа
+    if level > MFN_LEVEL and max(postings.tag, default=0) >= _LIMIT:
+        raise ValueError('Tag is too large for local search')
+    if level > FIELD_LEVEL \
+            and max(postings.occurrence, default=0) >= _LIMIT:
+        raise ValueError('Occurrence is too large for local search')
+    if level == MFN_LEVEL:
+        keys = _unique(postings.mfn)
+    elif level == FIELD_LEVEL:
+        keys = _unique((mfn << _SHIFT) | tag
+                       for mfn, tag in zip(postings.mfn, postings.tag))
+    else:
+        keys = _unique((((mfn << _SHIFT) | tag) << _SHIFT) | occurrence
+                       for mfn, tag, occurrence in zip(postings.mfn,
+                                                       postings.tag,
+                                                       postings.occurrence))
+    # MFN 0 -- постинг без данных
+    if keys and keys[0] >> (_SHIFT * level) == 0:
+        keys = keys[bisect_left(keys, 1 << (_SHIFT * level)):]
+    return keys
+
+
+def project(keys: array, level: int, target: int) -> array:
+    """
+    Огрубление ключей до указанного уровня детализации.
+
+    :param keys: Отсортированный массив ключей
+    :param level: Текущий уровень детализации
+    :param target: Требуемый уровень детализации
+    :return: Отсортированный массив ключей без повторов
+    """
+    if level == target:
+        return keys
+    shift = _SHIFT * (level - target)
+    return array('Q', dict.fromkeys(key >> shift for key in keys))
+
+
+class LocalSearch:
+    """
+    Вычисление поискового выражения на стороне клиента:
+    постинги термов считываются постранично, логические операции
+    и операции (G)/(F) выполняются слиянием отсортированных массивов.
+    """
+
+    __slots__ = ('connection', 'page_size', 'database', '_postings')
+
+    def __init__(self, connection: 'Any', page_size: int = 10000,
+                 database: 'Optional[str]' = None) -> None:
+        self.connection: 'Any' = connection
+        self.page_size: int = page_size
+        self.database: 'Optional[str]' = database
+        self._postings: 'Dict[str, PostingList]' = {}
+
+    def expand(self, text: str) -> 'List[str]':
+        """
+        Раскрытие терма с правым усечением в перечень термов словаря.
+
+        :param text: Терм (возможно, с усечением)
+        :return: Перечень термов
+        """
+        text = text.upper()
+        if not text.endswith('$'):
+            return [text]
+        prefix = text[:-1]
+        return [term.text for term in
+                self.connection.iter_terms(prefix, prefix,
+                                           page_size=self.page_size,
+                                           database=self.database)]
+
+    def postings(self, text: str) -> PostingList:
+        """
+        Постинги терма (с учетом усечения).
+
+        :param text: Терм
+        :return: Постинги
+        """
+        key = text.upper()
+        result = self._postings.get(key)
+        if result is None:
+            result = PostingList()
+            terms = self.expand(text)
+            if terms:
+                for page in self.connection.iter_postings(
+                        terms, self.page_size, database=self.database):
+                    result.extend(page)
+            self._postings[key] = result
+        return result
+
+    def keys(self, node: 'SearchNode', level: int = MFN_LEVEL) -> array:
+        """
+        Вычисление узла поискового выражения.
+
+        :param node: Узел дерева разбора
+        :param level: Требуемый уровень детализации
+        :return: Отсортированный массив ключей без повторов
+        """
+        if isinstance(node, SearchText):
+            raise ValueError('Unsupported search syntax: ' + node.text)
+        if not isinstance(node, SearchOperation):
+            return posting_keys(self.postings(node.text), level)
+
+        operator = node.operator
+        inner = level
+        if operator == '(G)':
+            inner = max(level, FIELD_LEVEL)
+        elif operator == '(F)':
+            inner = REPEAT_LEVEL
+
+        if operator == '+':
+            result = self.keys(node.items[0], inner)
+            for item in node.items[1:]:
+                result = union(result, self.keys(item, inner))
+        elif operator == '^':
+            result = self.keys(node.items[0], inner)
+            for item in node.items[1:]:
+                if not result:
+                    break
+                result = difference(result, self.keys(item, inner))
+        else:
+            result = self.keys(node.items[0], inner)
+            for item in node.items[1:]:
+                if not result:
+                    break
+                result = intersect(result, self.keys(item, inner))
+
+        return project(result, inner, level)
+
+    def search(self, expression: 'Any') -> 'List[int]':
+        """
+        Поиск записей.
+
+        :param expression: Поисковое выражение (строка или Search)
+        :return: Отсортированный список MFN
+        """
+        return self.keys(normalize_search(expression)).tolist()
+
+    def count(self, expression: 'Any') -> int:
+        """
+        Точное количество записей, удовлетворяющих выражению.
+
+        :param expression: Поисковое выражение (строка или Search)
+        :return: Количество записей
+        """
+        return len(self.keys(normalize_search(expression)))
+
+
+__all__ = ['difference', 'FIELD_LEVEL', 'intersect', 'LocalSearch',
+           'MFN_LEVEL', 'posting_keys', 'project', 'REPEAT_LEVEL', 'union']
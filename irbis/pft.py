@@ -0,0 +1,653 @@
+# coding: utf-8
+
+"""
+Работа с форматами (PFT).
+"""
+
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from irbis._common import ANSI, prepare_format, UTF
+if TYPE_CHECKING:
+    from typing import Any, Iterable, List, Optional, Tuple, Union
+    from irbis.records import Field, Record
+
+    FormatSpecification = Union[str, 'CompiledFormat']
+
+
+class CompiledFormat:
+    """
+    Формат, подготовленный к отсылке на сервер однократно:
+    комментарии и управляющие символы удалены, строка формата
+    закодирована в нужной кодировке. Может использоваться
+    везде, где ожидается строка формата.
+    """
+
+    __slots__ = ('source', 'prepared', 'encoded')
+
+    def __init__(self, source: str) -> None:
+        self.source: str = source
+        self.prepared: str = prepare_format(source)
+        if source[:1] == '@':
+            self.encoded: bytes = self.prepared.encode(ANSI)
+        elif source[:1] == '!':
+            self.encoded = self.prepared.encode(UTF)
+        else:
+            self.encoded = ('!' + self.prepared).encode(UTF)
+
+    def __str__(self):
+        return self.source
+
+    def __bool__(self):
+        return bool(self.source)
+
+
+# Сколько подготовленных форматов держим в памяти
+FORMAT_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _compile_format(source: str) -> CompiledFormat:
+    return CompiledFormat(source)
+
+
+def compile_format(specification: 'FormatSpecification') -> CompiledFormat:
+    """
+    Получение подготовленного формата. Результаты подготовки строк
+    запоминаются (не более FORMAT_CACHE_SIZE последних форматов),
+    так что повторное использование того же формата обходится дёшево.
+
+    :param specification: Строка формата либо уже подготовленный формат
+    :return: Подготовленный формат
+    """
+    if isinstance(specification, CompiledFormat):
+        return specification
+    return _compile_format(specification)
+
+
+def projection_format(tags: 'Iterable[int]') -> CompiledFormat:
+    """
+    Формат, выдающий только указанные поля записи, по одному
+    повторению поля на строку в серверном представлении ("200#^a...").
+
+    :param tags: Метки выдаваемых полей
+    :return: Подготовленный формат
+    """
+    parts = ['mpl']
+    for tag in sorted(set(int(tag) for tag in tags)):
+        assert tag > 0
+        parts.append(f"(if p(v{tag}) then '{tag}#',v{tag},# fi)")
+    return compile_format(','.join(parts))
+
+
+###############################################################################
+
+# Локальное (на стороне клиента) исполнение простых форматов.
+#
+# Поддерживаемое подмножество языка форматирования:
+#
+# * v200, v200^a, v200^* -- выборка поля (подполя) в режиме проверки
+#   (mpl): поле без кода подполя выводится как есть, с разделителями;
+# * d200, n200 -- "пустые" поля: выводят свои условные литералы,
+#   если поле соответственно присутствует или отсутствует;
+# * 'текст' -- безусловный литерал;
+# * "текст" -- условный литерал (перед полем или после него);
+# * |текст| -- повторяющийся литерал, в т. ч. с "плюсом": |; |+v700;
+# * / и # -- переводы строки; запятая -- разделитель;
+# * ( ... ) -- повторяющаяся группа (без вложенности);
+# * if ... then ... [else ...] fi -- условный оператор. В условии
+#   допустимы p(v200), a(v200), сравнения поля с литералом
+#   (=, <>, : -- "содержит" без учета регистра), and, or, not и скобки;
+# * mpl -- режим проверки (действует по умолчанию).
+#
+# Литерал, стоящий между двумя полями без запятой, неоднозначен
+# и считается неподдерживаемой конструкцией. Всё, что не входит
+# в подмножество, должно форматироваться сервером.
+
+_TOKEN_REGEX = re.compile(r"""
+    (?P<space>\s+)
+    | (?P<kind>[vdn])(?P<tag>\d+)(?:\^(?P<code>.))?
+    | (?P<quote>['"|])(?P<text>.*?)(?P=quote)
+    | (?P<word>[a-z]+)
+    | (?P<sym><>|[/#,()+=:])
+    """, re.IGNORECASE | re.VERBOSE | re.DOTALL)
+
+_NEW_LINE = '\r\n'
+
+
+class _Context:
+    """
+    Контекст исполнения локального формата.
+    """
+
+    __slots__ = ('record', 'occurrence', 'output')
+
+    def __init__(self, record: 'Record') -> None:
+        self.record: 'Record' = record
+        self.occurrence: 'Optional[int]' = None
+        self.output: 'List[str]' = []
+
+    def new_line(self, force: bool) -> None:
+        """
+        Перевод строки. Без force переводим строку, только если
+        текущая строка не пустая.
+
+        :param force: Переводить в любом случае.
+        :return: None
+        """
+        output = self.output
+        if force or (output and not output[-1].endswith(_NEW_LINE)):
+            output.append(_NEW_LINE)
+
+
+class _FieldReference:
+    """
+    Ссылка на поле (подполе): v200, v200^a, v200^*.
+    """
+
+    __slots__ = ('kind', 'tag', 'code')
+
+    def __init__(self, kind: str, tag: int, code: 'Optional[str]') -> None:
+        self.kind: str = kind
+        self.tag: int = tag
+        self.code: 'Optional[str]' = code
+
+    def extract(self, field: 'Field') -> str:
+        """
+        Значение поля (подполя) для вывода.
+
+        :param field: Поле записи
+        :return: Значение (возможно, пустое)
+        """
+        code = self.code
+        if code is None:
+            return field.text()
+        if code == '*':
+            return field.get_value_or_first_subfield() or ''
+        for subfield in field.subfields:
+            if subfield.code == code:
+                return subfield.value or ''
+        return ''
+
+    def occurrences(self, record: 'Record') -> 'List[str]':
+        """
+        Значения по всем повторениям поля (пустые не отбрасываются,
+        чтобы сохранялась нумерация повторений).
+
+        :param record: Запись
+        :return: Список значений
+        """
+        tag = self.tag
+        return [self.extract(field) for field in record.fields
+                if field.tag == tag]
+
+    def values(self, context: _Context) -> 'List[str]':
+        """
+        Непустые значения в текущем контексте: все повторения
+        вне группы либо текущее повторение внутри группы.
+
+        :param context: Контекст исполнения
+        :return: Список значений
+        """
+        found = self.occurrences(context.record)
+        if context.occurrence is None:
+            return [value for value in found if value]
+        if context.occurrence < len(found) and found[context.occurrence]:
+            return [found[context.occurrence]]
+        return []
+
+
+class _Literal:
+    """
+    Безусловный литерал.
+    """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: str) -> None:
+        self.text: str = text
+
+    def execute(self, context: _Context) -> None:
+        """
+        Вывод литерала.
+        """
+        context.output.append(self.text)
+
+
+class _NewLine:
+    """
+    Перевод строки: / или #.
+    """
+
+    __slots__ = ('force',)
+
+    def __init__(self, force: bool) -> None:
+        self.force: bool = force
+
+    def execute(self, context: _Context) -> None:
+        """
+        Перевод строки.
+        """
+        context.new_line(self.force)
+
+
+class _FieldItem:
+    """
+    Поле вместе с окружающими его литералами.
+    """
+
+    __slots__ = ('reference', 'conditional_prefix', 'repeat_prefix',
+                 'prefix_plus', 'repeat_suffix', 'suffix_plus',
+                 'conditional_suffix')
+
+    def __init__(self, reference: _FieldReference) -> None:
+        self.reference: _FieldReference = reference
+        self.conditional_prefix: str = ''
+        self.repeat_prefix: str = ''
+        self.prefix_plus: bool = False
+        self.repeat_suffix: str = ''
+        self.suffix_plus: bool = False
+        self.conditional_suffix: str = ''
+
+    def execute(self, context: _Context) -> None:
+        """
+        Вывод поля с литералами.
+        """
+        reference = self.reference
+        output = context.output
+        if reference.kind != 'v':
+            exists = bool(reference.values(context))
+            if exists == (reference.kind == 'd'):
+                output.append(self.conditional_prefix)
+                output.append(self.conditional_suffix)
+            return
+
+        found = reference.occurrences(context.record)
+        present = [index for index, value in enumerate(found) if value]
+        if not present:
+            return
+        if context.occurrence is None:
+            indexes = present
+        elif context.occurrence in present:
+            indexes = [context.occurrence]
+        else:
+            return
+
+        first, last = present[0], present[-1]
+        for index in indexes:
+            if index == first:
+                output.append(self.conditional_prefix)
+            if not (self.prefix_plus and index == first):
+                output.append(self.repeat_prefix)
+            output.append(found[index])
+            if not (self.suffix_plus and index == last):
+                output.append(self.repeat_suffix)
+            if index == last:
+                output.append(self.conditional_suffix)
+
+
+class _Group:
+    """
+    Повторяющаяся группа.
+    """
+
+    __slots__ = ('items', 'tags')
+
+    def __init__(self, items: 'List[Any]', tags: 'List[int]') -> None:
+        self.items: 'List[Any]' = items
+        self.tags: 'List[int]' = tags
+
+    def execute(self, context: _Context) -> None:
+        """
+        Исполнение группы для всех повторений входящих в нее полей.
+        """
+        tags = self.tags
+        count = 0
+        for tag in tags:
+            count = max(count, sum(1 for field in context.record.fields
+                                   if field.tag == tag))
+        for occurrence in range(count):
+            context.occurrence = occurrence
+            for item in self.items:
+                item.execute(context)
+        context.occurrence = None
+
+
+class _Condition:
+    """
+    Условие: p(v200), a(v200), сравнение, and, or, not.
+    """
+
+    __slots__ = ('operation', 'left', 'right')
+
+    def __init__(self, operation: str, left: 'Any',
+                 right: 'Any' = None) -> None:
+        self.operation: str = operation
+        self.left: 'Any' = left
+        self.right: 'Any' = right
+
+    @staticmethod
+    def _text(operand: 'Any', context: _Context) -> str:
+        if isinstance(operand, _FieldReference):
+            return ''.join(operand.values(context))
+        return operand
+
+    def evaluate(self, context: _Context) -> bool:
+        """
+        Вычисление условия.
+        """
+        operation = self.operation
+        if operation == 'p':
+            return bool(self.left.values(context))
+        if operation == 'a':
+            return not self.left.values(context)
+        if operation == 'not':
+            return not self.left.evaluate(context)
+        if operation == 'and':
+            return self.left.evaluate(context) \
+                and self.right.evaluate(context)
+        if operation == 'or':
+            return self.left.evaluate(context) \
+                or self.right.evaluate(context)
+        left = self._text(self.left, context)
+        right = self._text(self.right, context)
+        if operation == '=':
+            return left == right
+        if operation == '<>':
+            return left != right
+        return right.upper() in left.upper()
+
+
+class _If:
+    """
+    Условный оператор.
+    """
+
+    __slots__ = ('condition', 'then_items', 'else_items')
+
+    def __init__(self, condition: _Condition, then_items: 'List[Any]',
+                 else_items: 'List[Any]') -> None:
+        self.condition: _Condition = condition
+        self.then_items: 'List[Any]' = then_items
+        self.else_items: 'List[Any]' = else_items
+
+    def execute(self, context: _Context) -> None:
+        """
+        Исполнение нужной ветки.
+        """
+        if self.condition.evaluate(context):
+            items = self.then_items
+        else:
+            items = self.else_items
+        for item in items:
+            item.execute(context)
+
+
+class _Parser:
+    """
+    Разбор формата в дерево для локального исполнения.
+    При встрече неподдерживаемой конструкции бросается ValueError.
+    """
+
+    __slots__ = ('tokens', 'position', 'group_tags')
+
+    def __init__(self, text: str) -> None:
+        self.tokens: 'List[Tuple[str, Any]]' = self._tokenize(text)
+        self.position: int = 0
+        self.group_tags: 'Optional[List[int]]' = None
+
+    @staticmethod
+    def _tokenize(text: str) -> 'List[Tuple[str, Any]]':
+        result: 'List[Tuple[str, Any]]' = []
+        position = 0
+        length = len(text)
+        while position < length:
+            match = _TOKEN_REGEX.match(text, position)
+            if not match:
+                raise ValueError('Unsupported format: ' + text[position:])
+            position = match.end()
+            if match.group('space'):
+                continue
+            if match.group('kind'):
+                code = match.group('code')
+                result.append(('field', _FieldReference(
+                    match.group('kind').lower(), int(match.group('tag')),
+                    code.lower() if code else None)))
+            elif match.group('quote'):
+                result.append((match.group('quote'), match.group('text')))
+            elif match.group('word'):
+                result.append(('word', match.group('word').lower()))
+            else:
+                result.append(('sym', match.group('sym')))
+        return result
+
+    def _peek(self) -> 'Tuple[str, Any]':
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return ('end', None)
+
+    def _next(self) -> 'Tuple[str, Any]':
+        result = self._peek()
+        self.position += 1
+        return result
+
+    def _expect(self, kind: str, value: 'Any') -> None:
+        if self._next() != (kind, value):
+            raise ValueError(f'Expected {value}')
+
+    def _field(self) -> _FieldReference:
+        kind, value = self._next()
+        if kind != 'field':
+            raise ValueError('Field expected')
+        if self.group_tags is not None:
+            self.group_tags.append(value.tag)
+        return value
+
+    def parse(self) -> 'List[Any]':
+        """
+        Разбор всего формата.
+
+        :return: Список элементов формата.
+        """
+        result = self._items(())
+        if self._peek()[0] != 'end':
+            raise ValueError('Unexpected ' + str(self._peek()[1]))
+        return result
+
+    def _items(self, stop: 'Tuple[Any, ...]') -> 'List[Any]':
+        result: 'List[Any]' = []
+        while True:
+            token = self._peek()
+            kind, value = token
+            if kind == 'end' or token in stop:
+                return result
+            if token == ('sym', ','):
+                self._next()
+            elif token == ('sym', '/'):
+                self._next()
+                result.append(_NewLine(False))
+            elif token == ('sym', '#'):
+                self._next()
+                result.append(_NewLine(True))
+            elif token == ('sym', '('):
+                result.append(self._group())
+            elif token == ('word', 'if'):
+                result.append(self._if())
+            elif token == ('word', 'mpl'):
+                self._next()
+            elif kind == "'":
+                self._next()
+                result.append(_Literal(value))
+            elif kind in ('"', '|', 'field'):
+                result.append(self._field_item())
+            else:
+                raise ValueError('Unsupported: ' + str(value))
+
+    def _group(self) -> _Group:
+        if self.group_tags is not None:
+            raise ValueError('Nested groups are not supported')
+        self._next()
+        self.group_tags = []
+        items = self._items((('sym', ')'),))
+        self._expect('sym', ')')
+        result = _Group(items, sorted(set(self.group_tags)))
+        self.group_tags = None
+        return result
+
+    def _if(self) -> _If:
+        self._next()
+        condition = self._or()
+        self._expect('word', 'then')
+        then_items = self._items((('word', 'else'), ('word', 'fi')))
+        else_items: 'List[Any]' = []
+        if self._peek() == ('word', 'else'):
+            self._next()
+            else_items = self._items((('word', 'fi'),))
+        self._expect('word', 'fi')
+        return _If(condition, then_items, else_items)
+
+    def _field_item(self) -> _FieldItem:
+        conditional_prefix = repeat_prefix = ''
+        prefix_plus = False
+        if self._peek()[0] == '"':
+            conditional_prefix = self._next()[1]
+        if self._peek()[0] == '|':
+            repeat_prefix = self._next()[1]
+            if self._peek() == ('sym', '+'):
+                self._next()
+                prefix_plus = True
+        result = _FieldItem(self._field())
+        result.conditional_prefix = conditional_prefix
+        result.repeat_prefix = repeat_prefix
+        result.prefix_plus = prefix_plus
+
+        suffix = False
+        if self._peek() == ('sym', '+'):
+            self._next()
+            result.suffix_plus = True
+            if self._peek()[0] != '|':
+                raise ValueError('Repeatable literal expected')
+        if self._peek()[0] == '|':
+            result.repeat_suffix = self._next()[1]
+            suffix = True
+        if self._peek()[0] == '"':
+            result.conditional_suffix = self._next()[1]
+            suffix = True
+        if suffix and self._peek()[0] in ('"', '|', 'field'):
+            raise ValueError('Ambiguous literal between fields')
+
+        if result.reference.kind != 'v' \
+                and (repeat_prefix or result.repeat_suffix):
+            raise ValueError('Repeatable literal for dummy field')
+        return result
+
+    def _or(self) -> _Condition:
+        result = self._and()
+        while self._peek() == ('word', 'or'):
+            self._next()
+            result = _Condition('or', result, self._and())
+        return result
+
+    def _and(self) -> _Condition:
+        result = self._not()
+        while self._peek() == ('word', 'and'):
+            self._next()
+            result = _Condition('and', result, self._not())
+        return result
+
+    def _not(self) -> _Condition:
+        if self._peek() == ('word', 'not'):
+            self._next()
+            return _Condition('not', self._not())
+        return self._primary()
+
+    def _primary(self) -> _Condition:
+        token = self._peek()
+        if token in (('word', 'p'), ('word', 'a')):
+            self._next()
+            self._expect('sym', '(')
+            reference = self._field()
+            if reference.kind != 'v':
+                raise ValueError('Field expected')
+            self._expect('sym', ')')
+            return _Condition(token[1], reference)
+        if token == ('sym', '('):
+            self._next()
+            result = self._or()
+            self._expect('sym', ')')
+            return result
+        left = self._operand()
+        operation = self._next()
+        if operation not in (('sym', '='), ('sym', '<>'), ('sym', ':')):
+            raise ValueError('Comparison expected')
+        return _Condition(operation[1], left, self._operand())
+
+    def _operand(self) -> 'Any':
+        kind, value = self._peek()
+        if kind == "'":
+            self._next()
+            return value
+        reference = self._field()
+        if reference.kind != 'v':
+            raise ValueError('Field expected')
+        return reference
+
+
+class LocalFormat:
+    """
+    Формат, исполняемый на стороне клиента над уже загруженными
+    записями. Поддерживается лишь подмножество языка форматирования
+    (см. комментарий выше); для прочих форматов конструктор
+    бросает ValueError.
+    """
+
+    __slots__ = ('source', '_items')
+
+    def __init__(self, source: str) -> None:
+        self.source: str = source
+        text = prepare_format(source)
+        if text[:1] == '@':
+            raise ValueError('Server-side format: ' + source)
+        if text[:1] == '!':
+            text = text[1:]
+        self._items: 'List[Any]' = _Parser(text).parse()
+
+    def format_record(self, record: 'Record') -> str:
+        """
+        Расформатирование записи.
+
+        :param record: Запись
+        :return: Результат расформатирования
+        """
+        context = _Context(record)
+        for item in self._items:
+            item.execute(context)
+        return ''.join(context.output)
+
+    def __str__(self):
+        return self.source
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _local_format(source: str) -> 'Optional[LocalFormat]':
+    try:
+        return LocalFormat(source)
+    except ValueError:
+        return None
+
+
+def local_format(specification: 'FormatSpecification') \
+        -> 'Optional[LocalFormat]':
+    """
+    Получение формата для локального исполнения. Результаты
+    запоминаются так же, как у compile_format.
+
+    :param specification: Строка формата либо подготовленный формат
+    :return: Локальный формат либо None, если формат содержит
+        неподдерживаемые конструкции
+    """
+    return _local_format(str(specification))
+
+
+__all__ = ['compile_format', 'CompiledFormat', 'local_format', 'LocalFormat',
+           'projection_format']
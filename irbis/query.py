@@ -5,9 +5,13 @@
 """
 
 from typing import TYPE_CHECKING
-from irbis._common import ANSI, UTF, prepare_format
+from irbis._common import ANSI, IRBIS_DELIMITER, UTF
+from irbis.pft import compile_format
+from irbis.search import PreparedSearch
 if TYPE_CHECKING:
-    from typing import Union, Optional
+    from typing import Any, Union, Optional
+    from irbis.pft import FormatSpecification
+    from irbis.records import AbstractRecord
 
 
 class ClientQuery:
@@ -62,29 +66,61 @@ class ClientQuery:
         self.new_line()
         return self
 
-    def format(self, format_specification: 'Optional[str]') \
+    def expression(self, expression: 'Any') -> 'ClientQuery':
+        """
+        Добавление поискового выражения в кодировке UTF-8
+        (подготовленное выражение добавляется как есть).
+        Также добавляется перевод строки.
+
+        :param expression: Поисковое выражение (строка, Search
+            или PreparedSearch). Может быть пустым.
+        :return: Self
+        """
+        if isinstance(expression, PreparedSearch):
+            self._memory.extend(expression.encoded)
+            return self.new_line()
+        if expression is None:
+            return self.new_line()
+        return self.utf(str(expression))
+
+    def format(self,
+               format_specification: 'Optional[FormatSpecification]') \
             -> 'Union[ClientQuery, bool]':
         """
         Добавление строки формата, предварительно подготовив её.
         Также добавляется перевод строки.
 
-        :param format_specification: Добавляемая строка формата.
-            Может быть пустой.
+        :param format_specification: Добавляемая строка формата
+            либо подготовленный формат. Может быть пустой
+            (тогда добавляется пустая строка).
         :return: Self
         """
-        if format_specification is None:
+        if not format_specification:
             self.new_line()
             return False
 
-        prepared = prepare_format(format_specification)
-        if format_specification[0] == '@':
-            self.ansi(prepared)
-        elif format_specification[0] == '!':
-            self.utf(prepared)
-        else:
-            self.utf('!' + prepared)
+        compiled = compile_format(format_specification)
+        self._memory.extend(compiled.encoded)
+        self.new_line()
         return self
 
+    def record(self, record: 'AbstractRecord',
+               database: 'Optional[str]' = None) -> 'ClientQuery':
+        """
+        Добавление записи в кодировке UTF-8 (строки разделяются
+        IRBIS_DELIMITER), при необходимости -- с именем базы данных
+        впереди. Запись кодируется прямо в память запроса.
+        Также добавляется перевод строки.
+
+        :param record: Запись
+        :param database: Имя базы данных (опционально)
+        :return: Self
+        """
+        if database is not None:
+            self._memory.extend((database + IRBIS_DELIMITER).encode(UTF))
+        record.encode_into(self._memory)
+        return self.new_line()
+
     def new_line(self) -> 'ClientQuery':
         """
         Перевод строки.
@@ -103,6 +139,9 @@ class ClientQuery:
         """
         return self.append(text, UTF)
 
+    def __len__(self):
+        return len(self._memory)
+
     def encode(self) -> bytes:
         """
         Выдача, что получилось в итоге.
@@ -8,8 +8,11 @@
 from irbis.records.abstract import AbstractRecord
 from irbis.records.raw_record import RawRecord
 from irbis.records.record import Record
+from irbis.records.lazy_record import LazyRecord
+from irbis.records.compact import CompactRecord
 from irbis.records.field import Field
 from irbis.records.subfield import SubField
 
 
-__all__ = ['AbstractRecord', 'RawRecord', 'Record', 'Field', 'SubField']
+__all__ = ['AbstractRecord', 'CompactRecord', 'LazyRecord', 'RawRecord',
+           'Record', 'Field', 'SubField']
@@ -6,7 +6,8 @@
 
 from abc import ABCMeta, abstractmethod
 from typing import TYPE_CHECKING
-from irbis._common import LOGICALLY_DELETED, PHYSICALLY_DELETED
+from irbis._common import IRBIS_DELIMITER, LOGICALLY_DELETED, \
+    PHYSICALLY_DELETED
 if TYPE_CHECKING:
     from typing import Any, List, Optional
 
@@ -31,6 +32,36 @@ class ValueMixin:
         raise TypeError('Не поддерживаемый тип value')
 
 
+class DirtyTracking:
+    """
+    Примесь для отслеживания изменений объекта с момента загрузки
+    (с сервера, из файла) либо последнего сохранения. Признак хранится
+    в слоте _dirty дочернего класса; значения простых слотов дочерний
+    класс может сверять со значениями на момент загрузки, переопределив
+    dirty и mark_clean. Созданный конструктором объект считается
+    измененным.
+    """
+
+    __slots__ = ()
+
+    _dirty: bool
+
+    @property
+    def dirty(self) -> bool:
+        """
+        Объект изменен?
+        """
+        return self._dirty
+
+    def mark_clean(self) -> None:
+        """
+        Сброс признака изменения.
+
+        :return: None
+        """
+        object.__setattr__(self, '_dirty', False)
+
+
 class AbstractRecord:
     """
     Абстрактный класс с общими свойствами и методами для классов Record
@@ -46,6 +77,7 @@ class AbstractRecord:
         self.version = 0
         self.status = 0
         self.fields: 'Any' = []
+        self.partial = False  # Загружены не все поля записи
         self.__bulk_set__(*args)
 
     def clear(self) -> 'AbstractRecord':
@@ -68,6 +100,7 @@ class AbstractRecord:
         result.mfn = self.mfn
         result.status = self.status
         result.version = self.version
+        result.partial = self.partial
         result.fields = self.clone_fields()
         return result
 
@@ -90,6 +123,16 @@ class AbstractRecord:
             result.append(str(field))
         return result
 
+    def encode_into(self, buffer: bytearray) -> None:
+        """
+        Кодирование записи в серверное представление прямо в буфер:
+        строки в кодировке UTF-8, разделенные IRBIS_DELIMITER.
+
+        :param buffer: Буфер (например, память клиентского запроса)
+        :return: None
+        """
+        buffer.extend(IRBIS_DELIMITER.join(self.encode()).encode('utf-8'))
+
     def is_deleted(self) -> bool:
         """
         Удалена ли запись?
@@ -0,0 +1,267 @@
+# coding: utf-8
+
+"""
+Компактное представление записи для хранения больших наборов в памяти.
+"""
+
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from irbis._common import LOGICALLY_DELETED, PHYSICALLY_DELETED
+from irbis.records.field import Field
+from irbis.records.record import Record
+from irbis.records.subfield import SubField
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Pattern
+    from irbis.records.field import FieldList
+
+# Разделитель полей в буфере
+FIELD_SEPARATOR = b'\x1e'
+
+
+def _canonical(line: str) -> str:
+    # Строка поля в том виде, который дает str(Field):
+    # коды подполей в нижнем регистре, пустые подполя отброшены
+    tag, text = line.split('#', 1)
+    if '^*' in text:
+        return str(Field.trusted(int(tag), text))
+    parts = text.split('^')
+    parts[1:] = [item[0].lower() + item[1:] for item in parts[1:]
+                 if len(item) > 1]
+    return str(int(tag)) + '#' + '^'.join(parts)
+
+
+@lru_cache(maxsize=1024)
+def _pattern(tag: int, code: 'Optional[str]') -> 'Pattern[bytes]':
+    # Выражение для поиска в буфере полей с указанной меткой.
+    # Группа 1 -- текст поля (code is None), значение до первого
+    # разделителя (code == ''), значение подполя либо, для ^*,
+    # значение до первого разделителя (если оно есть); группа 2 --
+    # первое подполе вместе с кодом (для ^*)
+    head = b'\x1e%d#' % tag
+    if code is None:
+        tail = b'([^\x1e]*)'
+    elif not code:
+        tail = b'([^\x1e^]*)'
+    elif code == '*':
+        tail = b'(?:([^\x1e^]+)|\\^([^\x1e^]*)|)'
+    else:
+        tail = b'[^\x1e]*?\\^' + re.escape(code.encode('utf-8')) \
+            + b'([^\x1e^]*)'
+    return re.compile(head + tail)
+
+
+def _found(value: 'Optional[bytes]', first: 'Optional[bytes]' = None) \
+        -> 'Optional[str]':
+    # Значение по результату поиска _pattern
+    if value:
+        return value.decode('utf-8')
+    if first:
+        return first.decode('utf-8')[1:]
+    return None
+
+
+class CompactRecord:
+    """
+    Read-only MARC record for large in-memory sets.
+
+    All fields are kept in one UTF-8 buffer as "tag#text" lines,
+    each preceded by a field separator, so a record costs one small
+    object plus one bytes object. fm, fma and have_field take values
+    straight from the buffer; all, first, [] and iteration build
+    Field objects on demand (changing them does not change the record).
+    """
+    __slots__ = 'database', 'mfn', 'status', 'version', '_data'
+
+    def __init__(self) -> None:
+        self.database: 'Optional[str]' = None
+        self.mfn = 0
+        self.status = 0
+        self.version = 0
+        self._data = b''
+
+    @classmethod
+    def from_record(cls, record: Record) -> 'CompactRecord':
+        """
+        Компактная копия записи.
+
+        :param record: Исходная запись
+        :return: Компактная запись
+        """
+        result = cls()
+        result.database = record.database
+        result.mfn = record.mfn
+        result.status = record.status
+        result.version = record.version
+        result._set_lines([str(field) for field in record.fields])
+        return result
+
+    def to_record(self) -> Record:
+        """
+        Преобразование в обычную запись.
+
+        :return: Запись
+        """
+        result = Record()
+        result.parse(self.encode())
+        result.database = self.database
+        return result
+
+    def _set_lines(self, lines: 'List[str]') -> None:
+        if lines:
+            self._data = ('\x1e' + '\x1e'.join(lines)).encode('utf-8')
+        else:
+            self._data = b''
+
+    def _lines(self) -> 'List[str]':
+        return self._data.decode('utf-8').split('\x1e')[1:]
+
+    def all(self, tag: int) -> 'FieldList':
+        """
+        Список полей с указанной меткой.
+
+        :param tag: Тег
+        :return: Список полей (возможно, пустой)
+        """
+        return [Field.trusted(tag, text.decode('utf-8'))
+                for text in _pattern(tag, None).findall(self._data)]
+
+    def encode(self) -> 'List[str]':
+        """
+        Кодирование записи в серверное представление.
+
+        :return: Список строк
+        """
+        result = [str(self.mfn) + '#' + str(self.status),
+                  '0#' + str(self.version)]
+        result.extend(self._lines())
+        return result
+
+    def first(self, tag: int, default: 'Optional[Field]' = None)\
+            -> 'Optional[Field]':
+        """
+        Первое из полей с указанной меткой.
+
+        :param tag: Искомая метка поля.
+        :param default: Значение по умолчанию.
+        :return: Поле или значение по умолчанию.
+        """
+        found = _pattern(tag, None).search(self._data)
+        if found is None:
+            return default
+        return Field.trusted(tag, found.group(1).decode('utf-8'))
+
+    def fm(self, tag: int, code: str = '*', default: 'Optional[str]' = None)\
+            -> 'Optional[str]':
+        """
+        Текст первого поля с указанной меткой.
+
+        :param tag: Искомая метка поля.
+        :param code: Код подполя (опционально). Если код не задан,
+        возвращается значение поля до первого разделителя.
+        :param default: Значение по умолчанию.
+        :return: Текст или значение по умолчанию.
+        """
+        assert tag > 0
+
+        # Как у Record: без кода -- значение до первого разделителя
+        code = SubField.validate_code(code) if code else ''
+        data = self._data
+        start = data.find(b'\x1e%d#' % tag)
+        if start < 0:
+            return default
+        # Значение берется только из первого поля с меткой
+        found = _pattern(tag, code).match(data, start)
+        if found is None:
+            return default
+        result = _found(*found.groups(None))
+        if result or code == '*':
+            return result
+        return default
+
+    def fma(self, tag: int, code: str = '*') -> 'List[str]':
+        """
+        Спосок значений полей с указанной меткой.
+        Пустые значения в список не включаются.
+
+        :param tag: Искомая метка поля.
+        :param code: Код (опционально). Если код не задан,
+        возвращается значение поле до первого разделителя.
+        :return: Список с текстами (м. б. пустой).
+        """
+        assert tag > 0
+
+        code = SubField.validate_code(code) if code else ''
+        pattern = _pattern(tag, code)
+        if code != '*':
+            return [value.decode('utf-8')
+                    for value in pattern.findall(self._data) if value]
+        result = []
+        for found in pattern.finditer(self._data):
+            one = _found(*found.groups(None))
+            if one:
+                result.append(one)
+        return result
+
+    def have_field(self, tag: int) -> bool:
+        """
+        Есть ли в записи поле с указанной меткой?
+
+        :param tag: Искомая метка поля.
+        :return: True или False.
+        """
+        return b'\x1e%d#' % tag in self._data
+
+    def is_deleted(self) -> bool:
+        """
+        Удалена ли запись?
+        :return: True для удаленной записи
+        """
+        return (self.status & (LOGICALLY_DELETED | PHYSICALLY_DELETED)) != 0
+
+    def keys(self) -> 'List[int]':
+        """
+        Получение списка меток полей без повторений и с сохранением порядка
+
+        :return: список меток
+        """
+        result: 'Dict[int, None]' = {}
+        for line in self._lines():
+            result[int(line[:line.index('#')])] = None
+        return list(result)
+
+    def parse(self, text: 'List[str]') -> None:
+        """
+        Разбор текстового представления записи (в серверном формате).
+
+        :param text: Список строк
+        :return: None
+        """
+        if not text:
+            raise ValueError('text argument is empty')
+        header = Record()
+        header.parse(text[:2])
+        self.mfn = header.mfn
+        self.status = header.status
+        self.version = header.version
+        self._set_lines([_canonical(line) for line in text[2:] if line])
+
+    def __getitem__(self, tag: int) -> 'FieldList':
+        return self.all(tag)
+
+    def __iter__(self):
+        for line in self._lines():
+            tag, text = line.split('#', 1)
+            yield Field.trusted(int(tag), text)
+
+    def __bool__(self):
+        return bool(self._data)
+
+    def __len__(self):
+        return self._data.count(FIELD_SEPARATOR)
+
+    def __str__(self):
+        return '\n'.join(self._lines())
+
+
+__all__ = ['CompactRecord']
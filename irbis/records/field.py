@@ -5,13 +5,16 @@
 """
 
 from collections import OrderedDict
+from operator import attrgetter
 from typing import cast, TYPE_CHECKING
 from irbis.abstract import DictLike, Hashable
-from irbis.records.abstract import ValueMixin
+from irbis.records.abstract import DirtyTracking, ValueMixin
 from irbis.records.subfield import SubField
+from irbis.records.tracked import TrackedList
 if TYPE_CHECKING:
     from irbis.records.subfield import SubFieldList, Value
-    from typing import Dict, Iterable, List, Optional, Set, Union, Tuple
+    from typing import Dict, Iterable, List, Optional, Set, Union, \
+        Tuple
     from typing import Sequence
 
     Code = str
@@ -29,21 +32,42 @@ if TYPE_CHECKING:
     FieldGetReturn = Union[str, SubField, SubFieldList, None]
 
 
-class Field(DictLike, Hashable, ValueMixin):
+class Field(DictLike, Hashable, ValueMixin, DirtyTracking):
     """
     MARC record field with tag, value (up to the first delimiter)
     and subfields.
+
+    Tag, value and subfields are plain slots; changes of the tag
+    and value are found by comparing them with the ones saved at load,
+    changes of the subfield list are reported by the list itself
+    (see dirty and mark_clean). Replacing the subfield list counts
+    as a change.
     """
 
     DEFAULT_TAG = 0
 
-    __slots__ = 'tag', 'value', 'subfields'
+    __slots__ = 'tag', 'value', 'subfields', '_dirty', '_clean_tag', \
+        '_clean_value', '_encoded'
+    tag: int
+    value: 'Optional[str]'
+    subfields: 'SubFieldList'
+    # Метка и значение на момент загрузки
+    _clean_tag: 'Optional[int]'
+    _clean_value: 'Optional[str]'
+    # Текст поля в UTF-8, метка, значение, коды и значения подполей
+    # на момент кодирования либо None (см. encode_utf8)
+    _encoded: 'Optional[Tuple[bytes, int, Value, Tuple[str, ...], ' \
+        'Tuple[Value, ...]]]'
 
     def __init__(self, tag: 'Optional[int]' = DEFAULT_TAG,
                  value: 'FieldSetValue' = None) -> None:
-        self.tag: int = tag or self.DEFAULT_TAG
-        self.value: 'Optional[str]' = None
-        self.subfields: 'SubFieldList' = []
+        self._dirty = True
+        self._clean_tag = None
+        self._clean_value = None
+        self._encoded = None
+        self.tag = tag or self.DEFAULT_TAG
+        self.value = None
+        self.subfields = TrackedList(self)
         self.__bulk_set__(value)
 
     def __bulk_set__(self, values: 'FieldSetValue' = None):
@@ -163,7 +187,7 @@ class Field(DictLike, Hashable, ValueMixin):
         assert other
 
         self.value = other.value
-        self.subfields = [sf.clone() for sf in other.subfields]
+        self.subfields[:] = [sf.clone() for sf in other.subfields]
 
     def clear(self) -> 'Field':
         """
@@ -173,7 +197,7 @@ class Field(DictLike, Hashable, ValueMixin):
         """
 
         self.value = None
-        self.subfields = []
+        self.subfields.clear()
         return self
 
     def clone(self) -> 'Field':
@@ -429,6 +453,33 @@ class Field(DictLike, Hashable, ValueMixin):
             result[subfield.code] = subfield.value
         return result
 
+    def encode_utf8(self) -> bytes:
+        """
+        Текстовое представление поля (как str) в кодировке UTF-8.
+        Результат запоминается до изменения поля или его подполей,
+        поэтому повторная отправка записи не кодирует
+        неизмененные поля заново.
+
+        :return: Закодированное поле
+        """
+        # Коды и значения обычно те же объекты, что и при кодировании,
+        # поэтому сравнение сводится к проверке тождественности
+        # (они хранятся двумя кортежами, а не кортежем на каждое
+        # подполе, чтобы кэш не увеличивал заметно размер записи
+        # в памяти; строка из кодов неоднозначна, если код присвоен
+        # в обход проверки)
+        subfields = self.subfields
+        tag, value = self.tag, self.value
+        codes = tuple(map(_code, subfields))
+        values = tuple(map(_value, subfields))
+        cached = self._encoded
+        if cached is not None and cached[1] == tag and cached[2] == value \
+                and cached[3] == codes and cached[4] == values:
+            return cached[0]
+        result = str(self).encode('utf-8')
+        self._encoded = (result, tag, value, codes, values)
+        return result
+
     def __str__(self):
         if not self.tag:
             return ''
@@ -530,7 +581,8 @@ class Field(DictLike, Hashable, ValueMixin):
             self.subfields.pop(key)
         elif isinstance(key, str):
             key = SubField.validate_code(key)
-            self.subfields = [sf for sf in self.subfields if sf.code != key]
+            self.subfields[:] = [sf for sf in self.subfields
+                                 if sf.code != key]
 
     def __len__(self):
         return len(self.subfields)
@@ -538,5 +590,117 @@ class Field(DictLike, Hashable, ValueMixin):
     def __bool__(self):
         return bool(self.tag) and (bool(self.value) or bool(self.subfields))
 
+    @classmethod
+    def trusted(cls, tag: int, text: str, delimiter: str = '^') -> 'Field':
+        """
+        Создание поля по текстовому представлению без метки
+        для заведомо корректных данных (ответ сервера, мастер-файл,
+        файл обмена): результат тот же, что у headless_parse,
+        но подполя создаются без проверки кодов и значений.
+
+        :param tag: Метка поля
+        :param text: Текст поля
+        :param delimiter: Разделитель подполей
+        :return: Поле
+        """
+        parts = text.split(delimiter)
+        if delimiter + '*' in text:
+            # Подполе ^* задает значение до первого разделителя:
+            # редкий случай, разбираем с проверками
+            result = cls(tag)
+            result.value = parts[0] or None
+            for item in parts[1:]:
+                if item:
+                    result.add(item[:1], item[1:])
+            result.mark_clean()
+            return result
+        loaded = SubField.loaded
+        subfields = [loaded(item[0].lower(), item[1:])
+                     for item in parts[1:] if len(item) > 1]
+        return cls.loaded(tag, parts[0] or None, subfields)
+
+    @classmethod
+    def loaded(cls, tag: int, value: 'Optional[str]',
+               subfields: 'List[SubField]') -> 'Field':
+        """
+        Создание неизмененного поля из готовых подполей
+        (при чтении записей из файлов и двоичного представления).
+        Подполя должны быть неизмененными (см. SubField.loaded).
+
+        :param tag: Метка поля
+        :param value: Значение до первого разделителя
+        :param subfields: Подполя
+        :return: Поле
+        """
+        result = cls.__new__(cls)
+        result.tag = result._clean_tag = tag
+        result.value = result._clean_value = value
+        result._dirty = False
+        result._encoded = None
+        result.subfields = TrackedList(result, subfields)
+        return result
+
+    def _on_append(self, _subfield: SubField) -> None:
+        self._dirty = True
+
+    def _on_change(self) -> None:
+        self._dirty = True
+
+    def _tracked(self) -> bool:
+        # Список подполей -- собственный TrackedList поля
+        # (а не присвоенный извне список)
+        # pylint: disable=protected-access
+        subfields = self.subfields
+        return isinstance(subfields, TrackedList) \
+            and subfields._owner is self
+
+    @property
+    def dirty(self) -> bool:
+        """
+        Поле либо его подполя изменены?
+        """
+        if self._dirty or self.tag != self._clean_tag \
+                or self.value != self._clean_value or not self._tracked():
+            return True
+        for subfield in self.subfields:
+            if subfield.dirty:
+                return True
+        return False
+
+    def mark_clean(self) -> None:
+        """
+        Сброс признака изменения у поля и его подполей.
+        Присвоенный извне список подполей заменяется
+        отслеживающим изменения.
+
+        :return: None
+        """
+        self._dirty = False
+        self._clean_tag = self.tag
+        self._clean_value = self.value
+        if not self._tracked():
+            self.subfields = TrackedList(self, self.subfields)
+        for subfield in self.subfields:
+            subfield.mark_clean()
+
     def __hash__(self):
-        return hash((self.tag, self.value, *self.subfields))
+        # Коды и значения подполей собираются без вызова
+        # SubField.__hash__ для каждого подполя
+        subfields = self.subfields
+        return hash((self.tag, self.value, ''.join(map(_code, subfields)),
+                     tuple(map(_value, subfields))))
+
+    def __eq__(self, other) -> bool:
+        """
+        Сравнение полей по метке, значению и подполям.
+        """
+        if self is other:
+            return True
+        return type(self) is type(other) and self.tag == other.tag \
+            and self.value == other.value \
+            and len(self.subfields) == len(other.subfields) \
+            and list.__eq__(self.subfields, other.subfields)
+
+
+_code = attrgetter('code')
+_value = attrgetter('value')
@@ -0,0 +1,251 @@
+# coding: utf-8
+
+"""
+Запись, поля которой разбираются при первом обращении.
+"""
+
+from typing import cast, TYPE_CHECKING
+from irbis.records.abstract import AbstractRecord
+from irbis.records.record import Record
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional
+    from irbis.records.field import Field, FieldList
+
+
+class LazyRecord(Record):
+    """
+    MARC record that keeps raw server lines and builds fields
+    only when they are needed.
+
+    fm, fma, first, all, have_field, keys and [] parse just the lines
+    with the requested tag. Any other access to fields parses the whole
+    record once (reusing already built fields), after which the record
+    behaves exactly like Record.
+    """
+    __slots__ = '_lines', '_index', '_line_tags', '_parsed'
+
+    def __init__(self, *args) -> None:
+        self._lines: 'Optional[List[str]]' = None  # Вида "метка#текст"
+        self._index: 'Optional[Dict[int, List[int]]]' = None
+        self._line_tags: 'List[int]' = []  # Метки строк (для индекса)
+        self._parsed: 'Dict[int, Field]' = {}  # Позиция строки - поле
+        super().__init__(*args)
+        if not args:
+            self._reset([])
+
+    def _reset(self, lines: 'List[str]') -> None:
+        self._lines = lines
+        self._index = None
+        self._parsed = {}
+
+    @property
+    def materialized(self) -> bool:
+        """
+        Все поля записи уже разобраны?
+        """
+        return self._lines is None
+
+    @property
+    def fields(self) -> 'List[Field]':
+        """
+        Поля записи (при первом обращении разбираются все строки).
+        """
+        if self._lines is not None:
+            self._materialize()
+        return self._fields
+
+    @fields.setter
+    def fields(self, value: 'List[Field]') -> None:
+        self._lines = None
+        Record.fields.fset(self, value)  # type: ignore
+
+    def _materialize(self) -> None:
+        lines = self._lines
+        assert lines is not None
+        parsed = self._parsed
+        result = []
+        for position, line in enumerate(lines):
+            field = parsed.get(position)
+            if field is None:
+                field = self._parse_field(line)
+            result.append(field)
+        dirty = self._dirty  # Разбор -- не изменение записи
+        self.fields = result
+        self._dirty = dirty
+        self._index = None
+        self._parsed = {}
+
+    @property
+    def dirty(self) -> bool:
+        """
+        Запись (MFN, статус, версия, поля или подполя) изменена
+        с момента загрузки либо сохранения? Неразобранные строки
+        не изменяются.
+        """
+        if self._lines is None:
+            return super().dirty
+        return self._dirty or self._header_changed() \
+            or any(field.dirty for field in self._parsed.values())
+
+    def mark_clean(self) -> None:
+        """
+        Сброс признака изменения у записи, ее полей и подполей.
+
+        :return: None
+        """
+        if self._lines is None:
+            super().mark_clean()
+        else:
+            self.mark_loaded()
+            for field in self._parsed.values():
+                field.mark_clean()
+
+    def _build_index(self) -> 'Dict[int, List[int]]':
+        assert self._lines is not None
+        index: 'Dict[int, List[int]]' = {}
+        line_tags = [int(line[:line.index('#')]) for line in self._lines]
+        for position, tag in enumerate(line_tags):
+            found = index.get(tag)
+            if found is None:
+                index[tag] = [position]
+            else:
+                found.append(position)
+        self._index = index
+        self._line_tags = line_tags
+        return index
+
+    def _indexed(self) -> bool:
+        """
+        Можно ли искать поля по индексу строк? Нельзя, если запись
+        уже разобрана целиком. Если метка разобранного поля изменилась,
+        индекс устарел, и запись разбирается целиком.
+
+        :return: True, если можно
+        """
+        if self._lines is None:
+            return False
+        if self._index is None:
+            self._build_index()
+        line_tags = self._line_tags
+        for position, field in self._parsed.items():
+            if field.tag != line_tags[position]:
+                self._materialize()
+                return False
+        return True
+
+    def _positions(self, tag: int) -> 'List[int]':
+        index = self._index
+        if index is None:
+            index = self._build_index()
+        return index.get(tag, [])
+
+    def _tagged(self, tag: int) -> 'FieldList':
+        if not self._indexed():
+            return super()._tagged(tag)
+        return [self._field_at(position)
+                for position in self._positions(tag)]
+
+    def _first_tagged(self, tag: int) -> 'Optional[Field]':
+        if not self._indexed():
+            return super()._first_tagged(tag)
+        positions = self._positions(tag)
+        return self._field_at(positions[0]) if positions else None
+
+    def _field_at(self, position: int) -> 'Field':
+        field = self._parsed.get(position)
+        if field is None:
+            assert self._lines is not None
+            field = self._parse_field(self._lines[position])
+            self._parsed[position] = field
+        return field
+
+    def clone(self) -> 'LazyRecord':
+        """
+        Клонирование записи. Неразобранная запись клонируется
+        без разбора полей.
+
+        :return: Полный клон записи
+        """
+        lines = self._lines
+        result = cast('LazyRecord', super().clone())
+        if lines is not None and not self._parsed:
+            result._reset(list(lines))  # pylint: disable=protected-access
+        return result
+
+    def clone_fields(self) -> 'FieldList':
+        if self._lines is not None and not self._parsed:
+            # Строки полей копирует clone
+            return []
+        return super().clone_fields()
+
+    def encode(self) -> 'List[str]':
+        """
+        Кодирование записи в серверное представление.
+        Неразобранная запись кодируется без разбора полей.
+
+        :return: Список строк
+        """
+        lines = self._lines
+        if lines is None or self._parsed:
+            # Разобранные поля могли быть изменены
+            return super().encode()
+        result = [str(self.mfn) + '#' + str(self.status),
+                  '0#' + str(self.version)]
+        result.extend(lines)
+        return result
+
+    def encode_into(self, buffer: bytearray) -> None:
+        """
+        Кодирование записи в серверное представление прямо в буфер.
+        Неразобранная запись кодируется без разбора полей.
+
+        :param buffer: Буфер (например, память клиентского запроса)
+        :return: None
+        """
+        if self._lines is None or self._parsed:
+            super().encode_into(buffer)
+        else:
+            AbstractRecord.encode_into(self, buffer)
+
+    def keys(self) -> 'List[int]':
+        """
+        Получение списка меток полей без повторений и с сохранением порядка
+
+        :return: список меток
+        """
+        if not self._indexed():
+            return super().keys()
+        return list(cast('Dict[int, List[int]]', self._index))
+
+    def parse(self, text: 'List[str]') -> None:
+        """
+        Разбор текстового представления записи (в серверном формате).
+        Строки полей только запоминаются.
+
+        :param text: Список строк
+        :return: None
+        """
+        if not text:
+            raise ValueError('text argument is empty')
+        super().parse(text[:2])
+        self._reset([line for line in text[2:] if line])
+
+    def parse_line(self, line: str) -> None:
+        if self._lines is None:
+            super().parse_line(line)
+        else:
+            self._lines.append(line)
+            self._index = None
+
+    def __bool__(self):
+        if self._lines is None:
+            return super().__bool__()
+        return bool(self._lines)
+
+    def __len__(self):
+        if self._lines is None:
+            return super().__len__()
+        return len(self._lines)
+
+
+__all__ = ['LazyRecord']
@@ -15,7 +15,7 @@ class RawRecord(AbstractRecord):
     """
     Запись с нераскодированными полями/подполями.
     """
-    __slots__ = 'database', 'mfn', 'status', 'version', 'fields'
+    __slots__ = 'database', 'mfn', 'status', 'version', 'fields', 'partial'
     fields: 'List[str]'
 
     def __init__(self, *args: str) -> None:
@@ -5,13 +5,17 @@
 """
 
 from collections import OrderedDict
+from itertools import chain
+from operator import attrgetter
 from typing import cast, TYPE_CHECKING
 from irbis.abstract import DictLike, Hashable
-from irbis.records.abstract import AbstractRecord
+from irbis._common import IRBIS_DELIMITER
+from irbis.records.abstract import AbstractRecord, DirtyTracking
 from irbis.records.field import Field
 from irbis.records.subfield import SubField
+from irbis.records.tracked import TrackedList
 if TYPE_CHECKING:
-    from typing import Dict, List, Optional, Set, Union, Type
+    from typing import Dict, List, Optional, Set, Tuple, Union, Type
     from irbis.records.field import FieldList, FieldSetValue, SubFieldDicts
 
     RecordArg = Union[Field, Dict[int, SubFieldDicts]]
@@ -19,17 +23,67 @@ if TYPE_CHECKING:
                         SubFieldDicts]
 
 
-class Record(AbstractRecord, DictLike, Hashable):
+class Record(AbstractRecord, DictLike, Hashable, DirtyTracking):
     """
     MARC record with MFN, status, version and fields.
+
+    A record read from the server is clean; changes of its MFN, status,
+    version, field list, fields or subfields make it dirty (see dirty
+    and mark_clean). The database name is not tracked: it only tells
+    where the record is read from or written to.
     """
-    __slots__ = 'database', 'mfn', 'version', 'status', 'fields'
-    fields: 'List[Field]'
+    __slots__ = 'database', 'mfn', 'version', 'status', '_fields', \
+        'partial', '_dirty', '_header'
 
     def __init__(self, *args: 'RecordArg') -> None:
         self.field_type: 'Type[Field]' = Field
+        self._dirty = True
+        # MFN, статус и версия на момент загрузки либо сохранения
+        self._header: 'Optional[Tuple[int, int, int]]' = None
         super().__init__(*args)
 
+    @property
+    def fields(self) -> 'List[Field]':
+        """
+        Поля записи.
+        """
+        return self._fields
+
+    @fields.setter
+    def fields(self, value: 'List[Field]') -> None:
+        if not (isinstance(value, TrackedList)
+                and value._owner is self):  # pylint: disable=protected-access
+            value = TrackedList(self, value)
+        self._fields = value
+        self._dirty = True
+
+    def _on_append(self, _field: 'Field') -> None:
+        self._dirty = True
+
+    def _on_change(self) -> None:
+        self._dirty = True
+
+    def _tagged(self, tag: int) -> 'FieldList':
+        """
+        Поля с указанной меткой.
+
+        :param tag: Метка поля
+        :return: Список полей (возможно, пустой)
+        """
+        return [field for field in self.fields if field.tag == tag]
+
+    def _first_tagged(self, tag: int) -> 'Optional[Field]':
+        """
+        Первое поле с указанной меткой.
+
+        :param tag: Метка поля
+        :return: Поле либо None
+        """
+        for field in self.fields:
+            if field.tag == tag:
+                return field
+        return None
+
     def __bulk_set__(self, *args: 'RecordArg'):
         """
         Приватный метод установки полей записи.
@@ -50,22 +104,45 @@ class Record(AbstractRecord, DictLike, Hashable):
                 raise TypeError('One or more args have unsupported type')
 
     def add(self, tag: int,
-            value: 'Optional[Union[str, SubField]]' = None) -> 'Field':
+            value: 'Optional[Union[str, SubField]]' = None,
+            unique: bool = True) -> 'Field':
         """
         Добавление поля (возможно, с значением и подполями) к записи.
 
         :param tag: Метка поля.
         :param value: Значение поля (опционально)
+        :param unique: Проверять, что такого поля в записи еще нет
+            (False -- для заведомо уникальных полей, например,
+            при массовом построении записей).
         :return: Свежедобавленное поле
         """
         assert tag > 0
         field = self.field_type(tag, value)
 
-        if field in self.fields:
+        if unique and self._contains(field):
             raise ValueError(f'Field "{field}" already added')
         self.fields.append(field)
         return field
 
+    def _contains(self, field: 'Field') -> bool:
+        """
+        Есть ли в записи поле, равное указанному?
+        Поля равны, если равны их хэши, а хэш включает метку,
+        поэтому сравниваются только поля с той же меткой,
+        а хэш нового поля вычисляется однажды.
+
+        :param field: Поле
+        :return: True, если есть
+        """
+        candidates = self._tagged(field.tag)
+        if not candidates:
+            return False
+        key = hash(field)
+        for other in candidates:
+            if other is field or (hash(other) == key and other == field):
+                return True
+        return False
+
     def add_non_empty(self, tag: int,
                       value: 'Union[str, SubField]') -> 'Record':
         """
@@ -111,7 +188,7 @@ class Record(AbstractRecord, DictLike, Hashable):
         """
         assert tag > 0
 
-        return [f.to_dict() for f in self.fields if f.tag == tag]
+        return [f.to_dict() for f in self._tagged(tag)]
 
     def clone_fields(self) -> 'FieldList':
         return [field.clone() for field in self.fields]
@@ -128,6 +205,22 @@ class Record(AbstractRecord, DictLike, Hashable):
             result[key] = [f.data for f in fields]
         return result
 
+    def encode_into(self, buffer: bytearray) -> None:
+        """
+        Кодирование записи в серверное представление прямо в буфер:
+        строки в кодировке UTF-8, разделенные IRBIS_DELIMITER.
+        Поля берут закодированный текст из кэша (см. Field.encode_utf8).
+
+        :param buffer: Буфер (например, память клиентского запроса)
+        :return: None
+        """
+        extend = buffer.extend
+        extend((str(self.mfn) + '#' + str(self.status) + IRBIS_DELIMITER
+                + '0#' + str(self.version)).encode('utf-8'))
+        for field in self.fields:
+            extend(_DELIMITER)
+            extend(field.encode_utf8())
+
     def fm(self, tag: int, code: str = '*', default: 'Optional[str]' = None)\
             -> 'Optional[str]':
         """
@@ -141,12 +234,12 @@ class Record(AbstractRecord, DictLike, Hashable):
         """
         assert tag > 0
 
-        for field in self.fields:
-            if field.tag == tag:
-                if code:
-                    return field.first_value(code, default)
-                return field.value or default
-        return default
+        field = self._first_tagged(tag)
+        if field is None:
+            return default
+        if code:
+            return field.first_value(code, default)
+        return field.value or default
 
     def fma(self, tag: int, code: str = '*') -> 'List[str]':
         """
@@ -161,16 +254,15 @@ class Record(AbstractRecord, DictLike, Hashable):
         assert tag > 0
 
         result = []
-        for field in self.fields:
-            if field.tag == tag:
-                if code:
-                    one = field.first_value(code)
-                    if one:
-                        result.append(one)
-                else:
-                    one = field.value
-                    if one:
-                        result.append(one)
+        for field in self._tagged(tag):
+            if code:
+                one = field.first_value(code)
+                if one:
+                    result.append(one)
+            else:
+                one = field.value
+                if one:
+                    result.append(one)
         return result
 
     def first(self, tag: int, default: 'Optional[Field]' = None)\
@@ -184,10 +276,8 @@ class Record(AbstractRecord, DictLike, Hashable):
         """
         assert tag > 0
 
-        for field in self.fields:
-            if field.tag == tag:
-                return field
-        return default
+        field = self._first_tagged(tag)
+        return default if field is None else field
 
     def first_as_dict(self, tag: int) -> OrderedDict:
         """
@@ -196,10 +286,8 @@ class Record(AbstractRecord, DictLike, Hashable):
         """
         assert tag > 0
 
-        for field in self.fields:
-            if field.tag == tag:
-                return field.to_dict()
-        return OrderedDict()
+        field = self._first_tagged(tag)
+        return OrderedDict() if field is None else field.to_dict()
 
     def have_field(self, tag: int) -> bool:
         """
@@ -212,7 +300,7 @@ class Record(AbstractRecord, DictLike, Hashable):
             raise ValueError('tag argument must be int type')
         if tag <= 0:
             raise ValueError('tag argument must be greater than 0')
-        return tag in self.keys()
+        return self._first_tagged(tag) is not None
 
     def insert_at(self, index: int, tag: int, value: 'Optional[str]' = None) \
             -> 'Field':
@@ -242,10 +330,63 @@ class Record(AbstractRecord, DictLike, Hashable):
         return [f.tag for f in self.fields
                 if not (f.tag in unique or add(f.tag))]
 
+    def _parse_field(self, line: str) -> 'Field':
+        # Строки приходят с сервера, поэтому подполя не проверяются
+        tag, text = line.split('#', 1)
+        return self.field_type.trusted(int(tag), text)
+
+    def parse(self, text: 'List[str]') -> None:
+        """
+        Разбор текстового представления записи (в серверном формате).
+
+        :param text: Список строк
+        :return: None
+        """
+        super().parse(text[:2])
+        parse_field = self._parse_field
+        self.fields = [parse_field(line) for line in text[2:] if line]
+        self.mark_loaded()
+
     def parse_line(self, line: str) -> None:
-        field = self.field_type()
-        field.parse(line)
-        self.fields.append(field)
+        # Разбор -- не изменение записи
+        dirty = self._dirty
+        self.fields.append(self._parse_field(line))
+        self._dirty = dirty
+
+    @property
+    def dirty(self) -> bool:
+        """
+        Запись (MFN, статус, версия, поля или подполя) изменена
+        с момента загрузки либо сохранения? Новая запись считается
+        измененной. Смена базы данных изменением не считается.
+        """
+        return self._dirty or self._header_changed() \
+            or any(field.dirty for field in self.fields)
+
+    def _header_changed(self) -> bool:
+        return self._header != (self.mfn, self.status, self.version)
+
+    def mark_loaded(self) -> None:
+        """
+        Сброс признака изменения у самой записи (MFN, статус, версия,
+        список полей) без обхода полей: поля созданы неизмененными
+        (см. Field.loaded) при разборе записи.
+
+        :return: None
+        """
+        self._dirty = False
+        self._header = (self.mfn, self.status, self.version)
+
+    def mark_clean(self) -> None:
+        """
+        Сброс признака изменения у записи, ее полей и подполей.
+
+        :return: None
+        """
+        self._dirty = False
+        self._header = (self.mfn, self.status, self.version)
+        for field in self.fields:
+            field.mark_clean()
 
     def remove_field(self, tag: int) -> 'Record':
         """
@@ -331,7 +472,7 @@ class Record(AbstractRecord, DictLike, Hashable):
         :param tag: числовая метка полей.
         :return: список полей или ничего.
         """
-        return [f for f in self.fields if f.tag == tag]
+        return self._tagged(tag)
 
     def get(self, key: int, default: 'Optional[FieldList]' = None)\
             -> 'FieldList':
@@ -379,5 +520,30 @@ class Record(AbstractRecord, DictLike, Hashable):
         self.fields = [f for f in self.fields if f.tag != key]
 
     def __hash__(self):
-        fields_hashes = tuple(hash(f) for f in self.fields)
-        return hash(fields_hashes)
+        # Хэш вычисляется за один проход по всем полям и подполям
+        # (без вызова Field.__hash__ для каждого поля), равные
+        # по __eq__ записи получают равные хэши
+        fields = self.fields
+        subfields = list(map(_subfields, fields))
+        flat = list(chain.from_iterable(subfields))
+        return hash((tuple(map(_tag, fields)), tuple(map(_value, fields)),
+                     tuple(map(len, subfields)), ''.join(map(_code, flat)),
+                     tuple(map(_value, flat))))
+
+    def __eq__(self, other) -> bool:
+        """
+        Сравнение записей по полям (MFN, статус и т. п. не учитываются).
+        """
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return False
+        mine, theirs = self.fields, other.fields
+        return len(mine) == len(theirs) and list.__eq__(mine, theirs)
+
+
+_DELIMITER = IRBIS_DELIMITER.encode('utf-8')
+_tag = attrgetter('tag')
+_value = attrgetter('value')
+_subfields = attrgetter('subfields')
+_code = attrgetter('code')
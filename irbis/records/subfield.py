@@ -6,7 +6,7 @@
 
 from typing import TYPE_CHECKING
 from irbis.abstract import Hashable
-from irbis.records.abstract import ValueMixin
+from irbis.records.abstract import DirtyTracking, ValueMixin
 if TYPE_CHECKING:
     from typing import List, Optional
 
@@ -14,19 +14,46 @@ if TYPE_CHECKING:
     SubFieldList = List['SubField']
 
 
-class SubField(Hashable, ValueMixin):
+class SubField(Hashable, ValueMixin, DirtyTracking):
     """
     MARC record subfield with code and text value.
+
+    Code and value are plain slots; changes are found by comparing
+    them with the values saved at load (see dirty and mark_clean).
     """
 
     DEFAULT_CODE = '\0'
 
-    __slots__ = 'code', 'value'
+    __slots__ = 'code', 'value', '_clean_code', '_clean_value'
+    code: str
+    value: 'Value'
+    # Код и значение на момент загрузки либо сохранения
+    # (None -- подполе создано конструктором)
+    _clean_code: 'Optional[str]'
+    _clean_value: 'Value'
 
     def __init__(self, code: str = DEFAULT_CODE,
                  value: 'Value' = None) -> None:
-        self.code: str = self.validate_code(code) or SubField.DEFAULT_CODE
-        self.value: 'Value' = self.validate_value(value)
+        self.code = self.validate_code(code) or SubField.DEFAULT_CODE
+        self.value = self.validate_value(value)
+        self._clean_code = None
+        self._clean_value = None
+
+    @classmethod
+    def loaded(cls, code: str, value: 'Value') -> 'SubField':
+        """
+        Создание неизмененного подполя без проверки кода и значения
+        (при чтении записей с сервера, из файлов и двоичного
+        представления).
+
+        :param code: Код подполя
+        :param value: Значение подполя
+        :return: Подполе
+        """
+        result = cls.__new__(cls)
+        result.code = result._clean_code = code
+        result.value = result._clean_value = value
+        return result
 
     def assign_from(self, other: 'SubField') -> None:
         """
@@ -65,9 +92,32 @@ class SubField(Hashable, ValueMixin):
     def __bool__(self):
         return self.code != self.DEFAULT_CODE and bool(self.value)
 
+    @property
+    def dirty(self) -> bool:
+        """
+        Код или значение подполя изменены?
+        """
+        return self.code != self._clean_code \
+            or self.value != self._clean_value
+
+    def mark_clean(self) -> None:
+        """
+        Сброс признака изменения.
+
+        :return: None
+        """
+        self._clean_code = self.code
+        self._clean_value = self.value
+
     def __hash__(self):
         return hash((self.code, self.value))
 
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        return type(self) is type(other) and self.code == other.code \
+            and self.value == other.value
+
     @staticmethod
     def validate_code(code: str) -> str:
         """
@@ -0,0 +1,82 @@
+# coding: utf-8
+
+"""
+Список, сообщающий владельцу о своих изменениях.
+"""
+
+# pylint: disable=protected-access
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Any
+
+
+class TrackedList(list):
+    """
+    Список элементов (полей или подполей), сообщающий владельцу
+    о своих изменениях. Владелец реализует методы _on_append(item)
+    (добавление элемента в конец) и _on_change() (любое другое изменение).
+    """
+
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner: 'Any' = None, items: 'Any' = ()) -> None:
+        super().__init__(items)
+        self._owner = owner
+
+    def __reduce_ex__(self, protocol):
+        return self.__class__, (self._owner, list(self))
+
+    def append(self, item: 'Any') -> None:
+        super().append(item)
+        self._owner._on_append(item)
+
+    def extend(self, items: 'Any') -> None:
+        super().extend(items)
+        self._owner._on_change()
+
+    def insert(self, index: 'Any', item: 'Any') -> None:
+        super().insert(index, item)
+        self._owner._on_change()
+
+    def remove(self, item: 'Any') -> None:
+        super().remove(item)
+        self._owner._on_change()
+
+    def pop(self, index: 'Any' = -1) -> 'Any':
+        result = super().pop(index)
+        self._owner._on_change()
+        return result
+
+    def clear(self) -> None:
+        super().clear()
+        self._owner._on_change()
+
+    def sort(self, *args: 'Any', **kwargs: 'Any') -> None:
+        super().sort(*args, **kwargs)
+        self._owner._on_change()
+
+    def reverse(self) -> None:
+        super().reverse()
+        self._owner._on_change()
+
+    def __iadd__(self, items: 'Any') -> 'Any':  # type: ignore
+        super().__iadd__(items)
+        self._owner._on_change()
+        return self
+
+    def __imul__(self, count: 'Any') -> 'Any':  # type: ignore
+        super().__imul__(count)
+        self._owner._on_change()
+        return self
+
+    def __setitem__(self, index: 'Any', item: 'Any') -> None:
+        super().__setitem__(index, item)
+        self._owner._on_change()
+
+    def __delitem__(self, index: 'Any') -> None:
+        super().__delitem__(index)
+        self._owner._on_change()
+
+
+__all__ = ['TrackedList']
@@ -5,6 +5,7 @@
 """
 
 import socket
+from array import array
 from typing import TYPE_CHECKING
 from irbis._common import ANSI, ObjectWithError, UTF
 if TYPE_CHECKING:
@@ -117,13 +118,11 @@ class ServerResponse:
 
         :return: Список строк (возможно, пустой)
         """
-        result = []
-        while True:
-            line = self.ansi()
-            if not line:
-                break
-            result.append(line)
-        return result
+        chunk = self._remaining_chunk()
+        if not chunk:
+            return []
+        # noinspection PyTypeChecker
+        return str(chunk, ANSI).split('\r\n')  # type: ignore
 
     def check_return_code(self, allowed: 'Optional[List[int]]' = None) -> bool:
         """
@@ -211,6 +210,47 @@ class ServerResponse:
         # noinspection PyTypeChecker
         return int(self.read())  # type: ignore
 
+    def remaining_numbers(self) -> 'array':
+        """
+        Получение всех оставшихся строк ответа сервера как массива
+        целых неотрицательных чисел (например, MFN найденных записей).
+        Строки разбираются прямо из байтов, без декодирования.
+
+        :return: Массив чисел (возможно, пустой)
+        """
+        chunk = self._remaining_chunk()
+        if not chunk:
+            return array('I')
+        return array('I', map(int, chunk.tobytes().split(b'\r\n')))
+
+    def _remaining_chunk(self) -> memoryview:
+        """
+        Считывание одним куском всех строк вплоть до первой пустой
+        (либо до конца ответа). Пустая строка пропускается.
+
+        :return: memoryview на сырые байты строк без завершающего
+            перевода строки.
+        """
+        memory = self._memory
+        start = self._pos
+        length = len(memory)
+        if start >= length:
+            return self._view[0:0]
+
+        if memory.startswith(b'\r\n', start):
+            self._pos = start + 2
+            return self._view[0:0]
+
+        end = memory.find(b'\r\n\r\n', start)
+        if end < 0:
+            end = length
+            self._pos = length
+            if end - start >= 2 and memory.endswith(b'\r\n'):
+                end -= 2
+        else:
+            self._pos = end + 4
+        return self._view[start:end]
+
     def read(self) -> memoryview:
         """
         Считываем строку в сыром виде.
@@ -280,14 +320,11 @@ class ServerResponse:
 
         :return: Список строк (возможно, пустой)
         """
-
-        result = []
-        while True:
-            line = self.utf()
-            if not line:
-                break
-            result.append(line)
-        return result
+        chunk = self._remaining_chunk()
+        if not chunk:
+            return []
+        # noinspection PyTypeChecker
+        return str(chunk, UTF).split('\r\n')  # type: ignore
 
     def __str__(self):
         return str(self.return_code)
@@ -0,0 +1,319 @@
+# coding: utf-8
+
+"""
+Маршрутизация запросов: запись -- на основной сервер,
+чтение -- на наименее загруженную из реплик.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Any, Callable, Iterable, List, Optional
+    from irbis.connection import Connection
+
+# Команды, не изменяющие данные на сервере
+READ_COMMANDS = frozenset((
+    'format_local', 'format_record', 'format_record_async', 'format_records',
+    'fulltext_search', 'fulltext_search_async', 'get_database_info',
+    'get_max_mfn', 'get_max_mfn_async', 'iter_postings', 'iter_search_format',
+    'iter_search_read', 'iter_terms', 'iter_terms_async', 'list_files',
+    'print_table', 'read_alphabet_table', 'read_binary_file',
+    'read_ini_file', 'read_menu', 'read_opt_file', 'read_par_file',
+    'read_postings', 'read_raw_record', 'read_record', 'read_record_async',
+    'read_record_postings', 'read_records', 'read_search_scenario',
+    'read_terms', 'read_terms_async', 'read_text_file',
+    'read_text_file_async', 'read_tree_file', 'read_uppercase_table',
+    'search', 'search_all', 'search_async', 'search_count',
+    'search_count_async', 'search_ex', 'search_format', 'search_local',
+    'search_read'))
+
+# Команды чтения, возвращающие итераторы
+_STREAMING_COMMANDS = frozenset(('iter_postings', 'iter_search_format',
+                                 'iter_search_read', 'iter_terms',
+                                 'iter_terms_async'))
+
+# Ошибки, после которых сервер считается недоступным
+_NETWORK_ERRORS = (OSError, asyncio.TimeoutError)
+
+
+class Replica:
+    """
+    Сервер-реплика и статистика обращений к нему.
+    """
+
+    __slots__ = ('connection', 'latency', 'in_flight', 'failures',
+                 'ejected_until')
+
+    def __init__(self, connection: 'Connection') -> None:
+        self.connection: 'Connection' = connection
+        self.latency: 'Optional[float]' = None  # EWMA, секунды
+        self.in_flight: int = 0  # Выполняющиеся запросы
+        self.failures: int = 0  # Ошибки подряд
+        self.ejected_until: float = 0.0  # Момент повторной проверки
+
+    @property
+    def healthy(self) -> bool:
+        """
+        Реплика не исключена из обслуживания?
+        """
+        return not self.ejected_until
+
+    def score(self, default_latency: float) -> float:
+        """
+        Оценка стоимости запроса: чем меньше, тем лучше.
+
+        :param default_latency: Задержка для реплики без статистики
+        :return: Оценка
+        """
+        latency = default_latency if self.latency is None else self.latency
+        return latency * (self.in_flight + 1)
+
+    def __str__(self):
+        latency = 'n/a' if self.latency is None \
+            else f'{self.latency * 1000:.1f} ms'
+        state = 'ok' if self.healthy else 'ejected'
+        return f'{self.connection.host}:{self.connection.port} ' \
+               f'{state}, {latency}, in flight {self.in_flight}'
+
+
+class RoutingConnection:
+    """
+    Подключение к группе серверов с одинаковыми базами данных.
+    Команды чтения (READ_COMMANDS) выполняются на реплике с наименьшей
+    оценкой "сглаженная задержка * (запросы в работе + 1)", остальные
+    команды -- на основном сервере. Реплика, на которой подряд
+    случилось max_failures сетевых ошибок, исключается на eject_time
+    секунд, после чего проверяется командой nop в фоновом потоке.
+    Неизвестные атрибуты берутся у основного подключения.
+    """
+
+    __slots__ = ('primary', 'replicas', 'alpha', 'max_failures',
+                 'eject_time', 'read_from_primary', '_lock')
+
+    def __init__(self, primary: 'Connection',
+                 replicas: 'Iterable[Connection]' = (), *,
+                 alpha: float = 0.3, max_failures: int = 3,
+                 eject_time: float = 30.0,
+                 read_from_primary: bool = False) -> None:
+        self.primary: 'Connection' = primary
+        self.replicas: 'List[Replica]' = [Replica(one) for one in replicas]
+        if read_from_primary or not self.replicas:
+            self.replicas.append(Replica(primary))
+        self.alpha: float = alpha  # Вес нового замера в EWMA
+        self.max_failures: int = max_failures
+        self.eject_time: float = eject_time  # Секунды
+        self.read_from_primary: bool = read_from_primary
+        self._lock = threading.Lock()
+
+    @property
+    def connections(self) -> 'List[Connection]':
+        """
+        Все подключения группы (основное -- первым).
+        """
+        result = [self.primary]
+        result.extend(replica.connection for replica in self.replicas
+                      if replica.connection is not self.primary)
+        return result
+
+    @property
+    def database(self) -> str:
+        """
+        Текущая база данных (общая для всех серверов).
+        """
+        return self.primary.database
+
+    @database.setter
+    def database(self, value: str) -> None:
+        for connection in self.connections:
+            connection.database = value
+
+    def connect(self) -> None:
+        """
+        Подключение ко всем серверам группы.
+
+        :return: None
+        """
+        for connection in self.connections:
+            connection.connect()
+
+    def disconnect(self) -> None:
+        """
+        Отключение от всех серверов группы.
+
+        :return: None
+        """
+        for connection in self.connections:
+            connection.disconnect()
+
+    def push_database(self, database: str) -> str:
+        """
+        Переключение всех серверов группы на новую базу данных
+        с запоминанием предыдущей.
+
+        :param database: Новая база данных
+        :return: Предыдущая база данных
+        """
+        result = self.primary.database
+        for connection in self.connections:
+            connection.push_database(database)
+        return result
+
+    def pop_database(self) -> str:
+        """
+        Возврат всех серверов группы к предыдущей базе данных.
+
+        :return: Прошлая база данных
+        """
+        result = self.primary.database
+        for connection in self.connections:
+            connection.pop_database()
+        return result
+
+    def _probe(self, replica: Replica) -> None:
+        # Исключенная реплика, время исключения которой истекло,
+        # проверяется командой nop. Любая ошибка означает, что реплика
+        # по-прежнему недоступна
+        try:
+            alive = replica.connection.nop()
+        except Exception:  # pylint: disable=broad-except
+            alive = False
+        with self._lock:
+            if alive:
+                replica.failures = 0
+                replica.ejected_until = 0.0
+            else:
+                replica.ejected_until = time.monotonic() + self.eject_time
+
+    def choose(self, exclude: 'Iterable[Replica]' = ()) \
+            -> 'Optional[Replica]':
+        """
+        Выбор реплики для очередного запроса на чтение.
+
+        :param exclude: Реплики, которые не нужно рассматривать
+        :return: Реплика либо None, если подходящих нет
+        """
+        now = time.monotonic()
+        for replica in self.replicas:
+            if replica.ejected_until and replica.ejected_until <= now:
+                with self._lock:
+                    due = 0 < replica.ejected_until <= now
+                    if due:
+                        # Пока идет проверка, реплика остается исключенной
+                        replica.ejected_until = now + self.eject_time
+                if due:
+                    # Проверка не задерживает текущий запрос
+                    threading.Thread(target=self._probe, args=(replica,),
+                                     daemon=True).start()
+
+        with self._lock:
+            candidates = [replica for replica in self.replicas
+                          if replica.healthy and replica not in exclude]
+            if not candidates:
+                return None
+            known = [replica.latency for replica in candidates
+                     if replica.latency is not None]
+            # Реплики без статистики пробуем в первую очередь
+            default = min(known) / 2 if known else 0.0
+            result = min(candidates, key=lambda one: one.score(default))
+            result.in_flight += 1
+            return result
+
+    def _finish(self, replica: Replica, started: float,
+                error: 'Optional[BaseException]') -> None:
+        with self._lock:
+            replica.in_flight -= 1
+            if error is None:
+                elapsed = time.perf_counter() - started
+                if replica.latency is None:
+                    replica.latency = elapsed
+                else:
+                    replica.latency += self.alpha * (elapsed
+                                                     - replica.latency)
+                replica.failures = 0
+            else:
+                replica.failures += 1
+                if replica.failures >= self.max_failures:
+                    replica.ejected_until = time.monotonic() \
+                        + self.eject_time
+
+    def _release(self, replica: Replica) -> None:
+        with self._lock:
+            replica.in_flight -= 1
+
+    def _route(self, name: str) -> 'Callable':
+
+        def call(*args: 'Any', **kwargs: 'Any') -> 'Any':
+            tried: 'List[Replica]' = []
+            while True:
+                replica = self.choose(tried)
+                if replica is None:
+                    # Все реплики недоступны -- читаем с основного сервера
+                    return getattr(self.primary, name)(*args, **kwargs)
+                tried.append(replica)
+                started = time.perf_counter()
+                try:
+                    result = getattr(replica.connection, name)(*args,
+                                                               **kwargs)
+                except _NETWORK_ERRORS as error:
+                    self._finish(replica, started, error)
+                    continue
+                except BaseException:
+                    # Ошибка сервера ИРБИС или аргументов: реплика
+                    # исправна, только освобождаем ее
+                    self._release(replica)
+                    raise
+                self._finish(replica, started, None)
+                return result
+
+        def call_stream(*args: 'Any', **kwargs: 'Any') -> 'Any':
+            # Итератор выполняет запросы по мере обхода,
+            # поэтому задержку здесь не замеряем
+            replica = self.choose()
+            if replica is None:
+                return getattr(self.primary, name)(*args, **kwargs)
+            self._release(replica)
+            return getattr(replica.connection, name)(*args, **kwargs)
+
+        async def call_async(*args: 'Any', **kwargs: 'Any') -> 'Any':
+            tried: 'List[Replica]' = []
+            while True:
+                replica = self.choose(tried)
+                if replica is None:
+                    return await getattr(self.primary, name)(*args,
+                                                             **kwargs)
+                tried.append(replica)
+                started = time.perf_counter()
+                try:
+                    result = await getattr(replica.connection, name)(
+                        *args, **kwargs)
+                except _NETWORK_ERRORS as error:
+                    self._finish(replica, started, error)
+                    continue
+                except BaseException:  # В т. ч. asyncio.CancelledError
+                    self._release(replica)
+                    raise
+                self._finish(replica, started, None)
+                return result
+
+        method = getattr(self.primary, name)
+        if name in _STREAMING_COMMANDS:
+            return functools.wraps(method)(call_stream)
+        if asyncio.iscoroutinefunction(method):
+            return functools.wraps(method)(call_async)
+        return functools.wraps(method)(call)
+
+    def __getattr__(self, name: str) -> 'Any':
+        if name in RoutingConnection.__slots__:
+            raise AttributeError(name)
+        if name in READ_COMMANDS:
+            return self._route(name)
+        return getattr(self.primary, name)
+
+    def __str__(self):
+        return '\n'.join(str(replica) for replica in self.replicas)
+
+
+__all__ = ['READ_COMMANDS', 'Replica', 'RoutingConnection']
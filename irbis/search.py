@@ -4,11 +4,24 @@
 Всё, связанное с поиском.
 """
 
+import re
 from typing import TYPE_CHECKING
-from irbis._common import safe_int, safe_str
+from irbis._common import safe_int, safe_str, UTF
 from irbis.ini import IniFile
 if TYPE_CHECKING:
-    from typing import Any, List, Optional
+    from typing import Any, List, Optional, Tuple
+    from irbis.pft import FormatSpecification
+
+
+# Параметр шаблона поискового выражения
+_PLACEHOLDER = '?'
+
+# Терм шаблона: в кавычках либо без них; уточнение меток "/(200)"
+# к терму не относится
+_TEMPLATE_TERM_REGEX = re.compile(r'"[^"]*"|(?:[^\s()+*^"/]|/(?!\())+')
+
+# Символы, из-за которых терм нужно заключить в кавычки
+_WRAP_REGEX = re.compile(r'[\s+*^()#]')
 
 
 class FoundLine:
@@ -46,11 +59,11 @@ class SearchParameters:
     __slots__ = ('database', 'first', 'format', 'max_mfn', 'min_mfn',
                  'number', 'expression', 'sequential', 'filter', 'utf')
 
-    def __init__(self, expression: 'Optional[str]' = None,
+    def __init__(self, expression: 'Any' = None,
                  number: int = 0) -> None:
         self.database: 'Optional[str]' = None
         self.first: int = 1
-        self.format: 'Optional[str]' = None
+        self.format: 'Optional[FormatSpecification]' = None
         self.max_mfn: int = 0
         self.min_mfn: int = 0
         self.number: int = number
@@ -69,16 +82,113 @@ class SearchParameters:
         """
         database = self.database or connection.database
         query.ansi(database)
-        query.utf(self.expression)
+        query.expression(self.expression)
         query.add(self.number)
         query.add(self.first)
-        query.ansi(self.format)
+        query.format(self.format)
         query.add(self.min_mfn)
         query.add(self.max_mfn)
         query.ansi(self.sequential)
 
     def __str__(self):
-        return self.expression
+        return safe_str(self.expression)
+
+
+class PreparedSearch:
+    """
+    Поисковое выражение, уже закодированное в UTF-8
+    (результат подстановки параметров в шаблон).
+    """
+
+    __slots__ = ('encoded',)
+
+    def __init__(self, encoded: bytes) -> None:
+        self.encoded: bytes = encoded
+
+    def __str__(self):
+        return self.encoded.decode(UTF)
+
+
+class SearchTemplate:
+    """
+    Шаблон поискового выражения с параметрами "?", например,
+    "A=? * G=?" или author('?').and_(year('?')). Шаблон разбирается
+    и кодируется один раз, при подстановке параметров кодируются
+    лишь сами параметры; термы с параметрами при необходимости
+    заключаются в кавычки (без уточнения меток, например,
+    "K=?/(200)" дает "K=a b"/(200)). Пустые параметры не допускаются.
+    """
+
+    __slots__ = ('text', 'parameter_count', '_literals', '_terms')
+
+    def __init__(self, template: 'Any') -> None:
+        self.text: str = str(template)
+        # Закодированные куски шаблона между термами с параметрами
+        self._literals: 'List[bytes]' = []
+        # Закодированные части терма между "?" и признак того,
+        # что терм в любом случае нужно заключить в кавычки
+        self._terms: 'List[Tuple[List[bytes], bool]]' = []
+        position = 0
+        for match in _TEMPLATE_TERM_REGEX.finditer(self.text):
+            raw = match.group()
+            if _PLACEHOLDER not in raw:
+                continue
+            quoted = raw[0] == '"'
+            term = raw[1:-1] if quoted else raw
+            self._literals.append(
+                self.text[position:match.start()].encode(UTF))
+            self._terms.append(([part.encode(UTF) for part in
+                                 term.split(_PLACEHOLDER)],
+                                quoted or not term.strip(_PLACEHOLDER)
+                                or bool(_WRAP_REGEX.search(term))))
+            position = match.end()
+        self._literals.append(self.text[position:].encode(UTF))
+        self.parameter_count: int = sum(len(parts) - 1
+                                        for parts, _ in self._terms)
+
+    def bind(self, *values: 'Any') -> PreparedSearch:
+        """
+        Подстановка параметров в шаблон.
+
+        :param values: Значения параметров (по порядку)
+        :return: Закодированное поисковое выражение
+        """
+        if len(values) != self.parameter_count:
+            raise ValueError('Expected ' + str(self.parameter_count)
+                             + ' search parameters, got '
+                             + str(len(values)))
+        chunks: 'List[bytes]' = []
+        append = chunks.append
+        index = 0
+        for literal, (parts, wrap) in zip(self._literals, self._terms):
+            append(literal)
+            encoded: 'List[bytes]' = [parts[0]]
+            for part in parts[1:]:
+                value = str(values[index])
+                index += 1
+                if not value:
+                    raise ValueError('Empty search parameter')
+                if '"' in value:
+                    raise ValueError('Quotes are not allowed '
+                                     'in search parameters')
+                if not wrap and _WRAP_REGEX.search(value):
+                    wrap = True
+                encoded.append(value.encode(UTF))
+                encoded.append(part)
+            if wrap:
+                append(b'"')
+                chunks.extend(encoded)
+                append(b'"')
+            else:
+                chunks.extend(encoded)
+        append(self._literals[-1])
+        return PreparedSearch(b''.join(chunks))
+
+    def __call__(self, *values: 'Any') -> PreparedSearch:
+        return self.bind(*values)
+
+    def __str__(self):
+        return self.text
 
 
 class SearchScenario:
@@ -244,5 +354,6 @@ class CellResult:
         return self.term or '--nothing--'
 
 
-__all__ = ['CellResult', 'FoundLine', 'SearchParameters', 'SearchScenario',
-           'TextParameters', 'TextResult']
+__all__ = ['CellResult', 'FoundLine', 'PreparedSearch', 'SearchParameters',
+           'SearchScenario', 'SearchTemplate', 'TextParameters',
+           'TextResult']
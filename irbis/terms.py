@@ -4,10 +4,12 @@
 Работа с терминами словаря.
 """
 
+from array import array
 from typing import TYPE_CHECKING
 from irbis._common import safe_str
 if TYPE_CHECKING:
-    from typing import Iterable, List, Optional
+    from typing import Dict, Iterable, Iterator, List, Optional, Union
+    from irbis.pft import FormatSpecification
 
 
 class PostingParameters:
@@ -18,10 +20,10 @@ class PostingParameters:
     __slots__ = 'database', 'first', 'fmt', 'number', 'terms'
 
     def __init__(self, term: 'Optional[str]' = None,
-                 fmt: 'Optional[str]' = None) -> None:
+                 fmt: 'Optional[FormatSpecification]' = None) -> None:
         self.database: 'Optional[str]' = None
         self.first: int = 1
-        self.fmt: 'Optional[str]' = fmt
+        self.fmt: 'Optional[FormatSpecification]' = fmt
         self.number: int = 0
         self.terms: 'List[str]' = []
         if term:
@@ -74,7 +76,7 @@ class TermParameters:
         self.number: int = number
         self.reverse: bool = False
         self.start: 'Optional[str]' = start
-        self.format: 'Optional[str]' = None
+        self.format: 'Optional[FormatSpecification]' = None
 
     def __str__(self):
         return str(self.number) + ' ' + safe_str(self.format)
@@ -123,4 +125,287 @@ class TermPosting:
                          subst])
 
 
-__all__ = ['PostingParameters', 'TermInfo', 'TermParameters', 'TermPosting']
+class PostingList:
+    """
+    Компактный список постингов: вместо отдельного объекта TermPosting
+    на каждый постинг хранятся параллельные массивы (колонки) MFN, меток,
+    повторений и смещений, а тексты постингов -- в таблице строк.
+    Объекты TermPosting создаются лишь при обращении к элементам списка.
+    """
+
+    __slots__ = ('mfn', 'tag', 'occurrence', 'count', 'text_index',
+                 'texts', '_text_lookup')
+
+    def __init__(self) -> None:
+        self.mfn: array = array('I')
+        self.tag: array = array('I')
+        self.occurrence: array = array('I')
+        self.count: array = array('I')
+        self.text_index: array = array('I')  # 0 означает отсутствие текста
+        self.texts: 'List[Optional[str]]' = [None]
+        self._text_lookup: 'Dict[str, int]' = {}
+
+    def intern(self, text: 'Optional[str]') -> int:
+        """
+        Помещение текста в таблицу строк.
+
+        :param text: Текст (возможно, пустой)
+        :return: Индекс текста в таблице (0 для пустого текста)
+        """
+        if not text:
+            return 0
+        result = self._text_lookup.get(text)
+        if result is None:
+            result = len(self.texts)
+            self.texts.append(text)
+            self._text_lookup[text] = result
+        return result
+
+    def append(self, mfn: int, tag: int = 0, occurrence: int = 0,
+               count: int = 0, text: 'Optional[str]' = None) -> None:
+        """
+        Добавление постинга в конец списка.
+
+        :param mfn: MFN записи
+        :param tag: Метка поля
+        :param occurrence: Номер повторения поля
+        :param count: Смещение (номер слова) в поле
+        :param text: Текст постинга (опционально)
+        :return: None
+        """
+        self.mfn.append(mfn)
+        self.tag.append(tag)
+        self.occurrence.append(occurrence)
+        self.count.append(count)
+        self.text_index.append(self.intern(text))
+
+    def extend(self, other: 'PostingList') -> None:
+        """
+        Добавление в конец списка постингов из другого списка.
+
+        :param other: Другой список постингов
+        :return: None
+        """
+        self.mfn.extend(other.mfn)
+        self.tag.extend(other.tag)
+        self.occurrence.extend(other.occurrence)
+        self.count.extend(other.count)
+        if len(other.texts) == 1:
+            self.text_index.extend(array('I', [0]) * len(other))
+        else:
+            texts, intern = other.texts, self.intern
+            self.text_index.extend(array('I', (intern(texts[index])
+                                               for index in other.text_index)))
+
+    def text(self, index: int) -> 'Optional[str]':
+        """
+        Текст постинга с указанным индексом.
+
+        :param index: Индекс постинга
+        :return: Текст либо None
+        """
+        return self.texts[self.text_index[index]]
+
+    @staticmethod
+    def parse(lines: 'Iterable[str]') -> 'PostingList':
+        """
+        Разбор ответа сервера (строк вида "MFN#TAG#OCC#CNT[#TEXT]").
+
+        :param lines: Строки ответа
+        :return: Список постингов
+        """
+        result = PostingList()
+        mfn, tag = result.mfn.append, result.tag.append
+        occurrence, count = result.occurrence.append, result.count.append
+        text_index, add_text = result.text_index.append, result.intern
+        for line in lines:
+            parts = line.split('#', 4)
+            if len(parts) >= 4:
+                mfn(int(parts[0]))
+                tag(int(parts[1]))
+                occurrence(int(parts[2]))
+                count(int(parts[3]))
+                text_index(add_text(parts[4]) if len(parts) > 4 else 0)
+            else:
+                # Так же, как TermPosting.parse: постинг без данных
+                mfn(0)
+                tag(0)
+                occurrence(0)
+                count(0)
+                text_index(0)
+        return result
+
+    def _row(self, index: int) -> TermPosting:
+        result = TermPosting()
+        result.mfn = self.mfn[index]
+        result.tag = self.tag[index]
+        result.occurrence = self.occurrence[index]
+        result.count = self.count[index]
+        result.text = self.texts[self.text_index[index]]
+        return result
+
+    def __getitem__(self, index: 'Union[int, slice]') \
+            -> 'Union[TermPosting, PostingList]':
+        if isinstance(index, slice):
+            result = PostingList()
+            result.mfn = self.mfn[index]
+            result.tag = self.tag[index]
+            result.occurrence = self.occurrence[index]
+            result.count = self.count[index]
+            if len(self.texts) == 1:
+                result.text_index = self.text_index[index]
+            else:
+                # Срез получает собственную таблицу строк,
+                # содержащую только его тексты
+                texts, intern = self.texts, result.intern
+                result.text_index = array('I', (
+                    intern(texts[one]) for one in self.text_index[index]))
+            return result
+        if index < 0:
+            index += len(self.mfn)
+        if not 0 <= index < len(self.mfn):
+            raise IndexError(index)
+        return self._row(index)
+
+    def __iter__(self) -> 'Iterator[TermPosting]':
+        for index in range(len(self.mfn)):
+            yield self._row(index)
+
+    def __len__(self):
+        return len(self.mfn)
+
+    def __bool__(self):
+        return bool(self.mfn)
+
+    def __str__(self):
+        return '\n'.join(str(posting) for posting in self)
+
+
+class TermList:
+    """
+    Компактный список терминов: счетчики ссылок хранятся в массиве,
+    тексты -- в списке строк. Объекты TermInfo создаются лишь
+    при обращении к элементам списка.
+    """
+
+    __slots__ = ('count', 'text')
+
+    def __init__(self) -> None:
+        self.count: array = array('I')
+        self.text: 'List[str]' = []
+
+    def append(self, count: int, text: str) -> None:
+        """
+        Добавление термина в конец списка.
+
+        :param count: Количество ссылок
+        :param text: Текст термина
+        :return: None
+        """
+        self.count.append(count)
+        self.text.append(text)
+
+    @staticmethod
+    def parse(lines: 'Iterable[str]') -> 'TermList':
+        """
+        Разбор ответа сервера (строк вида "COUNT#TEXT").
+
+        :param lines: Строки ответа
+        :return: Список терминов
+        """
+        result = TermList()
+        count, text = result.count.append, result.text.append
+        for line in lines:
+            parts = line.split('#', 1)
+            count(int(parts[0]))
+            text(parts[1])
+        return result
+
+    def __getitem__(self, index: 'Union[int, slice]') \
+            -> 'Union[TermInfo, TermList]':
+        if isinstance(index, slice):
+            result = TermList()
+            result.count = self.count[index]
+            result.text = self.text[index]
+            return result
+        return TermInfo(self.count[index], self.text[index])
+
+    def __iter__(self) -> 'Iterator[TermInfo]':
+        for count, text in zip(self.count, self.text):
+            yield TermInfo(count, text)
+
+    def __len__(self):
+        return len(self.count)
+
+    def __bool__(self):
+        return bool(self.count)
+
+    def __str__(self):
+        return '\n'.join(str(term) for term in self)
+
+
+class TermPager:
+    """
+    Постраничный обход поискового словаря: формирует параметры
+    очередной порции термов и отбрасывает повторы на границах порций.
+    Обход прекращается, когда терм выходит за пределы префикса
+    или сервер не возвращает новых термов.
+    """
+
+    __slots__ = ('database', 'prefix', 'page_size', 'reverse', 'start',
+                 'done', '_last')
+
+    def __init__(self, start: str, prefix_stop: 'Union[bool, str]' = True,
+                 page_size: int = 100, reverse: bool = False,
+                 database: str = '') -> None:
+        self.database: str = database
+        if prefix_stop is True:
+            # Префикс вида "A=" берется из стартового терма
+            index = start.find('=')
+            self.prefix: str = start[:index + 1] if index >= 0 else ''
+        else:
+            self.prefix = prefix_stop or ''
+        # Одна порция должна содержать хотя бы один новый терм
+        self.page_size: int = max(page_size, 2)
+        self.reverse: bool = reverse
+        self.start: str = start
+        self.done: bool = False
+        self._last: 'Optional[str]' = None
+
+    def parameters(self) -> TermParameters:
+        """
+        Параметры для считывания очередной порции термов.
+
+        :return: Параметры термов
+        """
+        result = TermParameters(self.start, self.page_size)
+        result.database = self.database
+        result.reverse = self.reverse
+        return result
+
+    def accept(self, page: 'TermList') -> 'List[TermInfo]':
+        """
+        Обработка очередной порции термов, полученной от сервера.
+
+        :param page: Порция термов
+        :return: Новые термы, не выходящие за пределы префикса
+        """
+        result: 'List[TermInfo]' = []
+        prefix, last = self.prefix, self._last
+        for count, text in zip(page.count, page.text):
+            if text == last:
+                continue
+            if prefix and not text.startswith(prefix):
+                self.done = True
+                break
+            result.append(TermInfo(count, text))
+            last = text
+        if not result:
+            self.done = True
+        else:
+            self._last = self.start = result[-1].text
+        return result
+
+
+__all__ = ['PostingList', 'PostingParameters', 'TermInfo', 'TermList',
+           'TermPager', 'TermParameters', 'TermPosting']
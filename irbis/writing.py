@@ -0,0 +1,123 @@
+# coding: utf-8
+
+"""
+Результаты пакетного сохранения записей (Connection.write_records).
+"""
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Iterable, List, Optional
+    from irbis.records import Record
+
+
+class RecordResult:
+    """
+    Результат сохранения одной записи.
+    """
+
+    __slots__ = ('record', 'mfn', 'status', 'error_code', 'error')
+
+    def __init__(self, record: 'Record') -> None:
+        self.record: 'Record' = record
+        self.mfn: int = record.mfn  # MFN, присвоенный сервером
+        self.status: int = record.status
+        self.error_code: int = 0  # Код ошибки ИРБИС
+        self.error: 'Optional[BaseException]' = None
+
+    @property
+    def ok(self) -> bool:
+        """
+        Запись сохранена успешно?
+        """
+        return self.error is None and self.error_code >= 0
+
+    def __str__(self):
+        if self.ok:
+            return f"{self.mfn}: ok"
+        if self.error is not None:
+            return f"{self.mfn}: {self.error!r}"
+        return f"{self.mfn}: error {self.error_code}"
+
+
+class WriteResult:
+    """
+    Результат пакетного сохранения: сведения о каждой записи
+    (в порядке записей), времени обмена с сервером и объеме
+    переданных данных. Истинен, если все записи сохранены
+    и сохранение в целом не завершилось ошибкой (например,
+    нет подключения к серверу).
+    """
+
+    __slots__ = ('records', 'error_code', 'chunk_times', 'elapsed',
+                 'bytes_sent')
+
+    def __init__(self) -> None:
+        self.records: 'List[RecordResult]' = []
+        # Код ошибки всего сохранения: NOT_CONNECTED либо код возврата
+        # сервера для первой отвергнутой порции
+        self.error_code: int = 0
+        self.chunk_times: 'List[float]' = []  # Секунды на каждую порцию
+        self.elapsed: float = 0.0  # Секунды на все сохранение
+        self.bytes_sent: int = 0
+
+    def add_failed(self, records: 'Iterable[Record]', error_code: int = 0,
+                   error: 'Optional[BaseException]' = None) -> None:
+        """
+        Добавление записей, которые не удалось сохранить.
+
+        :param records: Записи
+        :param error_code: Код ошибки ИРБИС
+        :param error: Исключение (опционально)
+        :return: None
+        """
+        for record in records:
+            one = RecordResult(record)
+            one.error_code = error_code
+            one.error = error
+            self.records.append(one)
+
+    @property
+    def failures(self) -> 'List[RecordResult]':
+        """
+        Записи, которые не удалось сохранить.
+        """
+        return [one for one in self.records if not one.ok]
+
+    @property
+    def ok(self) -> bool:
+        """
+        Все записи сохранены успешно?
+        """
+        return self.error_code >= 0 and all(one.ok for one in self.records)
+
+    @property
+    def written(self) -> int:
+        """
+        Количество успешно сохраненных записей.
+        """
+        return sum(1 for one in self.records if one.ok)
+
+    @property
+    def records_per_second(self) -> float:
+        """
+        Пропускная способность: записей в секунду.
+        """
+        return self.written / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        """
+        Пропускная способность: байт в секунду.
+        """
+        return self.bytes_sent / self.elapsed if self.elapsed else 0.0
+
+    def __bool__(self):
+        return self.ok
+
+    def __str__(self):
+        return f"{self.written} of {len(self.records)} records written " \
+               f"in {len(self.chunk_times)} chunks, {self.elapsed:.3f} s " \
+               f"({self.records_per_second:.0f} records/s)"
+
+
+__all__ = ['RecordResult', 'WriteResult']
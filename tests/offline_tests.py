@@ -4,19 +4,33 @@
 Tests that doesn't require the IRBIS server connection.
 """
 
+import asyncio
+import copy
+import importlib.util
+import io
+import pickle
 import random
+import threading
+import time
 import os
 import os.path
 import unittest
+from array import array
 from sys import platform
 from collections import OrderedDict
 
 from irbis import *
 from irbis._common import same_string, safe_str, safe_int, irbis_to_dos, \
     irbis_to_lines, short_irbis_to_lines
+from irbis import codec
+from irbis.abstract import AttrRedirect
+from irbis.local_search import difference, FIELD_LEVEL, intersect, \
+    MFN_LEVEL, posting_keys, REPEAT_LEVEL, union
+from irbis.pft import projection_format
 from irbis.builder import author, bbk, document_kind, keyword, language, \
-    magazine, mhr, number, place, publisher, rzn, Search, subject, title, \
-    udc, year
+    magazine, mhr, normalize_search, number, parse_search, place, \
+    publisher, rzn, Search, search_cache_key, SearchPlanner, subject, \
+    title, udc, year
 
 #############################################################################
 
@@ -862,6 +876,16 @@ class TestMarcRecord(unittest.TestCase):
         self.assertIn(field, record.fields)
         self.assertRaises(ValueError, record.add, 100, 'Some value')
 
+    def test_add_duplicate_2(self):
+        record = Record()
+        field = record.add(100)
+        record.add(200, 'Some value')
+        field.add('a', 'Some value')
+        self.assertRaises(ValueError, record.add, 100, '^aSome value')
+        record.add(100, '^aSome value', unique=False)
+        self.assertEqual(2, len(record.all(100)))
+        self.assertEqual(3, len(record.fields))
+
     def test_all_1(self):
         record = Record()
         record.add(100, 'Field100')
@@ -1294,6 +1318,40 @@ class TestFileSpecification(unittest.TestCase):
 #############################################################################
 
 
+class TestServerResponse(unittest.TestCase):
+
+    @staticmethod
+    def get_response(data: bytes):
+        result = ServerResponse(Connection())
+        result._memory.extend(data)
+        result._view = memoryview(result._memory)
+        return result
+
+    def test_utf_remaining_lines_1(self):
+        response = self.get_response('Привет\r\nмир\r\n'.encode('utf-8'))
+        self.assertEqual(response.utf_remaining_lines(), ['Привет', 'мир'])
+        self.assertEqual(response.utf_remaining_lines(), [])
+
+    def test_utf_remaining_lines_2(self):
+        response = self.get_response(b'1\r\n2\r\n\r\n3\r\n4')
+        self.assertEqual(response.utf_remaining_lines(), ['1', '2'])
+        self.assertEqual(response.utf_remaining_lines(), ['3', '4'])
+
+    def test_ansi_remaining_lines_1(self):
+        response = self.get_response('Привет\r\nмир'.encode('cp1251'))
+        self.assertEqual(response.ansi(), 'Привет')
+        self.assertEqual(response.ansi_remaining_lines(), ['мир'])
+
+    def test_remaining_numbers_1(self):
+        response = self.get_response(b'3\r\n1\r\n20\r\n300\r\n')
+        self.assertEqual(response.number(), 3)
+        self.assertEqual(response.remaining_numbers().tolist(),
+                         [1, 20, 300])
+        self.assertEqual(len(response.remaining_numbers()), 0)
+
+#############################################################################
+
+
 class TestIrbisFormat(unittest.TestCase):
 
     def test_comments_1(self):
@@ -1320,6 +1378,2101 @@ class TestIrbisFormat(unittest.TestCase):
         self.assertEqual("v100",
                          prepare_format("v100/*comment"))
 
+    def test_prepare_2(self):
+        self.assertEqual("'/*', v100", prepare_format("'/*', v100/*comment"))
+        self.assertEqual("'unclosed /* v100",
+                         prepare_format("'unclosed /* v100"))
+        self.assertEqual("v100/v200", prepare_format("v100/v200"))
+        self.assertEqual("v100|/*||x|v200",
+                         prepare_format("v100|/*||x|/*c\nv200"))
+
+    def test_compiled_1(self):
+        compiled = CompiledFormat("v200^a,/*comment\r\nv300")
+        self.assertEqual(compiled.prepared, "v200^a,v300")
+        self.assertEqual(compiled.encoded, b"!v200^a,v300")
+        self.assertEqual(str(compiled), "v200^a,/*comment\r\nv300")
+
+    def test_compiled_2(self):
+        self.assertEqual(CompiledFormat('@brief').encoded, b'@brief')
+        self.assertEqual(CompiledFormat('!v200').encoded, b'!v200')
+        self.assertEqual(CompiledFormat("'Ё'").encoded,
+                         "!'Ё'".encode('utf-8'))
+
+    def test_compile_format_1(self):
+        first = compile_format('v200^a')
+        self.assertIs(compile_format('v200^a'), first)
+        self.assertIs(compile_format(first), first)
+
+    def test_query_format_1(self):
+        connection = Connection()
+        plain = ClientQuery(connection, 'G').format("v200/*c\nv300")
+        connection.query_id = 0
+        compiled = ClientQuery(connection, 'G')
+        compiled.format(CompiledFormat("v200/*c\nv300"))
+        self.assertEqual(plain.encode(), compiled.encode())
+        self.assertTrue(plain.encode().endswith(b'\n!v200v300\n'))
+
+    def test_query_format_2(self):
+        # Строка формата и подготовленный формат кодируются одинаково
+        # в параметрах поиска, постингов и термов
+        connection = Connection()
+        source = "v200/*комментарий\n,'Ё'"
+
+        def encode(make_query, format_specification):
+            connection.query_id = 0
+            return make_query(format_specification).encode()
+
+        def search_query(format_specification):
+            parameters = SearchParameters('K=X')
+            parameters.format = format_specification
+            query = ClientQuery(connection, 'K')
+            parameters.encode(query, connection)
+            return query
+
+        def postings_query(format_specification):
+            parameters = PostingParameters('K=X')
+            parameters.fmt = format_specification
+            return connection._read_postings_query(parameters)
+
+        def terms_query(format_specification):
+            parameters = TermParameters('K=X')
+            parameters.format = format_specification
+            return connection._read_terms_query(parameters)
+
+        for make_query in (search_query, postings_query, terms_query):
+            plain = encode(make_query, source)
+            self.assertEqual(plain,
+                             encode(make_query, CompiledFormat(source)))
+            self.assertIn(b"\n!v200,'" + 'Ё'.encode('utf-8') + b"'\n",
+                          plain)
+            self.assertEqual(encode(make_query, None),
+                             encode(make_query, ''))
+
+#############################################################################
+
+
+class TestPostingList(unittest.TestCase):
+
+    def test_parse_1(self):
+        postings = PostingList.parse(['1#200#1#1#Title',
+                                      '2#700#2#3',
+                                      '3#200#1#2#Title'])
+        self.assertEqual(3, len(postings))
+        self.assertTrue(postings)
+        self.assertEqual([1, 2, 3], postings.mfn.tolist())
+        self.assertEqual([200, 700, 200], postings.tag.tolist())
+        self.assertEqual('Title', postings.text(0))
+        self.assertIsNone(postings.text(1))
+        self.assertEqual([None, 'Title'], postings.texts)
+
+    def test_parse_2(self):
+        postings = PostingList.parse(['garbage'])
+        self.assertEqual(1, len(postings))
+        self.assertEqual(0, postings[0].mfn)
+        self.assertFalse(PostingList())
+
+    def test_getitem_1(self):
+        postings = PostingList.parse(['1#200#1#1#Title', '2#700#2#3'])
+        posting = postings[-1]
+        self.assertIsInstance(posting, TermPosting)
+        self.assertEqual(2, posting.mfn)
+        self.assertEqual(700, posting.tag)
+        self.assertEqual(2, posting.occurrence)
+        self.assertEqual(3, posting.count)
+        self.assertIsNone(posting.text)
+        with self.assertRaises(IndexError):
+            _ = postings[2]
+
+    def test_slice_1(self):
+        postings = PostingList.parse(['1#200#1#1#A', '2#200#1#1#B',
+                                      '3#200#1#1#C'])
+        tail = postings[1:]
+        self.assertIsInstance(tail, PostingList)
+        self.assertEqual([2, 3], tail.mfn.tolist())
+        self.assertEqual(['B', 'C'], [one.text for one in tail])
+
+    def test_slice_2(self):
+        # Срез не разделяет таблицу текстов с исходным списком
+        postings = PostingList.parse(['1#200#1#1#A', '2#200#1#1#B',
+                                      '3#200#1#1', '4#200#1#1#B'])
+        tail = postings[1:]
+        self.assertEqual([None, 'B'], tail.texts)
+        self.assertEqual(['B', None, 'B'], [one.text for one in tail])
+        tail.append(5, 200, 1, 1, 'D')
+        postings.append(6, 200, 1, 1, 'E')
+        self.assertEqual([None, 'B', 'D'], tail.texts)
+        self.assertEqual([None, 'A', 'B', 'E'], postings.texts)
+        self.assertEqual('E', postings.text(4))
+        self.assertEqual('D', tail.text(3))
+        self.assertEqual([None], PostingList.parse(['1#200#1#1'])[:1].texts)
+
+    def test_iter_1(self):
+        lines = ['1#200#1#1#A', '2#700#2#3']
+        postings = PostingList.parse(lines)
+        expected = []
+        for line in lines:
+            one = TermPosting()
+            one.parse(line)
+            expected.append(str(one))
+        self.assertEqual(expected, [str(one) for one in postings])
+        self.assertEqual('\n'.join(expected), str(postings))
+
+    def test_extend_1(self):
+        first = PostingList.parse(['1#200#1#1#A'])
+        first.append(2, 200, 1, 1, 'B')
+        second = PostingList.parse(['3#200#1#1#B', '4#200#1#1'])
+        first.extend(second)
+        self.assertEqual(4, len(first))
+        self.assertEqual([None, 'A', 'B'], first.texts)
+        self.assertEqual(['A', 'B', 'B', None],
+                         [first.text(i) for i in range(4)])
+
+
+class TestTermList(unittest.TestCase):
+
+    def test_parse_1(self):
+        terms = TermList.parse(['10#A=FIRST', '2#A=SECOND#X'])
+        self.assertEqual(2, len(terms))
+        self.assertEqual([10, 2], terms.count.tolist())
+        self.assertEqual(['A=FIRST', 'A=SECOND#X'], terms.text)
+        term = terms[1]
+        self.assertIsInstance(term, TermInfo)
+        self.assertEqual(2, term.count)
+        self.assertEqual('A=SECOND#X', term.text)
+
+    def test_iter_1(self):
+        lines = ['10#A=FIRST', '2#A=SECOND']
+        terms = TermList.parse(lines)
+        self.assertEqual(lines, [str(term) for term in terms])
+        self.assertEqual(['2#A=SECOND'], [str(t) for t in terms[1:]])
+        self.assertFalse(TermList())
+
+
+class FakeTermConnection(Connection):
+    """
+    Подключение, отвечающее на запросы термов и постингов
+    из словаря в памяти.
+    """
+
+    __slots__ = ('terms', 'postings', 'starts')
+
+    def __init__(self, terms, postings=None):
+        super().__init__()
+        self.connected = True
+        self.terms = sorted(terms)
+        self.postings = postings or {}
+        self.starts = []
+
+    def execute(self, query):
+        lines = bytes(query._memory).decode('utf-8').split('\n')
+        if lines[0] == 'I':
+            return self.execute_postings(lines)
+        command, start, number = lines[0], lines[11], int(lines[12])
+        self.starts.append(start)
+        if command == 'P':
+            found = [t for t in self.terms if t <= start][::-1][:number]
+        else:
+            found = [t for t in self.terms if t >= start][:number]
+        text = '0\r\n' + ''.join(str(len(self.postings.get(t, 'x'))) + '#'
+                                  + t + '\r\n' for t in found)
+        return TestServerResponse.get_response(text.encode('utf-8'))
+
+    def execute_postings(self, lines):
+        number, first, terms = int(lines[11]), int(lines[12]), lines[14:-1]
+        self.starts.append((terms[0], first))
+        found = [p for term in terms for p in self.postings.get(term, [])]
+        if not found:
+            return TestServerResponse.get_response(b'-202\r\n')
+        found = found[first - 1:first - 1 + number]
+        text = '0\r\n' + ''.join(p + '\r\n' for p in found)
+        return TestServerResponse.get_response(text.encode('utf-8'))
+
+    async def execute_async(self, query):
+        return self.execute(query)
+
+    def get_max_mfn(self, database=None):
+        return 100
+
+
+class TestTermPager(unittest.TestCase):
+
+    TERMS = ['A=ALPHA', 'A=BETA', 'A=GAMMA', 'A=OMEGA', 'B=FIRST',
+             'B=SECOND', 'K=KEY']
+
+    def test_prefix_1(self):
+        self.assertEqual('A=', TermPager('A=BETA').prefix)
+        self.assertEqual('', TermPager('A=BETA', False).prefix)
+        self.assertEqual('A=B', TermPager('A=BETA', 'A=B').prefix)
+
+    def test_iter_terms_1(self):
+        connection = FakeTermConnection(self.TERMS)
+        terms = [t.text for t in connection.iter_terms('A=', page_size=2)]
+        self.assertEqual(self.TERMS[:4], terms)
+        self.assertEqual(['A=', 'A=BETA', 'A=GAMMA', 'A=OMEGA'],
+                         connection.starts)
+
+    def test_iter_terms_2(self):
+        connection = FakeTermConnection(self.TERMS)
+        terms = [t.text for t in connection.iter_terms('A=GAMMA', False,
+                                                       page_size=3,
+                                                       prefetch=False)]
+        self.assertEqual(self.TERMS[2:], terms)
+
+    def test_iter_terms_3(self):
+        connection = FakeTermConnection(self.TERMS)
+        terms = [t.text for t in connection.iter_terms('B=SECOND',
+                                                       page_size=2,
+                                                       reverse=True)]
+        self.assertEqual(['B=SECOND', 'B=FIRST'], terms)
+
+    def test_iter_terms_4(self):
+        connection = FakeTermConnection(self.TERMS)
+        iterator = connection.iter_terms('A=', page_size=2)
+        self.assertEqual('A=ALPHA', next(iterator).text)
+        iterator.close()
+        self.assertFalse(list(Connection().iter_terms('A=')))
+        with self.assertRaises(TypeError):
+            connection.iter_terms('A=', True, 2)
+
+    def test_iter_terms_async_1(self):
+        connection = FakeTermConnection(self.TERMS)
+
+        async def collect():
+            return [t.text async for t in
+                    connection.iter_terms_async('B=', page_size=2)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            terms = loop.run_until_complete(collect())
+        finally:
+            loop.close()
+        self.assertEqual(['B=FIRST', 'B=SECOND'], terms)
+
+
+class TestIterPostings(unittest.TestCase):
+
+    POSTINGS = {'K=ONE': ['%d#610#1#1' % mfn for mfn in range(1, 8)],
+                'K=TWO': ['3#610#1#1', '9#610#2#1']}
+
+    def test_iter_postings_1(self):
+        connection = FakeTermConnection([], self.POSTINGS)
+        pages = list(connection.iter_postings('K=ONE', page_size=3))
+        self.assertEqual([3, 3, 1], [len(page) for page in pages])
+        self.assertIsInstance(pages[0], PostingList)
+        merged = PostingList()
+        for page in pages:
+            merged.extend(page)
+        self.assertEqual(list(range(1, 8)), merged.mfn.tolist())
+        self.assertEqual([('K=ONE', 1), ('K=ONE', 4), ('K=ONE', 7)],
+                         connection.starts)
+
+    def test_iter_postings_2(self):
+        connection = FakeTermConnection([], self.POSTINGS)
+        pages = list(connection.iter_postings(['K=TWO', 'K=NONE', 'K=ONE'],
+                                              page_size=4, prefetch=False))
+        self.assertEqual([[3, 9], [1, 2, 3, 4], [5, 6, 7]],
+                         [page.mfn.tolist() for page in pages])
+
+    def test_iter_postings_3(self):
+        connection = FakeTermConnection([], self.POSTINGS)
+        self.assertFalse(list(connection.iter_postings([])))
+        self.assertFalse(list(Connection().iter_postings('K=ONE')))
+
+
+class TestLocalSearch(unittest.TestCase):
+
+    # MFN#TAG#OCC#CNT
+    POSTINGS = {'A=PUSHKIN': ['1#700#1#1', '2#701#1#1', '3#700#1#1'],
+                'A=PUSHKINA': ['4#700#1#1'],
+                'T=POEMS': ['1#200#1#1', '2#200#1#1', '5#200#1#1'],
+                'K=RED': ['1#610#1#1', '2#610#1#1', '3#610#2#1'],
+                'K=WINE': ['1#610#2#1', '2#610#1#2', '3#610#2#2',
+                           '3#606#1#1']}
+
+    def get_search(self):
+        connection = FakeTermConnection(list(self.POSTINGS), self.POSTINGS)
+        return LocalSearch(connection, page_size=2)
+
+    def test_posting_keys_1(self):
+        postings = PostingList()
+        postings.append(1, 200, 65535)
+        postings.append(1, 200, 1)
+        postings.append(2, 200, 1)
+        self.assertEqual([(1 << 32) | (200 << 16) | 1,
+                          (1 << 32) | (200 << 16) | 65535,
+                          (2 << 32) | (200 << 16) | 1],
+                         posting_keys(postings, REPEAT_LEVEL).tolist())
+        # Повторение, не помещающееся в ключ, не должно
+        # перекрывать метку и MFN
+        postings.append(1, 200, 65536)
+        with self.assertRaises(ValueError):
+            posting_keys(postings, REPEAT_LEVEL)
+        self.assertEqual([(1 << 16) | 200, (2 << 16) | 200],
+                         posting_keys(postings, FIELD_LEVEL).tolist())
+        postings.append(3, 70000, 1)
+        with self.assertRaises(ValueError):
+            posting_keys(postings, FIELD_LEVEL)
+        self.assertEqual([1, 2, 3],
+                         posting_keys(postings, MFN_LEVEL).tolist())
+
+    def test_merge_1(self):
+        rnd = random.Random(1)
+        for _ in range(200):
+            first = set(rnd.sample(range(100), rnd.randint(0, 50)))
+            second = set(rnd.sample(range(100), rnd.randint(0, 5)))
+            a = array('Q', sorted(first))
+            b = array('Q', sorted(second))
+            self.assertEqual(sorted(first & second), list(intersect(a, b)))
+            self.assertEqual(sorted(first & second), list(intersect(b, a)))
+            self.assertEqual(sorted(first | second), list(union(a, b)))
+            self.assertEqual(sorted(first - second), list(difference(a, b)))
+            self.assertEqual(sorted(second - first), list(difference(b, a)))
+
+    def test_parse_1(self):
+        node = parse_search('A=X + T=Y * "K=A B" ^ K=C$')
+        self.assertEqual('(A=X + (T=Y * ("K=A B" ^ K=C$)))', str(node))
+        self.assertTrue(node.items[1].items[1].items[1].truncated)
+
+    def test_parse_2(self):
+        node = parse_search(keyword('RED').same_repeat(keyword('WINE')))
+        self.assertEqual('(F)', node.operator)
+        self.assertEqual('(K=RED (G) K=A)',
+                         str(parse_search('(K=RED (g) K=A)')))
+
+    def test_parse_3(self):
+        for bad in ('', '(A=X', 'A=X)', 'A=X +', 'A=X T=Y', '"A=X',
+                    'K=A . K=B', 'K=A/(200)'):
+            with self.assertRaises(ValueError):
+                parse_search(bad)
+
+    def test_search_1(self):
+        search = self.get_search()
+        self.assertEqual([1, 2, 3], search.search('A=PUSHKIN'))
+        self.assertEqual([1, 2], search.search(
+            author('Pushkin').and_(title('Poems'))))
+        self.assertEqual([1, 2, 3, 5], search.search('A=PUSHKIN + T=POEMS'))
+        self.assertEqual([3], search.search('A=PUSHKIN ^ T=POEMS'))
+        self.assertEqual(0, search.count('A=NOBODY * T=POEMS'))
+
+    def test_search_2(self):
+        search = self.get_search()
+        self.assertEqual([1, 2, 3, 4], search.search('A=PUSHKIN$'))
+        self.assertEqual([4], search.search('A=PUSHKIN$ ^ A=PUSHKIN'))
+
+    def test_search_3(self):
+        search = self.get_search()
+        self.assertEqual([1, 2, 3], search.search('K=RED * K=WINE'))
+        self.assertEqual([1, 2, 3], search.search('K=RED (G) K=WINE'))
+        self.assertEqual([2, 3], search.search('K=RED (F) K=WINE'))
+        self.assertEqual([3], search.search(
+            '(K=RED (F) K=WINE) ^ (A=PUSHKIN * T=POEMS)'))
+
+    def test_search_local_1(self):
+        connection = FakeTermConnection(list(self.POSTINGS), self.POSTINGS)
+        self.assertEqual([1, 2], connection.search_local(
+            'A=PUSHKIN * T=POEMS', page_size=2))
+        self.assertEqual([], Connection().search_local('A=PUSHKIN'))
+
+
+class TestSearchPlanner(unittest.TestCase):
+
+    def test_node_1(self):
+        expressions = [author('Byron', 'Shelley').and_(title('Poems$')),
+                       keyword('A').or_('K=B', '(K=C * K=D)').not_('K=E'),
+                       year(1990).same_field(keyword('X')).same_repeat('Y'),
+                       Search.all().and_(language('rus'))]
+        for expression in expressions:
+            self.assertEqual(str(expression), str(expression.node))
+            self.assertEqual(str(parse_search(expression)),
+                             str(expression.node))
+
+    def test_node_2(self):
+        # Операнды, которые разбор не поддерживает, остаются как есть
+        expression = keyword('A').and_('(K=X . K=Y)')
+        self.assertEqual('(K=A * (K=X . K=Y))', str(expression))
+        self.assertEqual(str(expression), str(expression.node))
+        expression = keyword('A').or_('"K=X$"/(200)').not_('(K=B (F) K=C)')
+        self.assertEqual('((K=A + "K=X$"/(200)) ^ (K=B (F) K=C))',
+                         str(expression))
+        self.assertEqual(str(expression), str(expression.node))
+        expression = keyword('b').same_field('(K=X . K=Y)') \
+            .same_repeat('"K=Z$"/(200)')
+        self.assertEqual('((K=b (G) (K=X . K=Y)) (F) "K=Z$"/(200))',
+                         str(expression))
+        self.assertEqual('("K=Z$"/(200) (F) ((K=X . K=Y) (G) K=B))',
+                         expression.cache_key())
+        planner = SearchPlanner(FakeTermConnection([], {}))
+        self.assertEqual('(K=X . K=Y)', str(planner.plan(
+            keyword('NONE').or_('(K=X . K=Y)'))))
+        with self.assertRaises(ValueError):
+            LocalSearch(FakeTermConnection([], {})).search(expression)
+
+    def test_normalize_1(self):
+        self.assertEqual('((A=1 * B=1) + (C=1 ^ D=1))', str(normalize_search(
+            '(b=1 * (a=1 * I=$)) + (c=1 ^ d=1 ^ d=1) + (a=1 * b=1)')))
+        self.assertEqual('I=$', str(normalize_search('A=X + I=$')))
+        self.assertEqual('I=$', str(normalize_search('I=$ * I=$')))
+        self.assertEqual('(A=1 ^ B=1 ^ C=1)',
+                         str(normalize_search('(A=1 ^ C=1) ^ B=1')))
+        self.assertEqual('(A=1 ^ (B=1 ^ C=1))',
+                         str(normalize_search('A=1 ^ (B=1 ^ C=1)')))
+
+    def test_cache_key_1(self):
+        first = author('Byron').and_(title('Poems'), author('Byron'))
+        second = title('POEMS').and_(author('byron'))
+        self.assertEqual(first.cache_key(), second.cache_key())
+        self.assertEqual('(A=BYRON * T=POEMS)', str(first.normalize()))
+        self.assertNotEqual(first.cache_key(),
+                            search_cache_key('A=BYRON + T=POEMS'))
+
+    def test_plan_1(self):
+        postings = {'A=COMMON': ['1#1#1#1'] * 50, 'A=RARE': ['1#1#1#1'],
+                    'A=MIDDLE': ['1#1#1#1'] * 5}
+        planner = SearchPlanner(FakeTermConnection(list(postings),
+                                                   postings))
+        self.assertEqual(1, planner.term_count('a=rare'))
+        self.assertEqual(0, planner.term_count('A=NONE'))
+        self.assertEqual(56, planner.term_count('A=$'))
+        self.assertEqual(100, planner.term_count('I=$'))
+        self.assertEqual('(A=RARE * A=MIDDLE * A=COMMON)', str(planner.plan(
+            'A=COMMON * A=MIDDLE * A=RARE')))
+        self.assertEqual('A=RARE', str(planner.plan('A=NONE + A=RARE')))
+        self.assertEqual('(A=COMMON ^ A=RARE)', str(planner.plan(
+            'A=COMMON ^ A=NONE ^ A=RARE')))
+        self.assertEqual(['(A=COMMON + A=MIDDLE)', 'A=RARE'],
+                         [str(node) for node in planner.split(
+                             'A=RARE + A=MIDDLE + A=COMMON', 2)])
+
+
+class TestSearchTemplate(unittest.TestCase):
+
+    def test_bind_1(self):
+        template = SearchTemplate('A=? * G=?')
+        self.assertEqual(2, template.parameter_count)
+        prepared = template.bind('Byron', 1990)
+        self.assertIsInstance(prepared, PreparedSearch)
+        self.assertEqual('A=Byron * G=1990', str(prepared))
+        self.assertEqual('A=Byron * G=1990'.encode('utf-8'),
+                         prepared.encoded)
+        self.assertEqual('"A=Лорд Байрон" * G=1990',
+                         str(template('Лорд Байрон', 1990)))
+
+    def test_bind_2(self):
+        template = SearchTemplate(author('?').and_(title('?$')))
+        self.assertEqual('(A=Byron * T=Poems$)',
+                         str(template('Byron', 'Poems')))
+        self.assertEqual('(A=Byron * "T=Child Harold$")',
+                         str(template('Byron', 'Child Harold')))
+        self.assertEqual('(A=Byron * "T=a+b$")',
+                         str(template('Byron', 'a+b')))
+
+    def test_bind_3(self):
+        template = SearchTemplate('"K=red ?" + K=?')
+        self.assertEqual('"K=red wine" + K=X', str(template('wine', 'X')))
+        with self.assertRaises(ValueError):
+            template('x')
+        with self.assertRaises(ValueError):
+            template('x', 'a"b')
+
+    def test_bind_4(self):
+        template = SearchTemplate('K=?/(200,700) * "T=?"/(200) + A=a/b?')
+        self.assertEqual(3, template.parameter_count)
+        self.assertEqual('"K=a b"/(200,700) * "T=c"/(200) + A=a/bd',
+                         str(template('a b', 'c', 'd')))
+        self.assertEqual('K=ab/(200,700) * "T=c d"/(200) + "A=a/be f"',
+                         str(template('ab', 'c d', 'e f')))
+
+    def test_bind_5(self):
+        for template in (SearchTemplate('K=?/(200)'),
+                         SearchTemplate('"K=?"'),
+                         SearchTemplate(title('?$'))):
+            with self.assertRaises(ValueError):
+                template('')
+
+    def test_encode_1(self):
+        connection = Connection()
+        template = SearchTemplate('A=? * "T=?"')
+        prepared = template('Пушкин', 'Сказки')
+        plain = 'A=Пушкин * "T=Сказки"'
+        first = ClientQuery(connection, 'K')
+        SearchParameters(prepared).encode(first, connection)
+        connection.query_id = 0
+        second = ClientQuery(connection, 'K')
+        SearchParameters(plain).encode(second, connection)
+        self.assertEqual(second.encode(), first.encode())
+        self.assertEqual(plain, str(SearchParameters(prepared)))
+
+
+class FakeSearchConnection(Connection):
+    """
+    Подключение, отвечающее на поисковые запросы без сервера.
+    """
+
+    __slots__ = ('found', 'delay', 'fail')
+
+    def __init__(self, host, found, delay=0.0, fail=False):
+        super().__init__(host)
+        self.connected = True
+        self.found = found  # База данных -> список MFN
+        self.delay = delay
+        self.fail = fail
+
+    def search(self, parameters):
+        time.sleep(self.delay)
+        if self.fail:
+            raise OSError('connection refused')
+        if self.database not in self.found:
+            self.last_error = -140
+            return []
+        return self.found[self.database]
+
+    def search_count(self, expression):
+        return len(self.search(expression))
+
+    def search_format(self, expression, format_specification, limit=0):
+        return ['record ' + str(mfn) for mfn in self.search(expression)]
+
+
+class TestFederatedSearch(unittest.TestCase):
+
+    def test_search_1(self):
+        first = FakeSearchConnection('one', {'IBIS': [1, 2], 'RDR': [5]})
+        second = FakeSearchConnection('two', {'IBIS': [2, 3]})
+        search = FederatedSearch([first, (first, 'RDR'), second,
+                                  SearchTarget(second, name='copy')])
+        result = search.search('K=X')
+        self.assertTrue(result.complete)
+        self.assertEqual([('one:6666/IBIS', 1), ('one:6666/IBIS', 2),
+                          ('one:6666/RDR', 5), ('two:6666/IBIS', 2),
+                          ('two:6666/IBIS', 3), ('copy', 2), ('copy', 3)],
+                         result.items)
+        self.assertEqual('IBIS', first.database)
+        self.assertEqual(7, search.search_count('K=X').items)
+        self.assertEqual(['record 1', 'record 2', 'record 5', 'record 3'],
+                         search.search_format('K=X', '@brief').items)
+
+    def test_search_2(self):
+        good = FakeSearchConnection('good', {'IBIS': [1]})
+        slow = FakeSearchConnection('slow', {'IBIS': [2]}, delay=0.5)
+        broken = FakeSearchConnection('broken', {}, fail=True)
+        missing = FakeSearchConnection('missing', {})
+        search = FederatedSearch([good, slow, broken, missing], timeout=0.1)
+        result = search.search('K=X')
+        self.assertEqual([('good:6666/IBIS', 1)], result.items)
+        self.assertFalse(result.complete)
+        good_result, slow_result, broken_result, missing_result = \
+            result.targets
+        self.assertTrue(good_result.ok)
+        self.assertTrue(slow_result.timed_out)
+        self.assertIsInstance(broken_result.error, OSError)
+        self.assertEqual(-140, missing_result.error_code)
+        self.assertEqual(3, len(result.failures))
+        self.assertIn('timeout', str(result))
+
+    def test_search_3(self):
+        # Срок отсчитывается от начала обработки каждой цели
+        connection = FakeSearchConnection('one', {'IBIS': [1], 'RDR': [2]},
+                                          delay=0.2)
+        search = FederatedSearch([connection, (connection, 'RDR')],
+                                 timeout=0.3)
+        result = search.search('K=X')
+        self.assertTrue(result.complete)
+        self.assertEqual([('one:6666/IBIS', 1), ('one:6666/RDR', 2)],
+                         result.items)
+
+    def test_search_4(self):
+        # Зависшая цель удерживает подключение до своего завершения
+        connection = FakeSearchConnection('one', {'IBIS': [1], 'RDR': [2]})
+
+        def action(current):
+            before = current.database
+            time.sleep(0.3 if before == 'RDR' else 0.05)
+            return before, current.database
+
+        first = FederatedSearch([(connection, 'RDR'), connection],
+                                timeout=0.1)
+        second = FederatedSearch([connection], timeout=1.0)
+        first_result, second_result = first.run(action)
+        self.assertTrue(first_result.timed_out)
+        self.assertTrue(second_result.timed_out)
+        self.assertLess(first_result.elapsed, 0.3)
+        result, = second.run(action)
+        self.assertTrue(result.ok)
+        self.assertEqual(('IBIS', 'IBIS'), result.result)
+        self.assertEqual('IBIS', connection.database)
+
+
+class FakeReplica(Connection):
+    """
+    Сервер-реплика с управляемой задержкой и доступностью.
+    """
+
+    __slots__ = ('delay', 'down', 'calls', 'writes', 'nop_delay')
+
+    def __init__(self, host, delay=0.0):
+        super().__init__(host)
+        self.connected = True
+        self.delay = delay
+        self.nop_delay = 0.0
+        self.down = False
+        self.calls = 0
+        self.writes = 0
+
+    def read_record(self, mfn, version=0):
+        self.calls += 1
+        if self.down:
+            raise ConnectionRefusedError(self.host)
+        if mfn <= 0:
+            raise ValueError('mfn')
+        time.sleep(self.delay)
+        record = Record()
+        record.mfn = mfn
+        record.database = self.host
+        return record
+
+    async def read_record_async(self, mfn, version=0):
+        self.calls += 1
+        if mfn <= 0:
+            raise asyncio.CancelledError()
+        return self.read_record(mfn, version)
+
+    def write_record(self, record, lock=False, actualize=True,
+                     dont_parse=False):
+        self.writes += 1
+        return 1
+
+    def iter_search_read(self, expression, page_size=100, limit=0,
+                         tags=None, prefetch=False):
+        self.calls += 1
+        yield self.read_record(1)
+
+    def nop(self):
+        time.sleep(self.nop_delay)
+        if self.down == 'irbis':
+            raise IrbisError(-3333)
+        return not self.down
+
+
+class TestRoutingConnection(unittest.TestCase):
+
+    def test_route_1(self):
+        primary = FakeReplica('primary')
+        fast, slow = FakeReplica('fast', 0.001), FakeReplica('slow', 0.02)
+        router = RoutingConnection(primary, [fast, slow])
+        hosts = [router.read_record(1).database for _ in range(20)]
+        self.assertEqual(0, primary.calls)
+        self.assertEqual(1, slow.calls)
+        self.assertEqual(19, hosts.count('fast'))
+        self.assertEqual(1, router.write_record(Record()))
+        self.assertEqual(1, primary.writes)
+        self.assertEqual(0, fast.writes + slow.writes)
+        self.assertIn('fast', str(router))
+
+    def test_route_2(self):
+        primary = FakeReplica('primary')
+        first, second = FakeReplica('first'), FakeReplica('second')
+        router = RoutingConnection(primary, [first, second],
+                                   max_failures=1, eject_time=0.05)
+        first.down = True
+        hosts = {router.read_record(1).database for _ in range(5)}
+        self.assertEqual({'second'}, hosts)
+        self.assertFalse(router.replicas[0].healthy)
+        self.assertEqual(1, first.calls)
+        time.sleep(0.06)
+        first.down = False
+        router.read_record(1)
+        self._wait_healthy(router.replicas[0])
+        self.assertTrue(router.replicas[0].healthy)
+
+    def test_route_3(self):
+        primary = FakeReplica('primary')
+        replica = FakeReplica('replica')
+        router = RoutingConnection(primary, [replica], max_failures=1)
+        replica.down = True
+        self.assertEqual('primary', router.read_record(1).database)
+        self.assertEqual('primary', router.read_record(1).database)
+        self.assertEqual(1, replica.calls)
+
+    def test_route_4(self):
+        # Ошибки, не связанные с сетью, не занимают реплику навсегда
+        # и не исключают ее из обслуживания
+        primary = FakeReplica('primary')
+        replica = FakeReplica('replica')
+        router = RoutingConnection(primary, [replica], max_failures=1)
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                router.read_record(0)
+        loop = asyncio.new_event_loop()
+        try:
+            with self.assertRaises(asyncio.CancelledError):
+                loop.run_until_complete(router.read_record_async(0))
+            record = loop.run_until_complete(router.read_record_async(1))
+        finally:
+            loop.close()
+        self.assertEqual('replica', record.database)
+        self.assertEqual(0, router.replicas[0].in_flight)
+        self.assertEqual(0, router.replicas[0].failures)
+        self.assertTrue(router.replicas[0].healthy)
+        self.assertEqual(0, primary.calls)
+
+    def test_route_5(self):
+        # Ошибка сервера при проверке оставляет реплику исключенной
+        primary = FakeReplica('primary')
+        replica = FakeReplica('replica')
+        router = RoutingConnection(primary, [replica], max_failures=1,
+                                   eject_time=0.05)
+        replica.down = 'irbis'
+        self.assertEqual('primary', router.read_record(1).database)
+        router._probe(router.replicas[0])
+        self.assertFalse(router.replicas[0].healthy)
+        time.sleep(0.06)
+        self.assertEqual('primary', router.read_record(1).database)
+        replica.down = False
+        time.sleep(0.06)
+        router.read_record(1)
+        self._wait_healthy(router.replicas[0])
+        self.assertEqual('replica', router.read_record(1).database)
+
+    def test_route_6(self):
+        # Проверка реплики не задерживает запрос
+        primary = FakeReplica('primary')
+        replica = FakeReplica('replica')
+        router = RoutingConnection(primary, [replica], max_failures=1,
+                                   eject_time=0.05)
+        replica.down = True
+        router.read_record(1)
+        replica.down = False
+        replica.nop_delay = 0.3
+        time.sleep(0.06)
+        started = time.perf_counter()
+        self.assertEqual('primary', router.read_record(1).database)
+        self.assertLess(time.perf_counter() - started, 0.2)
+        self._wait_healthy(router.replicas[0])
+        self.assertTrue(router.replicas[0].healthy)
+
+    def test_route_7(self):
+        primary, replica = FakeReplica('primary'), FakeReplica('replica')
+        router = RoutingConnection(primary, [replica])
+        records = router.iter_search_read('K=X', page_size=10)
+        self.assertEqual(['replica'], [one.database for one in records])
+        self.assertEqual(0, primary.calls)
+        self.assertEqual(0, router.replicas[0].in_flight)
+        with self.assertRaises(TypeError):
+            RoutingConnection(primary, [replica], 0.5)
+
+    @staticmethod
+    def _wait_healthy(replica):
+        # Проверка реплики выполняется в фоновом потоке
+        for _ in range(100):
+            if replica.healthy:
+                break
+            time.sleep(0.01)
+
+    def test_database_1(self):
+        primary, replica = FakeReplica('primary'), FakeReplica('replica')
+        router = RoutingConnection(primary, [replica])
+        router.push_database('RDR')
+        self.assertEqual('RDR', replica.database)
+        self.assertEqual('RDR', router.database)
+        router.pop_database()
+        self.assertEqual('IBIS', replica.database)
+        router.database = 'RQST'
+        self.assertEqual('RQST', primary.database)
+        self.assertEqual('RQST', replica.database)
+
+
+class FakeFormatConnection(Connection):
+    """
+    Подключение, отвечающее на поиск с расформатированием.
+    """
+
+    __slots__ = ('found', 'requests', 'text')
+
+    def __init__(self, count, text='Title '):
+        super().__init__()
+        self.connected = True
+        self.found = list(range(1, count + 1))
+        self.requests = []
+        self.text = text
+
+    def execute(self, query):
+        lines = bytes(query._memory).decode('utf-8').split('\n')
+        number, first = int(lines[12]), int(lines[13])
+        self.requests.append((first, number))
+        page = self.found[first - 1:]
+        if number:
+            page = page[:number]
+        text = '0\r\n' + str(len(self.found)) + '\r\n' \
+            + ''.join(str(mfn) + '#' + self.text + str(mfn) + '\r\n'
+                      for mfn in page)
+        return TestServerResponse.get_response(text.encode('utf-8'))
+
+
+class TestIterSearch(unittest.TestCase):
+
+    def test_iter_search_format_1(self):
+        connection = FakeFormatConnection(25)
+        lines = list(connection.iter_search_format('K=X', '@brief',
+                                                   page_size=10))
+        self.assertEqual(['Title ' + str(mfn) for mfn in range(1, 26)],
+                         lines)
+        self.assertEqual([(1, 10), (11, 10), (21, 10)],
+                         connection.requests)
+
+    def test_iter_search_format_2(self):
+        connection = FakeFormatConnection(25)
+        iterator = connection.iter_search_format('K=X', '@brief',
+                                                 page_size=10)
+        first = [next(iterator) for _ in range(3)]
+        iterator.close()
+        self.assertEqual(['Title 1', 'Title 2', 'Title 3'], first)
+        self.assertEqual([(1, 10)], connection.requests)
+
+    def test_iter_search_format_3(self):
+        connection = FakeFormatConnection(25)
+        lines = list(connection.iter_search_format('K=X', '@brief',
+                                                   page_size=10, limit=12,
+                                                   prefetch=True))
+        self.assertEqual(12, len(lines))
+        self.assertEqual([(1, 10), (11, 2)], connection.requests)
+
+    def test_search_format_1(self):
+        connection = FakeFormatConnection(25)
+        self.assertEqual(['Title 1', 'Title 2'],
+                         connection.search_format('K=X', '@brief', 2))
+        self.assertEqual([(1, 2)], connection.requests)
+
+    def test_iter_search_read_1(self):
+        connection = FakeFormatConnection(5, '200#Title ')
+        records = list(connection.iter_search_read('K=X', page_size=2,
+                                                   tags=[200]))
+        self.assertEqual([1, 2, 3, 4, 5], [r.mfn for r in records])
+        self.assertTrue(records[0].partial)
+        self.assertEqual('Title 3', records[2].fm(200))
+        self.assertEqual([(1, 2), (3, 2), (5, 2)], connection.requests)
+
+
+class TestRecordTagIndex(unittest.TestCase):
+
+    @staticmethod
+    def _record():
+        record = Record()
+        for index in range(10):
+            record.add(910, SubField('b', str(index)))
+            record.add(700 + index % 2, 'Автор ' + str(index))
+        return record
+
+    def test_record_tag_index_1(self):
+        record = self._record()
+        self.assertEqual(10, len(record.all(910)))
+        self.assertEqual('Автор 0', record.fm(700))
+        record.add(200, SubField('a', 'Заглавие'))
+        self.assertEqual('Заглавие', record.fm(200, 'a'))
+        record.insert_at(0, 910, 'Первое')
+        self.assertEqual('Первое', record.first(910).value)
+        record.remove_at(0)
+        self.assertEqual('0', record.fm(910, 'b'))
+        del record[910]
+        self.assertEqual([], record.fma(910, 'b'))
+        self.assertEqual([700, 701, 200], record.keys())
+
+    def test_record_tag_index_2(self):
+        record = self._record()
+        self.assertEqual('9', record.fma(910, 'b')[-1])
+        record[910] = ['^bX']
+        self.assertEqual(['X'], record.fma(910, 'b'))
+        record.fields.append(Field(910, '^bY'))
+        self.assertEqual(['X', 'Y'], record.fma(910, 'b'))
+        record.fields.pop()
+        record.fields.sort(key=lambda field: field.tag)
+        self.assertEqual(['X'], record.fma(910, 'b'))
+        self.assertEqual(700, record.fields[0].tag)
+
+    def test_record_tag_index_3(self):
+        record = self._record()
+        self.assertTrue(record.have_field(910))
+        for field in record.all(910):
+            field.tag = 911
+        self.assertFalse(record.have_field(910))
+        self.assertEqual(10, len(record.all(911)))
+
+    def test_record_tag_index_4(self):
+        record = self._record()
+        for other in (copy.deepcopy(record),
+                      pickle.loads(pickle.dumps(record)),
+                      record.clone()):
+            self.assertEqual(record, other)
+            other.add(300, 'Примечание')
+            self.assertEqual('Примечание', other.fm(300))
+            self.assertIsNone(record.fm(300))
+
+    def test_record_tag_index_5(self):
+        # Смена метки не затрагивает другие записи
+        first, second = self._record(), self._record()
+        self.assertEqual(10, len(first.all(910)))
+        first.first(910).tag = 911
+        self.assertEqual(['0'], first.fma(911, 'b'))
+        self.assertEqual(9, len(first.all(910)))
+        self.assertEqual(10, len(second.all(910)))
+        self.assertIsNone(second.first(911))
+
+    def test_record_tag_index_6(self):
+        # Поле в двух записях
+        field = Field(300, 'Примечание')
+        first, second = self._record(), self._record()
+        first.fields.append(field)
+        second.fields.append(field)
+        self.assertEqual('Примечание', first.fm(300))
+        self.assertEqual('Примечание', second.fm(300))
+        field.tag = 301
+        self.assertIsNone(first.fm(300))
+        self.assertIsNone(second.fm(300))
+        self.assertEqual('Примечание', first.fm(301))
+        self.assertEqual('Примечание', second.fm(301))
+
+    def test_record_tag_index_7(self):
+        # Смена метки поля неразобранной записи
+        record = LazyRecord()
+        record.parse(['1#0', '0#1', '700#^aИванов', '200#^aЗаглавие',
+                      '910#^b1'])
+        record.first(700).tag = 701
+        self.assertFalse(record.have_field(700))
+        self.assertEqual('Иванов', record.fm(701, 'a'))
+        self.assertEqual([701, 200, 910], record.keys())
+        self.assertIsNone(record.first(700))
+
+    def test_record_tag_index_8(self):
+        # Смена метки после копирования записи
+        lazy = LazyRecord()
+        lazy.parse(['1#0', '0#1', '700#^aИванов', '200#^aЗаглавие'])
+        for record in self._record(), lazy:
+            self.assertIsNotNone(record.first(700))
+            for other in (copy.deepcopy(record),
+                          pickle.loads(pickle.dumps(record)),
+                          record.clone()):
+                field = other.first(700)
+                field.tag = 600
+                self.assertIs(field, other.first(600))
+                self.assertNotIn(field, other.all(700))
+                self.assertIsNone(record.first(600))
+
+
+class TestHashing(unittest.TestCase):
+
+    @staticmethod
+    def _record():
+        record = Record()
+        record.add(200, '^aЗаглавие^eподзаголовок')
+        record.add(700, '^aИванов^bИ. И.')
+        return record
+
+    def test_hashing_1(self):
+        record = self._record()
+        before = hash(record)
+        self.assertEqual(before, hash(record))
+        subfield = record.fields[0].subfields[0]
+        subfield.value = 'Другое заглавие'
+        self.assertNotEqual(before, hash(record))
+        self.assertNotEqual(self._record(), record)
+        subfield.value = 'Заглавие'
+        self.assertEqual(before, hash(record))
+        self.assertEqual(self._record(), record)
+
+    def test_hashing_2(self):
+        record = self._record()
+        other = self._record()
+        self.assertEqual(hash(other), hash(record))
+        record.fm(700)
+        record.first(700).add('g', 'Иван')
+        self.assertNotEqual(hash(other), hash(record))
+        record.first(700).remove_subfield('g')
+        self.assertEqual(other, record)
+        record.set_subfield(200, 'e', None)
+        self.assertNotEqual(other, record)
+        record.fields.pop()
+        self.assertEqual(1, len(record.fields))
+        self.assertNotEqual(hash(other), hash(record))
+
+    def test_hashing_3(self):
+        subfield = SubField('a', 'A')
+        first = Field(100)
+        second = Field(100)
+        first.subfields.append(subfield)
+        second.subfields.append(subfield)
+        self.assertEqual(hash(first), hash(second))
+        subfield.code = 'b'
+        self.assertEqual(hash(Field(100, '^bA')), hash(first))
+        self.assertEqual(hash(Field(100, '^bA')), hash(second))
+        first.tag = 200
+        self.assertNotEqual(first, second)
+
+    def test_hashing_4(self):
+        first = Field(100, '^aA^bB')
+        second = Field(100, '^aA^bB')
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, Field(200, '^aA^bB'))
+        self.assertNotEqual(first, Field(100, '^aA'))
+        self.assertNotEqual(first, SubField('a', 'A'))
+        self.assertEqual(1, len({first, second, pickle.loads(
+            pickle.dumps(first))}))
+
+    def test_hashing_5(self):
+        # Хэш не хранится: любое изменение сразу меняет его
+        record = self._record()
+        other = self._record()
+        field = record.fields[1]
+        for change, undo in ((lambda: setattr(field, 'tag', 701),
+                              lambda: setattr(field, 'tag', 700)),
+                             (lambda: setattr(field, 'value', 'X'),
+                              lambda: setattr(field, 'value', None)),
+                             (lambda: setattr(field.subfields[1], 'code', 'c'),
+                              lambda: setattr(field.subfields[1], 'code', 'b')),
+                             (lambda: field.subfields.insert(0, SubField('g')),
+                              lambda: field.subfields.pop(0))):
+            change()
+            self.assertNotEqual(hash(other), hash(record))
+            self.assertNotEqual(other, record)
+            undo()
+            self.assertEqual(hash(other), hash(record))
+            self.assertEqual(other, record)
+
+
+class TestCompactRecord(unittest.TestCase):
+
+    lines = ['12#0', '0#3', '700#^AИванов^bИ. И.', '200#^aЗаглавие^e^fАвтор',
+             '910#^aC^b1', '910#^b2', '910#^a0^b3', '920#PAZK', '2000#^x1']
+
+    def test_compact_record_1(self):
+        record = Record()
+        record.parse(self.lines)
+        compact = CompactRecord()
+        compact.parse(self.lines)
+        self.assertEqual(12, compact.mfn)
+        self.assertEqual(3, compact.version)
+        self.assertEqual(7, len(compact))
+        self.assertEqual(record.encode(), compact.encode())
+        self.assertEqual(record.keys(), compact.keys())
+        self.assertEqual('Иванов', compact.fm(700, 'a'))
+        self.assertEqual('Иванов', compact.fm(700, 'A'))
+        self.assertEqual('PAZK', compact.fm(920))
+        self.assertIsNone(compact.fm(700, ''))
+        self.assertEqual('x', compact.fm(300, 'a', 'x'))
+        self.assertIsNone(compact.fm(200, 'e'))
+        self.assertEqual(['C', '0'], compact.fma(910, 'a'))
+        self.assertEqual(['C', '2', '0'], compact.fma(910))
+        self.assertEqual('1', compact.fm(2000, 'x'))
+        self.assertFalse(compact.have_field(20))
+        self.assertTrue(compact.have_field(2000))
+        for tag in (700, 200, 910, 300):
+            for code in ('', '*', 'a', 'b', 'e', 'f'):
+                self.assertEqual(record.fm(tag, code), compact.fm(tag, code))
+                self.assertEqual(record.fma(tag, code),
+                                 compact.fma(tag, code))
+
+    def test_compact_record_2(self):
+        record = Record()
+        record.parse(self.lines)
+        compact = CompactRecord.from_record(record)
+        self.assertEqual(str(record), str(compact))
+        self.assertEqual(record, compact.to_record())
+        self.assertEqual(record.all(910), compact.all(910))
+        self.assertEqual(record.first(200), compact[200][0])
+        self.assertEqual(record.fields, list(compact))
+        self.assertIsNone(compact.first(300))
+        # Изменение выданного поля не меняет запись
+        compact.first(920).value = 'Other'
+        self.assertEqual('PAZK', compact.fm(920))
+
+    def test_compact_record_3(self):
+        compact = CompactRecord()
+        self.assertFalse(compact)
+        self.assertEqual(0, len(compact))
+        self.assertEqual([], compact.keys())
+        compact.parse(self.lines)
+        clone = pickle.loads(pickle.dumps(compact))
+        self.assertEqual(compact.encode(), clone.encode())
+
+    def test_compact_record_4(self):
+        # fm и fma совпадают с Record для любого кода, в т. ч. None
+        lines = ['1#0', '0#1', '300#Примечание^aA^bB', '300#^aC',
+                 '300#Второе', '610#^*Рубрика^aD']
+        record = Record()
+        record.parse(lines)
+        compact = CompactRecord()
+        compact.parse(lines)
+        for tag in (300, 610, 700):
+            for code in (None, '', '*', 'a', 'B', 'x'):
+                self.assertEqual(record.fm(tag, code),
+                                 compact.fm(tag, code), (tag, code))
+                self.assertEqual(record.fm(tag, code, 'default'),
+                                 compact.fm(tag, code, 'default'))
+                self.assertEqual(record.fma(tag, code),
+                                 compact.fma(tag, code), (tag, code))
+        self.assertEqual('Примечание', compact.fm(300, None))
+        self.assertEqual(['Примечание', 'Второе'], compact.fma(300, None))
+
+
+class FakeWriteConnection(Connection):
+    """
+    Подключение, принимающее пакетное сохранение записей.
+    """
+
+    __slots__ = ('requests', 'code')
+
+    def __init__(self, code=0):
+        super().__init__()
+        self.connected = True
+        self.database = 'IBIS'
+        self.requests = []
+        self.code = code
+
+    def execute(self, query):
+        self.requests.append(bytes(query._memory).decode('utf-8'))
+        return TestServerResponse.get_response(
+            (str(self.code) + '\r\n').encode('utf-8'))
+
+
+class TestDirtyTracking(unittest.TestCase):
+
+    lines = ['1#0', '0#1', '700#^aИванов^bИ. И.', '200#^aЗаглавие',
+             '910#^aC^b1']
+
+    def get_record(self, mfn=1):
+        record = Record()
+        record.parse([str(mfn) + '#0'] + self.lines[1:])
+        return record
+
+    def test_dirty_1(self):
+        self.assertTrue(Record().dirty)
+        record = self.get_record()
+        self.assertFalse(record.dirty)
+        record.fm(700, 'a')
+        self.assertFalse(record.dirty)
+        record.first(700).subfields[0].value = 'Петров'
+        self.assertTrue(record.dirty)
+        self.assertTrue(record.first(700).dirty)
+        self.assertFalse(record.first(200).dirty)
+        record.mark_clean()
+        self.assertFalse(record.dirty)
+        record.add(300, 'Примечание')
+        self.assertTrue(record.dirty)
+        self.assertFalse(Field.trusted(200, '^*Заглавие^eПодзаголовок').dirty)
+
+    def test_dirty_2(self):
+        actions = [
+            lambda r: r.first(200).add('e', 'Подзаголовок'),
+            lambda r: r.first(200).subfields.pop(),
+            lambda r: setattr(r.first(200), 'tag', 201),
+            lambda r: setattr(r.first(200), 'value', 'Текст'),
+            lambda r: r.first(910).set_subfield('b', '2'),
+            lambda r: r.remove_field(910),
+            lambda r: r.set_field(920, 'PAZK'),
+            lambda r: r.__setitem__(910, '^aX'),
+        ]
+        for action in actions:
+            record = self.get_record()
+            action(record)
+            self.assertTrue(record.dirty)
+
+    def test_dirty_3(self):
+        record = LazyRecord()
+        record.parse(self.lines)
+        self.assertFalse(record.dirty)
+        record.first(910).set_subfield('b', '2')
+        self.assertFalse(record.materialized)
+        self.assertTrue(record.dirty)
+        record.mark_clean()
+        self.assertFalse(record.dirty)
+        self.assertEqual(3, len(record.fields))
+        self.assertFalse(record.dirty)
+
+    def test_dirty_4(self):
+        # MFN, статус и версия отслеживаются, база данных -- нет
+        for name, value in (('status', 1), ('mfn', 2), ('version', 5)):
+            for record in (self.get_record(), LazyRecord()):
+                if isinstance(record, LazyRecord):
+                    record.parse(self.lines)
+                setattr(record, name, value)
+                self.assertTrue(record.dirty, name)
+                record.mark_clean()
+                self.assertFalse(record.dirty, name)
+        record = self.get_record()
+        record.database = 'OTHER'
+        self.assertFalse(record.dirty)
+        record.status = 1
+        self.assertTrue(codec.loads(codec.dumps(record)).dirty)
+        record.status = 0
+        self.assertFalse(record.dirty)
+
+    def test_dirty_5(self):
+        # Замена списка подполей -- тоже изменение
+        record = self.get_record()
+        field = record.first(200)
+        field.subfields = [SubField('a', 'Заглавие')]
+        self.assertTrue(field.dirty)
+        self.assertTrue(record.dirty)
+        record.mark_clean()
+        self.assertFalse(record.dirty)
+        field.subfields.append(SubField('e', 'Подзаголовок'))
+        self.assertTrue(record.dirty)
+        field.subfields.pop()
+        record.mark_clean()
+        field.value = 'Текст'
+        self.assertTrue(record.dirty)
+        field.value = None
+        self.assertFalse(record.dirty)
+
+    def test_write_records_only_dirty_1(self):
+        connection = FakeWriteConnection()
+        records = [self.get_record(mfn) for mfn in range(1, 6)]
+        records[1].first(200).add('e', 'Подзаголовок')
+        records[3].add(300, 'Примечание')
+        self.assertTrue(connection.write_records(records, only_dirty=True))
+        self.assertEqual(1, len(connection.requests))
+        request = connection.requests[0]
+        self.assertIn('2#0', request)
+        self.assertIn('4#0', request)
+        self.assertNotIn('3#0', request)
+        self.assertFalse(any(record.dirty for record in records))
+        self.assertTrue(connection.write_records(records, only_dirty=True))
+        self.assertEqual(1, len(connection.requests))
+
+    def test_write_records_only_dirty_2(self):
+        connection = FakeWriteConnection(-608)
+        records = [self.get_record(mfn) for mfn in range(1, 4)]
+        for record in records:
+            record.add(300, 'Примечание')
+        self.assertFalse(connection.write_records(records, only_dirty=True))
+        self.assertTrue(all(record.dirty for record in records))
+
+    def test_write_records_only_dirty_3(self):
+        connection = FakeWriteConnection()
+        records = [self.get_record(mfn) for mfn in range(1, 4)]
+        records[1].status = LOGICALLY_DELETED
+        self.assertTrue(connection.write_records(records, only_dirty=True))
+        self.assertEqual(1, len(connection.requests))
+        self.assertIn('2#1', connection.requests[0])
+        self.assertNotIn('3#0', connection.requests[0])
+
+
+class TestBinaryCodec(unittest.TestCase):
+
+    lines = ['12#0', '0#3', '700#^aИванов^bИ. И.', '200#^aЗаглавие',
+             '910#^aC^b1', '910#^a0^b3', '300#Примечание']
+
+    def get_record(self):
+        record = Record()
+        record.parse(self.lines)
+        record.database = 'IBIS'
+        return record
+
+    def check_same(self, expected, actual):
+        self.assertEqual(type(expected), type(actual))
+        self.assertEqual(expected.database, actual.database)
+        self.assertEqual(expected.mfn, actual.mfn)
+        self.assertEqual(expected.status, actual.status)
+        self.assertEqual(expected.version, actual.version)
+        self.assertEqual(expected.partial, actual.partial)
+        self.assertEqual(expected.encode(), actual.encode())
+
+    def test_record_1(self):
+        record = self.get_record()
+        restored = codec.loads(codec.dumps(record))
+        self.check_same(record, restored)
+        self.assertEqual(record, restored)
+        self.assertFalse(restored.dirty)
+        self.assertEqual('И. И.', restored.fm(700, 'b'))
+        restored.first(910).set_subfield('b', '2')
+        self.assertTrue(restored.dirty)
+        self.assertEqual('2', restored.fm(910, 'b'))
+
+    def test_record_2(self):
+        record = Record()
+        record.mfn = 70000
+        record.status = LOGICALLY_DELETED
+        record.partial = True
+        field = Field(70000, 'Value')
+        field.subfields.append(SubField('a'))
+        field.add('b', 'x^y')
+        record.fields.append(field)
+        record.fields.append(Field(100))
+        restored = codec.loads(codec.dumps(record))
+        self.check_same(record, restored)
+        self.assertTrue(restored.dirty)
+        self.assertIsNone(restored.database)
+        self.assertIsNone(restored.fields[1].value)
+        self.assertEqual('x^y', restored.fields[0].subfields[1].value)
+        self.assertIsNone(restored.fields[0].subfields[0].value)
+        self.check_same(Record(), codec.loads(codec.dumps(Record())))
+
+    def test_record_3(self):
+        record = self.get_record()
+        record.add(330, 'x' * 70000)
+        restored = codec.loads(codec.dumps(record))
+        self.check_same(record, restored)
+        lazy = LazyRecord()
+        lazy.parse(self.lines)
+        restored = codec.loads(codec.dumps(lazy))
+        self.assertIs(type(restored), Record)
+        self.assertEqual(lazy.encode(), restored.encode())
+
+    def test_raw_record_1(self):
+        record = RawRecord()
+        record.parse(self.lines)
+        record.database = 'IBIS'
+        self.check_same(record, codec.loads(codec.dumps(record)))
+
+    def test_stream_1(self):
+        records = [self.get_record(), RawRecord(), Record()]
+        stream = io.BytesIO()
+        for record in records:
+            write_binary_record(stream, record)
+        stream.seek(0)
+        self.check_same(records[0], read_binary_record(stream))
+        restored = list(iter_binary_records(stream))
+        self.assertEqual(2, len(restored))
+        self.check_same(records[1], restored[0])
+        self.check_same(records[2], restored[1])
+        self.assertIsNone(read_binary_record(stream))
+
+    def test_errors_1(self):
+        data = codec.dumps(self.get_record())
+        with self.assertRaises(ValueError):
+            codec.loads(b'\x02' + data[1:])
+        with self.assertRaises(ValueError):
+            codec.loads(data[:5])
+        with self.assertRaises(TypeError):
+            codec.dumps('12#0')
+        stream = io.BytesIO()
+        write_binary_record(stream, self.get_record())
+        stream = io.BytesIO(stream.getvalue()[:-3])
+        with self.assertRaises(ValueError):
+            read_binary_record(stream)
+
+    def test_errors_2(self):
+        raw = RawRecord()
+        raw.parse(self.lines)
+        for record in self.get_record(), raw:
+            data = codec.dumps(record)
+            for size in range(len(data)):
+                with self.assertRaisesRegex(ValueError,
+                                            '^(Truncated|Corrupt) record$'):
+                    codec.loads(data[:size])
+            with self.assertRaisesRegex(ValueError, '^Corrupt record$'):
+                codec.loads(data + b'x')
+
+    def test_errors_3(self):
+        data = bytearray(codec.dumps(self.get_record()))
+        count = codec._HEADER.size - 4
+        data[count] += 1  # В таблице на одно число больше
+        with self.assertRaisesRegex(ValueError,
+                                    '^(Truncated|Corrupt) record$'):
+            codec.loads(bytes(data))
+        data[count] = 0  # Пустая таблица
+        with self.assertRaisesRegex(ValueError, '^Corrupt record$'):
+            codec.loads(bytes(data))
+
+
+class FakeDirectAccess:
+
+    def __init__(self, records):
+        self.records = records
+
+    def next_mfn(self):
+        return len(self.records) + 1
+
+    def read_record(self, mfn, lazy=False):
+        return self.records[mfn - 1]
+
+
+class TestRecordBatch(unittest.TestCase):
+
+    @staticmethod
+    def get_records():
+        result = []
+        data = [('Иванов', '2001', 'RU'), ('Петров', '2001', 'EN'),
+                ('Иванов', '2005', None), (None, '2005', 'RU')]
+        for mfn, (author, year, country) in enumerate(data, 1):
+            record = Record()
+            record.mfn = mfn
+            if author:
+                record.add(700, '^a' + author + '^bИ. И.')
+            record.add(210, '^aМосква^d' + year)
+            if country:
+                record.add(102, country)
+            result.append(record)
+        return result
+
+    def get_batch(self):
+        return RecordBatch.from_records(self.get_records(),
+                                        [(700, 'a'), '210^D', 102])
+
+    def test_from_records_1(self):
+        batch = self.get_batch()
+        self.assertEqual(4, len(batch))
+        self.assertEqual(['700^a', '210^d', '102'], batch.names)
+        self.assertEqual([102, 210, 700], batch.tags)
+        self.assertEqual([1, 2, 3, 4], list(batch.mfn))
+        self.assertEqual(['Иванов', 'Петров', 'Иванов', None],
+                         batch['700^a'])
+        self.assertEqual(['RU', 'EN', None, 'RU'], batch.column('102'))
+        self.assertEqual((3, 'Иванов', '2005', None), list(batch.rows())[2])
+        batch = RecordBatch.from_records(self.get_records(),
+                                         {'year': (210, 'd')})
+        self.assertEqual(['year'], batch.names)
+        self.assertEqual(['2001', '2001', '2005', '2005'], batch['year'])
+
+    def test_from_records_2(self):
+        lazy = LazyRecord()
+        lazy.parse(['5#0', '0#1', '700#^aСидоров', '210#^d2010'])
+        compact = CompactRecord.from_record(self.get_records()[1])
+        batch = RecordBatch.from_records([lazy, compact], ['700^a', '210^d'])
+        self.assertEqual(['Сидоров', 'Петров'], batch['700^a'])
+        self.assertEqual(['2010', '2001'], batch['210^d'])
+        self.assertFalse(lazy.materialized)
+
+    def test_from_sources_1(self):
+        records = self.get_records()
+        records[1].status = LOGICALLY_DELETED
+        batch = RecordBatch.from_direct(FakeDirectAccess(records), ['700^a'])
+        self.assertEqual([1, 3, 4], list(batch.mfn))
+        batch = RecordBatch.from_direct(FakeDirectAccess(records), ['700^a'],
+                                        mfns=[3])
+        self.assertEqual(['Иванов'], batch['700^a'])
+        with open(relative_path('data/records.txt'), 'rt',
+                  encoding='utf-8') as stream:
+            batch = RecordBatch.from_text(stream, ['200^a', 920])
+        self.assertEqual(3, len(batch))
+        self.assertEqual('Странные люди', batch['200^a'][0])
+        self.assertEqual('SPEC', batch['920'][0])
+        with open(relative_path('data/test1.iso'), 'rb') as stream:
+            batch = RecordBatch.from_iso(stream, ['200^a'], 'cp1251')
+        self.assertEqual('Вып. 13.', batch['200^a'][0])
+
+    def test_filter_1(self):
+        batch = self.get_batch()
+        self.assertEqual([True, False, True, False],
+                         batch.equal('700^a', 'Иванов'))
+        self.assertEqual([True, True, False, True], batch.present('102'))
+        self.assertEqual([True, False, False, True],
+                         batch.isin('102', ['RU', 'DE']))
+        found = batch.where('210^d', lambda year: int(year) > 2003)
+        self.assertEqual([3, 4], list(found.mfn))
+        self.assertEqual(['Иванов', None], found['700^a'])
+        mask = [left and right
+                for left, right in zip(batch.equal('700^a', 'Иванов'),
+                                       batch.equal('102', 'RU'))]
+        self.assertEqual([1], list(batch.filter(mask).mfn))
+        with self.assertRaises(ValueError):
+            batch.filter([True])
+
+    def test_count_by_1(self):
+        batch = self.get_batch()
+        self.assertEqual({'Иванов': 2, 'Петров': 1, None: 1},
+                         dict(batch.count_by('700^a')))
+        counts = batch.count_by('210^d', '102')
+        self.assertEqual(1, counts['2001', 'RU'])
+        self.assertEqual(2, len(batch.count_by('210^d')))
+
+    def test_join_1(self):
+        batch = self.get_batch()
+        countries = RecordBatch([10, 11, 12],
+                                {'102': ['RU', 'RU', 'EN'],
+                                 'name': ['Россия', 'РФ', 'Англия']})
+        joined = batch.join(countries, '102')
+        self.assertEqual([1, 1, 2, 4, 4], list(joined.mfn))
+        self.assertEqual(['Россия', 'РФ', 'Англия', 'Россия', 'РФ'],
+                         joined['name'])
+        self.assertEqual(['RU', 'RU', 'EN', 'RU', 'RU'], joined['102_right'])
+        joined = batch.join(countries, '102', other_on='name')
+        self.assertEqual(0, len(joined))
+        with self.assertRaises(ValueError):
+            RecordBatch([1], {'102': []})
+
+    @unittest.skipIf(importlib.util.find_spec('numpy') is None,
+                     'NumPy is not installed')
+    def test_to_numpy_1(self):
+        batch = self.get_batch()
+        arrays = batch.to_numpy()
+        self.assertEqual([1, 2, 3, 4], arrays['mfn'].tolist())
+        self.assertEqual(2, int((batch.to_numpy('700^a') == 'Иванов').sum()))
+
+
+class TestAttributeSetters(unittest.TestCase):
+
+    def test_attr_redirect_1(self):
+        class Old(AttrRedirect):
+            __aliases__ = {'old_name': 'name'}
+
+            def __init__(self):
+                self.name = 'A'
+
+        class Older(Old):
+            __aliases__ = {'oldest_name': 'old_name'}
+
+        one = Old()
+        self.assertEqual('A', one.old_name)
+        one.old_name = 'B'
+        self.assertEqual('B', one.name)
+        two = Older()
+        two.oldest_name = 'C'
+        self.assertEqual('C', two.name)
+        self.assertEqual('C', two.old_name)
+
+    def test_plain_slots_1(self):
+        class Upper(SubField):
+            __slots__ = ()
+
+            @property
+            def text(self):
+                return self.value
+
+            @text.setter
+            def text(self, value):
+                self.value = value.upper()
+
+        subfield = Upper('a', 'x')
+        subfield.mark_clean()
+        subfield.text = 'abc'
+        self.assertEqual('ABC', subfield.value)
+        self.assertTrue(subfield.dirty)
+        subfield.value = 'x'  # Прежнее значение
+        self.assertFalse(subfield.dirty)
+        # Запись простых слотов без перехвата __setattr__
+        self.assertIs(SubField.__setattr__, object.__setattr__)
+        self.assertIs(Field.__setattr__, object.__setattr__)
+        for name in ('tag', 'value', 'subfields'):
+            self.assertNotIsInstance(Field.__dict__[name], property)
+
+    def test_plain_slots_2(self):
+        record = Record()
+        record.add(200, '^aЗаглавие')
+        record.mark_clean()
+        field = record.fields[0]
+        before = hash(record)
+        self.assertEqual('Заглавие', record.fm(200, 'a'))
+        field.tag = 201
+        self.assertTrue(record.dirty)
+        self.assertNotEqual(before, hash(record))
+        self.assertIsNone(record.fm(200, 'a'))
+        self.assertEqual('Заглавие', record.fm(201, 'a'))
+        field.tag = 200
+        self.assertFalse(record.dirty)
+        self.assertEqual('200#^aЗаглавие'.encode('utf-8'),
+                         field.encode_utf8())
+        field.tag = 202
+        self.assertTrue(field.encode_utf8().startswith(b'202#'))
+
+
+class TestEncodeInto(unittest.TestCase):
+
+    lines = ['12#0', '0#3', '700#^aИванов^bИ. И.', '200#^aЗаглавие',
+             '910#^aC^b1', '300#Примечание']
+
+    @staticmethod
+    def expected(record):
+        return '\x1F\x1E'.join(record.encode()).encode('utf-8')
+
+    @staticmethod
+    def encoded(record):
+        buffer = bytearray()
+        record.encode_into(buffer)
+        return bytes(buffer)
+
+    def test_encode_into_1(self):
+        record = Record()
+        record.parse(self.lines)
+        self.assertEqual(self.expected(record), self.encoded(record))
+        lazy = LazyRecord()
+        lazy.parse(self.lines)
+        self.assertEqual(self.expected(record), self.encoded(lazy))
+        self.assertFalse(lazy.materialized)
+        lazy.first(910).set_subfield('b', '2')
+        self.assertIn('^b2'.encode('utf-8'), self.encoded(lazy))
+        raw = RawRecord()
+        raw.parse(self.lines)
+        self.assertEqual(self.expected(raw), self.encoded(raw))
+        self.assertEqual(b'0#0\x1F\x1E0#0', self.encoded(Record()))
+
+    def test_encode_into_2(self):
+        record = Record()
+        record.parse(self.lines)
+        field = record.first(700)
+        first = field.encode_utf8()
+        self.assertIs(first, field.encode_utf8())
+        actions = [
+            lambda: setattr(field.subfields[0], 'value', 'Петров'),
+            lambda: setattr(field.subfields[1], 'code', 'g'),
+            lambda: field.add('c', 'проф.'),
+            lambda: field.subfields.pop(),
+            lambda: setattr(field, 'value', 'Текст'),
+            lambda: setattr(field, 'tag', 701),
+            lambda: setattr(field, 'subfields', [SubField('x', 'Y')]),
+        ]
+        for action in actions:
+            before = field.encode_utf8()
+            action()
+            after = field.encode_utf8()
+            self.assertNotEqual(before, after)
+            self.assertEqual(str(field).encode('utf-8'), after)
+        self.assertEqual(self.expected(record), self.encoded(record))
+
+    def test_encode_into_3(self):
+        shared = SubField('a', 'Общее')
+        first, second = Field(610), Field(611)
+        first.subfields.append(shared)
+        second.subfields.append(shared)
+        first.encode_utf8()
+        second.encode_utf8()
+        shared.value = 'Другое'
+        self.assertEqual('610#^aДругое'.encode('utf-8'), first.encode_utf8())
+        self.assertEqual('611#^aДругое'.encode('utf-8'), second.encode_utf8())
+
+    def test_encode_into_4(self):
+        # Коды подполей, присвоенные в обход проверки
+        field = Field(200)
+        field.add('a', 'X').add('b', 'Y')
+        field.subfields[0].code = 'ab'
+        field.subfields[1].code = ''
+        self.assertEqual('200#^abX^Y'.encode('utf-8'), field.encode_utf8())
+        field.subfields[0].code = 'a'
+        field.subfields[1].code = 'b'
+        self.assertEqual('200#^aX^bY'.encode('utf-8'), field.encode_utf8())
+        field.subfields[0].code = 'ab'
+        field.subfields[1].code = ''
+        self.assertEqual('200#^abX^Y'.encode('utf-8'), field.encode_utf8())
+
+    def test_query_record_1(self):
+        connection = FakeWriteConnection()
+        records = []
+        for mfn in (1, 2):
+            record = Record()
+            record.parse([str(mfn) + '#0'] + self.lines[1:])
+            records.append(record)
+        records[1].database = 'RDR'
+        self.assertTrue(connection.write_records(records))
+        request = connection.requests[0]
+        for record, database in zip(records, ['IBIS', 'RDR']):
+            line = database + '\x1F\x1E' + '\x1F\x1E'.join(record.encode())
+            self.assertIn('\n' + line + '\n', request)
+
+
+class FakeChunkConnection(FakeWriteConnection):
+    """
+    Подключение, отвечающее на сохранение порции записей
+    строкой на каждую запись. Новые записи получают MFN по порядку,
+    запись с полем 999 не сохраняется, запрос с записью,
+    содержащей поле 998, завершается исключением.
+    """
+
+    __slots__ = ('next_mfn', 'lock', 'server', 'workers')
+
+    def __init__(self, server=None):
+        super().__init__()
+        self.next_mfn = 100
+        self.lock = threading.Lock()
+        self.server = server  # Подключение, хранящее состояние сервера
+        self.workers = []
+
+    def execute(self, query):
+        text = bytes(query._memory).decode('utf-8')
+        server = self.server or self
+        with server.lock:
+            return server._answer(text)
+
+    def _worker_connections(self, count):
+        for number in range(count):
+            worker = FakeChunkConnection(self)
+            worker.client_id = number + 1
+            self.workers.append(worker)
+        return self.workers
+
+    def disconnect(self):
+        self.connected = False
+
+    def _answer(self, text):
+        self.requests.append(text)
+        if '\x1F\x1E998#' in text:
+            raise ConnectionError('broken')
+        answer = ['0']
+        for line in text.split('\n')[12:-1]:
+            parts = line.split('\x1F\x1E')[1:]
+            if any(part.startswith('999#') for part in parts[2:]):
+                answer.append('-608#0')
+                continue
+            mfn = int(parts[0].split('#')[0])
+            if not mfn:
+                mfn = self.next_mfn
+                self.next_mfn += 1
+            version = int(parts[1].split('#')[1]) + 1
+            answer.append('\x1E'.join([str(mfn) + '#0', '0#' + str(version)]
+                                       + parts[2:] + ['907#^aСохранено']))
+        return TestServerResponse.get_response(
+            ('\r\n'.join(answer) + '\r\n').encode('utf-8'))
+
+
+class TestWriteRecords(unittest.TestCase):
+
+    @staticmethod
+    def get_records(count):
+        result = []
+        for index in range(count):
+            record = Record()
+            record.add(200, '^aЗаглавие ' + str(index))
+            result.append(record)
+        return result
+
+    def test_write_records_1(self):
+        connection = FakeChunkConnection()
+        records = self.get_records(5)
+        result = connection.write_records(records, chunk_size=2)
+        self.assertTrue(result)
+        self.assertEqual(3, len(connection.requests))
+        self.assertEqual(3, len(result.chunk_times))
+        self.assertEqual(5, result.written)
+        self.assertEqual([100, 101, 102, 103, 104],
+                         [one.mfn for one in result.records])
+        self.assertEqual([100, 101, 102, 103, 104],
+                         [record.mfn for record in records])
+        self.assertEqual(1, records[0].version)
+        self.assertEqual('Сохранено', records[0].fm(907, 'a'))
+        self.assertEqual('IBIS', records[0].database)
+        self.assertFalse(any(record.dirty for record in records))
+        self.assertGreater(result.bytes_sent, 0)
+        self.assertIn('5 of 5 records written in 3 chunks', str(result))
+
+    def test_write_records_2(self):
+        connection = FakeChunkConnection()
+        records = self.get_records(10)
+        result = connection.write_records(records, chunk_bytes=1,
+                                          dont_parse=True)
+        self.assertEqual(10, len(connection.requests))
+        self.assertEqual(list(range(100, 110)),
+                         [record.mfn for record in records])
+        self.assertIsNone(records[0].fm(907, 'a'))
+        self.assertEqual(1, records[0].version)
+        self.assertFalse(records[0].dirty)
+        self.assertEqual(10, result.written)
+
+    def test_write_records_3(self):
+        connection = FakeChunkConnection()
+        records = self.get_records(6)
+        records[2].add(998, 'Сбой')
+        records[4].add(999, 'Ошибка')
+        result = connection.write_records(records, chunk_size=2, workers=3)
+        self.assertFalse(result)
+        self.assertEqual(3, len(connection.requests))
+        # Каждая порция отправлена через свое подключение
+        self.assertEqual(['0', '1', '2'], sorted(
+            request.split('\n')[3] for request in connection.requests))
+        self.assertTrue(connection.connected)
+        self.assertFalse(any(one.connected for one in connection.workers))
+        self.assertEqual(3, len(result.failures))
+        self.assertEqual([True, True, False, False, False, True],
+                         [one.ok for one in result.records])
+        self.assertIsInstance(result.records[2].error, ConnectionError)
+        self.assertEqual(-608, result.records[4].error_code)
+        self.assertTrue(records[2].dirty)
+        self.assertTrue(records[4].dirty)
+        self.assertFalse(records[5].dirty)
+        self.assertEqual(3, result.written)
+
+    def test_write_records_4(self):
+        connection = FakeChunkConnection()
+        records = self.get_records(3)
+        records[1].partial = True
+        with self.assertRaises(ValueError):
+            connection.write_records(records)
+        self.assertEqual([], connection.requests)
+        connection.connected = False
+        result = connection.write_records(self.get_records(2))
+        self.assertFalse(result)
+        self.assertEqual([NOT_CONNECTED, NOT_CONNECTED],
+                         [one.error_code for one in result.failures])
+        self.assertFalse(connection.write_records([]))
+        records = self.get_records(2)
+        for record in records:
+            record.mark_clean()
+        result = connection.write_records(records, only_dirty=True)
+        self.assertFalse(result)
+        self.assertEqual(NOT_CONNECTED, result.error_code)
+        self.assertEqual([], result.records)
+        connection.connected = True
+        self.assertTrue(connection.write_records([]))
+        self.assertTrue(connection.write_records(records, only_dirty=True))
+
+    def test_write_records_5(self):
+        connection = FakeWriteConnection(-608)
+        connection.last_error = -1
+        result = connection.write_records(self.get_records(3), workers=2,
+                                          chunk_size=1)
+        self.assertFalse(result)
+        with self.assertRaises(TypeError):
+            connection.write_records(self.get_records(1), False, 1)
+        self.assertEqual(-608, result.error_code)
+        self.assertEqual(-608, connection.last_error)
+        connection.code = 0
+        self.assertTrue(connection.write_records(self.get_records(1)))
+        self.assertEqual(0, connection.last_error)
+
+    def test_write_records_6(self):
+        # Через каждое подключение запросы идут по порядку номеров
+        connection = FakeChunkConnection()
+        records = self.get_records(12)
+        result = connection.write_records(records, chunk_size=2, workers=3)
+        self.assertTrue(result)
+        self.assertEqual(list(range(100, 112)),
+                         sorted(record.mfn for record in records))
+        sent = {}
+        for request in connection.requests:
+            lines = request.split('\n')
+            sent.setdefault(lines[3], []).append(int(lines[4]))
+        self.assertEqual({'0': [0, 1], '1': [0, 1], '2': [0, 1]}, sent)
+
+
+class TestLazyRecord(unittest.TestCase):
+
+    lines = ['12#0', '0#3', '700#^aИванов^bИ. И.', '200#^aЗаглавие',
+             '910#^aC^b1', '910#^aC^b2', '910#^a0^b3']
+
+    def test_lazy_record_1(self):
+        record = LazyRecord()
+        record.parse(self.lines)
+        self.assertEqual(12, record.mfn)
+        self.assertEqual(3, record.version)
+        self.assertEqual(5, len(record))
+        self.assertFalse(record.materialized)
+        self.assertEqual('Иванов', record.fm(700, 'a'))
+        self.assertEqual(['1', '2', '3'], record.fma(910, 'b'))
+        self.assertIsNone(record.fm(300))
+        self.assertEqual([700, 200, 910], record.keys())
+        self.assertTrue(record.have_field(200))
+        self.assertFalse(record.materialized)
+        self.assertEqual(self.lines, record.encode())
+
+    def test_lazy_record_2(self):
+        record = LazyRecord()
+        record.parse(self.lines)
+        first = record.first(910)
+        first.set_subfield('b', '100')
+        self.assertEqual(3, len(record.all(910)))
+        self.assertIs(first, record.fields[2])
+        self.assertTrue(record.materialized)
+        self.assertEqual('910#^aC^b100', record.encode()[4])
+        record.add(300, 'Примечание')
+        self.assertEqual(6, len(record))
+        self.assertEqual('Примечание', record.fm(300))
+
+    def test_lazy_record_3(self):
+        lazy = LazyRecord()
+        lazy.parse(self.lines)
+        eager = Record()
+        eager.parse(self.lines)
+        clone = lazy.clone()
+        self.assertFalse(clone.materialized)
+        self.assertEqual(str(eager), str(lazy))
+        self.assertEqual(eager.encode(), clone.encode())
+        self.assertEqual(hash(eager), hash(clone))
+
+    def test_lazy_record_4(self):
+        connection = FakeFormatConnection(3, '\x1F1#0\x1F0#1\x1F200#Title ')
+        records = connection.search_read('K=X', lazy=True)
+        self.assertEqual(3, len(records))
+        self.assertIsInstance(records[0], LazyRecord)
+        self.assertEqual('Title 2', records[1].fm(200))
+        connection = FakeFormatConnection(3, '200#Title ')
+        records = connection.search_read('K=X', tags=[200], lazy=True)
+        self.assertTrue(records[0].partial)
+        self.assertEqual('Title 1', records[0].fm(200))
+
+    def test_lazy_record_5(self):
+        mst = MstRecord()
+        mst.leader.mfn = 7
+        for tag, value in ((200, '^AЗаглавие'), (910, '^AC')):
+            field = MstField()
+            field.tag = tag
+            field.value = value
+            mst.fields.append(field)
+        record = mst.decode_record(lazy=True)
+        self.assertIsInstance(record, LazyRecord)
+        self.assertEqual(7, record.mfn)
+        self.assertEqual('Заглавие', record.fm(200, 'a'))
+        self.assertEqual(str(mst.decode_record()), str(record))
+
+
+class TestTrustedParse(unittest.TestCase):
+
+    def test_trusted_parse_1(self):
+        for text in ('', 'Value', '^aTitle^BПодполе^c', 'Value^a1^^b2',
+                     '^aX^*Value', '^a^b^c3'):
+            expected = Field(200)
+            expected.headless_parse(text)
+            field = Field.trusted(200, text)
+            self.assertEqual(expected, field)
+            self.assertEqual(str(expected), str(field))
+        field = Field.trusted(200, '^aTitle')
+        field.add('b', 'Subtitle')
+        self.assertEqual('200#^aTitle^bSubtitle', str(field))
+
+    def test_trusted_parse_2(self):
+        lines = ['1#0', '0#1', '200#^AЗаглавие^eПодзаголовок', '300#Note']
+        record = Record()
+        record.parse(lines)
+        self.assertEqual(['200#^aЗаглавие^eПодзаголовок', '300#Note'],
+                         [str(field) for field in record.fields])
+        self.assertEqual('Заглавие', record.fm(200, 'a'))
+        record.parse(lines[:2])
+        self.assertEqual(0, len(record))
+
+    def test_read_text_record_1(self):
+        records = []
+        with open(relative_path('data/records.txt'), 'rt',
+                  encoding='utf-8') as stream:
+            while True:
+                record = read_text_record(stream)
+                if record is None:
+                    break
+                records.append(record)
+        self.assertEqual(3, len(records))
+        self.assertEqual('Странные люди', records[0].fm(200, 'a'))
+        self.assertEqual('SPEC', records[0].fm(920))
+
+    def test_read_iso_record_1(self):
+        with open(relative_path('data/test1.iso'), 'rb') as stream:
+            record = read_iso_record(stream, 'cp1251')
+        self.assertEqual('Вып. 13.', record.fm(200, 'a'))
+        self.assertEqual(['RU', 'RU'], record.fma(21, 'a'))
+        self.assertEqual('RU\\NLR\\bibl\\3415', record.fm(1))
+
+    @staticmethod
+    def iso_fields(record):
+        return [(field.tag, field.value,
+                 [(one.code, one.value) for one in field.subfields])
+                for field in record.fields]
+
+    def test_read_iso_record_2(self):
+        # Запись, сохраненная в ISO и прочитанная снова, не меняется
+        with open(relative_path('data/test1.iso'), 'rb') as stream:
+            records = []
+            while True:
+                record = read_iso_record(stream, 'cp1251')
+                if record is None:
+                    break
+                records.append(record)
+        self.assertEqual(81, len(records))
+        buffer = io.BytesIO()
+        for record in records:
+            write_iso_record(buffer, record, 'cp1251')
+        buffer.seek(0)
+        for record in records:
+            copy_ = read_iso_record(buffer, 'cp1251')
+            self.assertEqual(self.iso_fields(record), self.iso_fields(copy_))
+        self.assertIsNone(read_iso_record(buffer, 'cp1251'))
+
+    def test_read_iso_record_3(self):
+        record = Record()
+        record.add(1, 'RU\\NLR')
+        record.fields.append(Field.loaded(5, '', []))
+        record.add(200, '^aЗаглавие^EПодзаголовок')
+        record.add(300, 'Текст^aПримечание')
+        record.add(301, 'Текст')
+        buffer = io.BytesIO()
+        write_iso_record(buffer, record, 'utf-8')
+        buffer.seek(0)
+        copy_ = read_iso_record(buffer, 'utf-8')
+        # Фиксированное поле читается как есть, в том числе пустое
+        self.assertEqual([(1, 'RU\\NLR', []), (5, '', []),
+                          (200, None, [('a', 'Заглавие'),
+                                       ('e', 'Подзаголовок')]),
+                          (300, 'Текст', [('a', 'Примечание')]),
+                          (301, 'Текст', [])],
+                         self.iso_fields(copy_))
+
+
+class TestLocalFormat(unittest.TestCase):
+
+    @staticmethod
+    def get_record():
+        record = Record()
+        record.add(200, '^aTitle^eSubtitle')
+        record.add(700, '^aIvanov^gI.')
+        record.add(701, '^aPetrov')
+        record.add(701, '^aSidorov')
+        record.add(910, '^a0^b1')
+        record.add(910, '^a0^b2')
+        return record
+
+    def format(self, text):
+        return LocalFormat(text).format_record(self.get_record())
+
+    def test_field_1(self):
+        self.assertEqual(self.format('v200^a'), 'Title')
+        self.assertEqual(self.format('v200'), '^aTitle^eSubtitle')
+        self.assertEqual(self.format('v700^*'), 'Ivanov')
+        self.assertEqual(self.format('v300^a'), '')
+
+    def test_literals_1(self):
+        self.assertEqual(self.format('v700^a,", "v701^a'),
+                         'Ivanov, PetrovSidorov')
+        self.assertEqual(self.format("'Title: ' v200^a, \" : \"v200^e"),
+                         'Title: Title : Subtitle')
+        self.assertEqual(self.format('v701^a+|; |'), 'Petrov; Sidorov')
+        self.assertEqual(self.format('"Notes: "d300, "No notes"n300'),
+                         'No notes')
+
+    def test_new_line_1(self):
+        self.assertEqual(self.format('v200^a/v700^a#v300^a/#v910^b'),
+                         'Title\r\nIvanov\r\n\r\n12')
+
+    def test_group_1(self):
+        self.assertEqual(self.format('(|; |+v701^a)'), 'Petrov; Sidorov')
+        self.assertEqual(self.format('("["v701^a"]")'), '[PetrovSidorov]')
+        self.assertEqual(self.format("(v910^b, ' ')"), '1 2 ')
+
+    def test_if_1(self):
+        self.assertEqual(self.format("if p(v300) then 'y' else 'n' fi"), 'n')
+        self.assertEqual(self.format(
+            "if v200^a:'TIT' and not a(v700) then 'ok' fi"), 'ok')
+        self.assertEqual(self.format(
+            "(if v910^b='2' then 'second' fi)"), 'second')
+
+    def test_unsupported_1(self):
+        self.assertRaises(ValueError, LocalFormat, '@brief')
+        self.assertRaises(ValueError, LocalFormat, 'mfn')
+        self.assertRaises(ValueError, LocalFormat, '((v200))')
+        self.assertRaises(ValueError, LocalFormat, 'v200^a" : "v200^e')
+        self.assertIsNone(local_format('v200^a*5'))
+        self.assertIsNotNone(local_format('!v200^a'))
+
+    def test_projection_1(self):
+        script = projection_format([910, 200, 910])
+        self.assertEqual(script.prepared,
+                         "mpl,(if p(v200) then '200#',v200,# fi),"
+                         "(if p(v910) then '910#',v910,# fi)")
+        text = LocalFormat(script.source).format_record(self.get_record())
+        self.assertEqual(text, '200#^aTitle^eSubtitle\r\n'
+                               '910#^a0^b1\r\n910#^a0^b2\r\n')
+
+    def test_projected_record_1(self):
+        connection = Connection()
+        record = connection._projected_record(
+            '123#200#^aTitle\x1F910#^a0^b1\x1F910#^a0^b2\x1F')
+        self.assertEqual(record.mfn, 123)
+        self.assertTrue(record.partial)
+        self.assertEqual(record.fm(200, 'a'), 'Title')
+        self.assertEqual(record.fma(910, 'b'), ['1', '2'])
+        self.assertTrue(record.clone().partial)
+        connection.connected = True
+        self.assertRaises(ValueError, connection.write_record, record)
+        self.assertRaises(ValueError, connection.write_records,
+                          [record, record])
+
+    def test_format_local_1(self):
+        connection = Connection()
+        self.assertEqual(connection.format_local('v200^a/',
+                                                 [self.get_record()]),
+                         ['Title'])
+
 #############################################################################
 
 